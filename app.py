@@ -1,5 +1,17 @@
-from flask import Flask, jsonify, request, render_template, flash, redirect, url_for # Added flash, redirect, url_for
+from flask import Flask, jsonify, request, render_template, flash, redirect, url_for, Response, stream_with_context # Added flash, redirect, url_for
 import database # Your existing database.py
+import importer
+import preview
+import search
+import field_index
+import facets
+import facet_search
+import table_data
+import upload_rows
+import jobs
+import outbox
+import webhook_export
+import webhook_sync
 import os # For potential API key access
 from functools import wraps # For API key decorator if used later
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
@@ -17,6 +29,9 @@ app.config['SESSION_COOKIE_SECURE'] = False # Set to True if using HTTPS (recomm
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax' # Or 'Strict'
 
+# One pooled database connection per request, returned to the pool on teardown
+database.init_app(app)
+
 # --- Flask-Login Configuration ---
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -162,19 +177,9 @@ def prepare_follow_up():
     try:
         conn = database.get_db_connection()
 
-        placeholders = ','.join('?' for _ in upload_ids)
-
-        query1 = f"SELECT DISTINCT outletName FROM journalists WHERE upload_id IN ({placeholders})"
-        query2 = f"SELECT DISTINCT outletName FROM media_titles WHERE upload_id IN ({placeholders})"
-
-        outlets1 = conn.execute(query1, upload_ids).fetchall()
-        outlets2 = conn.execute(query2, upload_ids).fetchall()
-
+        outlets = facets.facet_counts(conn, 'outletName', upload_ids)
         conn.close()
 
-        unique_outlets = set(row['outletName'] for row in outlets1 if row['outletName'])
-        unique_outlets.update(row['outletName'] for row in outlets2 if row['outletName'])
-
         # Build the redirect URL
         redirect_url = url_for(
             'outreach_follow_up',
@@ -182,7 +187,7 @@ def prepare_follow_up():
             staff_id=staff_id,
             subject=subject,
             # Pass outlets as multiple query parameters
-            **{'outlets': list(unique_outlets)}
+            **{'outlets': [value for value, count in outlets]}
         )
 
         return jsonify({'redirect_url': redirect_url})
@@ -317,7 +322,6 @@ import PyPDF2
 from werkzeug.utils import secure_filename
 import base64
 import mammoth
-from fuzzywuzzy import process
 
 def extract_text_from_docx(file_stream):
     doc = docx.Document(file_stream)
@@ -342,7 +346,9 @@ def extract_text_from_pdf(file_stream):
 @login_required
 def csv_preview():
     """
-    Accepts a CSV file and returns its headers for mapping.
+    Accepts a CSV file and returns its headers for mapping, the first rows, a sample
+    of later rows, per-column statistics and a suggested mapping onto target_table.
+    Only the first PREVIEW_SCAN_ROWS records are read.
     """
     if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
@@ -351,17 +357,21 @@ def csv_preview():
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
 
+    target_table = request.form.get('target_table', 'journalists')
+    if target_table not in importer.CONTACT_TABLES:
+        return jsonify({"error": "Invalid target table specified."}), 400
+    first_rows = min(request.form.get('rows', preview.PREVIEW_FIRST_ROWS, type=int), preview.PREVIEW_MAX_FIRST_ROWS)
+
     if file and file.filename.lower().endswith('.csv'):
         try:
-            # Read the first line of the file to get headers
+            conn = database.get_db_connection()
+            db_columns = importer.mappable_columns(conn, target_table)
+            conn.close()
             # We use io.TextIOWrapper to decode the file stream as text
-            stream = io.TextIOWrapper(file.stream, encoding='utf-8')
-            reader = csv.reader(stream)
-            headers = next(reader)
-            # Optional: Basic sanitization of headers
-            headers = [header.strip() for header in headers]
-            return jsonify({"headers": headers}), 200
-        except (csv.Error, StopIteration):
+            stream = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
+            result = preview.preview_csv(stream, db_columns, first_rows=max(first_rows, 0))
+            return jsonify(dict(result, target_table=target_table)), 200
+        except (csv.Error, StopIteration, UnicodeDecodeError):
             return jsonify({"error": "Could not read headers from CSV file. It might be empty or malformed."}), 400
         except Exception as e:
             print(f"Error in CSV preview: {e}")
@@ -369,101 +379,141 @@ def csv_preview():
 
     return jsonify({"error": "Invalid file type. Please upload a .csv file."}), 400
 
-@app.route('/api/import/run', methods=['POST'])
-@login_required
-def csv_run_import():
+def parse_import_request():
     """
-    Accepts a CSV file, a target table name, and a column mapping,
-    then imports the data into the specified table.
+    Validates the multipart form shared by the import endpoints.
+    Returns (params, None) on success or (None, error_response).
     """
     # --- 1. Validate Request ---
     if 'file' not in request.files:
-        return jsonify({"error": "No file part in the request"}), 400
+        return None, (jsonify({"error": "No file part in the request"}), 400)
     if 'target_table' not in request.form:
-        return jsonify({"error": "No target_table specified"}), 400
+        return None, (jsonify({"error": "No target_table specified"}), 400)
     if 'column_mapping' not in request.form:
-        return jsonify({"error": "No column_mapping provided"}), 400
+        return None, (jsonify({"error": "No column_mapping provided"}), 400)
     if 'upload_name' not in request.form or not request.form.get('upload_name'):
-        return jsonify({"error": "Upload name is required"}), 400
+        return None, (jsonify({"error": "Upload name is required"}), 400)
 
     file = request.files['file']
     target_table = request.form.get('target_table')
-    upload_name = request.form.get('upload_name')
 
     try:
         column_mapping = json.loads(request.form.get('column_mapping'))
     except json.JSONDecodeError:
-        return jsonify({"error": "Invalid JSON in column_mapping"}), 400
+        return None, (jsonify({"error": "Invalid JSON in column_mapping"}), 400)
 
     # --- 2. Check for valid file and target table ---
     if file.filename == '':
-        return jsonify({"error": "No file selected"}), 400
-    if target_table not in ['journalists', 'media_titles']:
-        return jsonify({"error": "Invalid target table specified."}), 400
+        return None, (jsonify({"error": "No file selected"}), 400)
+    if target_table not in importer.CONTACT_TABLES:
+        return None, (jsonify({"error": "Invalid target table specified."}), 400)
     if not file.filename.lower().endswith('.csv'):
-        return jsonify({"error": "Invalid file type. Please upload a .csv file."}), 400
-
-    # --- 3. Process the import ---
-    conn = database.get_db_connection()
-    cursor = conn.cursor()
+        return None, (jsonify({"error": "Invalid file type. Please upload a .csv file."}), 400)
 
+    # --- 3. Check the duplicate handling ---
+    import_mode = request.form.get('import_mode') or 'insert'
     try:
-        # Create a new upload record
-        cursor.execute("INSERT INTO uploads (name) VALUES (?)", (upload_name,))
-        upload_id = cursor.lastrowid
-
-        stream = io.TextIOWrapper(file.stream, encoding='utf-8')
-        reader = csv.reader(stream)
-
-        # Get CSV headers and build an index map for quick lookup
-        csv_headers = next(reader)
-        header_index_map = {header: i for i, header in enumerate(csv_headers)}
-
-        # Filter mapping to only include columns present in the uploaded CSV
-        valid_mapping = {
-            csv_col: db_col
-            for csv_col, db_col in column_mapping.items()
-            if csv_col in header_index_map and db_col # Ensure db_col is not empty/null
-        }
+        importer.check_import_options(target_table, import_mode)
+    except importer.ImportMappingError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    if import_mode != 'insert' and 'Email' not in column_mapping.values():
+        return None, (jsonify({"error": "Map a column to Email to update or skip existing contacts."}), 400)
+
+    return {
+        "file": file,
+        "target_table": target_table,
+        "upload_name": request.form.get('upload_name'),
+        "column_mapping": column_mapping,
+        "chunk_size": request.form.get('chunk_size', type=int),
+        "import_mode": import_mode,
+    }, None
 
-        if not valid_mapping:
-            return jsonify({"error": "Column mapping is empty or does not match any headers in the CSV file."}), 400
-
-        db_columns = ['upload_id'] + list(valid_mapping.values())
-        placeholders = ', '.join(['?'] * len(db_columns))
-        sql = f"INSERT INTO {target_table} ({', '.join(db_columns)}) VALUES ({placeholders})"
-
-        imported_count = 0
-        for row in reader:
-            # Build the tuple of values in the correct order for the SQL statement
-            values_to_insert = [upload_id]
-            for csv_col in valid_mapping.keys():
-                col_index = header_index_map[csv_col]
-                values_to_insert.append(row[col_index])
-
-            cursor.execute(sql, tuple(values_to_insert))
-            imported_count += 1
+@app.route('/api/import/run', methods=['POST'])
+@login_required
+def csv_run_import():
+    """
+    Accepts a CSV file, a target table name, and a column mapping,
+    then imports the data into the specified table within this request.
+    The optional import_mode (insert, update or skip) decides what happens to
+    rows whose email already exists in the table.
+    Large files should use /api/import/jobs instead.
+    """
+    params, error_response = parse_import_request()
+    if error_response:
+        return error_response
 
-        conn.commit()
-        return jsonify({
-            "message": f"Import successful. {imported_count} rows imported into '{target_table}' as part of upload '{upload_name}'.",
-            "imported_rows": imported_count
-        }), 200
+    # --- 4. Process the import ---
+    conn = database.get_db_connection()
 
+    try:
+        stream = io.TextIOWrapper(params['file'].stream, encoding='utf-8')
+        stats = importer.import_csv(conn, stream, params['target_table'], params['upload_name'],
+                                    params['column_mapping'], chunk_size=params['chunk_size'],
+                                    import_mode=params['import_mode'])
+        print(f"Imported {stats['imported_rows']} rows into {params['target_table']} at {stats['rows_per_second']} rows/s")
+        return jsonify(dict(stats, message=importer.summary_message(stats, params['upload_name']))), 200
+
+    except importer.ImportMappingError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        conn.rollback() # Rollback on any error during the transaction
         print(f"Error during CSV import run: {e}")
         return jsonify({"error": f"An error occurred during the import: {e}"}), 500
     finally:
         conn.close()
 
+@app.route('/api/import/jobs', methods=['POST'])
+@login_required
+def create_import_job():
+    """
+    Accepts the same form as /api/import/run, spools the file to disk and runs the
+    import in the background. Poll the returned status_url for progress.
+    """
+    params, error_response = parse_import_request()
+    if error_response:
+        return error_response
+
+    try:
+        job_id = jobs.submit_import_job(
+            params['file'], params['target_table'], params['upload_name'], params['column_mapping'],
+            chunk_size=params['chunk_size'], import_mode=params['import_mode'], created_by=current_user.id
+        )
+    except Exception as e:
+        print(f"Error queueing import job: {e}")
+        return jsonify({"error": "An error occurred while queueing the import."}), 500
+
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for('get_import_job', job_id=job_id)
+    }), 202
+
+@app.route('/api/import/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_import_job(job_id):
+    """Returns the status and progress of an import job."""
+    job = jobs.get_import_job(job_id)
+    if job is None:
+        return jsonify({"error": "Import job not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/api/import/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_import_job(job_id):
+    """Cancels a queued or running import job; rows it already imported are removed."""
+    if not jobs.cancel_import_job(job_id):
+        job = jobs.get_import_job(job_id)
+        if job is None:
+            return jsonify({"error": "Import job not found"}), 404
+        return jsonify({"error": f"Import job has already {job['status']}."}), 409
+    return jsonify(jobs.get_import_job(job_id)), 200
+
 # --- Email Template API Endpoints ---
 @app.route('/api/uploads', methods=['GET'])
 @login_required
 def get_uploads():
     conn = database.get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM uploads ORDER BY created_at DESC")
+    cursor.execute("SELECT id, name FROM uploads WHERE deleted_at IS NULL ORDER BY created_at DESC")
     uploads = cursor.fetchall()
     conn.close()
     return jsonify([dict(row) for row in uploads])
@@ -717,16 +767,10 @@ def get_table_schema(table_name):
 
     try:
         conn = database.get_db_connection()
-        cursor = conn.cursor()
-        # Pragma table_info is a safe way to get schema info
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        schema_info = cursor.fetchall()
+        # Pragma table_info is a safe way to get schema info; key, timestamp and derived fields are left out
+        column_names = importer.mappable_columns(conn, table_name)
         conn.close()
 
-        # Extract column names, ignoring primary key and timestamp fields
-        excluded_columns = ['id', 'created_at', 'updated_at']
-        column_names = [row['name'] for row in schema_info if row['name'] not in excluded_columns]
-
         return jsonify({"table": table_name, "columns": column_names}), 200
     except Exception as e:
         print(f"Error fetching schema for table {table_name}: {e}")
@@ -736,28 +780,54 @@ def get_table_schema(table_name):
 @login_required
 def get_table_data(table_name):
     """
-    Fetches paginated data from a specified table.
-    For now, fetches all data. Pagination can be added later.
+    Rows of a table in id order, optionally only the comma-separated `columns`.
+    Without limit, the whole table as a JSON array, streamed in batches. With limit
+    (and after, the previous page's nextAfter), one page: {"rows", "nextAfter"},
+    nextAfter being null on the last page. format=ndjson streams one JSON object per
+    line instead, from after and up to limit rows when they are given.
     """
-    if table_name not in ['journalists', 'media_titles', 'companies', 'uploads']:
+    if table_name not in table_data.TABLES:
         return jsonify({"error": "Invalid table name specified"}), 400
 
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after', type=int)
+    ndjson = request.args.get('format') == 'ndjson'
+    if limit is not None:
+        limit = min(max(limit, 1), table_data.MAX_PAGE_SIZE)
+
     try:
         conn = database.get_db_connection()
-        # Using a safe way to format table name - ensure it's in the allow-list
-        query = f"SELECT * FROM {table_name}" # Not safe for user input, but safe here due to check above
-        cursor = conn.cursor()
-        cursor.execute(query)
-        data = cursor.fetchall()
-        conn.close()
-
-        # Convert list of Row objects to list of dictionaries
-        data_list = [dict(row) for row in data]
-        return jsonify(data_list), 200
+        columns = table_data.parse_columns(conn, table_name, request.args.get('columns', ''))
+        if limit is not None and not ndjson:
+            rows, next_after = table_data.read_page(conn, table_name, columns, after, limit)
+            conn.close()
+            return jsonify({"rows": rows, "nextAfter": next_after}), 200
+        database.close_request_connection() # The stream checks one out per batch instead
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error fetching data for table {table_name}: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
 
+    def generate():
+        separator = '' if ndjson else '['
+        try:
+            for batch in table_data.pooled_row_batches(database.get_pool(), table_name, columns, after, limit):
+                if ndjson:
+                    yield ''.join(app.json.dumps(row) + '\n' for row in batch)
+                else:
+                    yield separator + ','.join(app.json.dumps(row) for row in batch)
+                    separator = ','
+        except Exception as e:
+            # Too late for an error status: the client sees a truncated body
+            print(f"Error streaming table {table_name}: {e}")
+            return
+        if not ndjson:
+            yield ']' if separator == ',' else '[]'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 
 # --- Staff API Endpoints ---
 
@@ -765,20 +835,17 @@ def get_table_data(table_name):
 @login_required
 def get_outlet_names(table_name):
     """
-    Fetches a distinct list of outlet names from the specified table.
+    Fetches the outlet names in the specified table with their number of contacts:
+    [{"value", "count"}] in name order.
     """
-    if table_name not in ['journalists', 'media_titles']:
+    if table_name not in facets.CONTACT_TABLES:
         return jsonify({"error": "Invalid table name specified"}), 400
 
     try:
         conn = database.get_db_connection()
-        # Use a safe way to format table name
-        query = f"SELECT DISTINCT outletName FROM {table_name} WHERE outletName IS NOT NULL AND outletName != '' ORDER BY outletName"
-        outlets = conn.execute(query).fetchall()
+        outlets = facets.facet_counts(conn, 'outletName', table=table_name)
         conn.close()
-        # Extract just the name from the row object
-        outlet_names = [row['outletName'] for row in outlets]
-        return jsonify(outlet_names), 200
+        return jsonify(facets.as_json(outlets)), 200
     except Exception as e:
         print(f"Error fetching outlet names for table {table_name}: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
@@ -787,34 +854,15 @@ def get_outlet_names(table_name):
 @login_required
 def get_all_outlet_names():
     """
-    Fetches a distinct list of all outlet names from both journalists and media_titles tables.
-    Can be filtered by upload_id.
+    Fetches all outlet names from both journalists and media_titles tables with their
+    number of contacts: [{"value", "count"}] in name order. Can be filtered by upload_id.
     """
     upload_id = request.args.get('upload_id', type=int)
     try:
         conn = database.get_db_connection()
-        params = []
-
-        query_parts = []
-
-        base_query_j = "SELECT DISTINCT outletName FROM journalists WHERE outletName IS NOT NULL AND outletName != ''"
-        if upload_id:
-            base_query_j += " AND upload_id = ?"
-            params.append(upload_id)
-        query_parts.append(base_query_j)
-
-        base_query_m = "SELECT DISTINCT outletName FROM media_titles WHERE outletName IS NOT NULL AND outletName != ''"
-        if upload_id:
-            base_query_m += " AND upload_id = ?"
-            params.append(upload_id)
-        query_parts.append(base_query_m)
-
-        query = " UNION ".join(query_parts) + " ORDER BY outletName"
-
-        outlets = conn.execute(query, params).fetchall()
+        outlets = facets.facet_counts(conn, 'outletName', [upload_id] if upload_id else None)
         conn.close()
-        outlet_names = [row['outletName'] for row in outlets]
-        return jsonify(outlet_names), 200
+        return jsonify(facets.as_json(outlets)), 200
     except Exception as e:
         print(f"Error fetching all outlet names: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
@@ -823,36 +871,41 @@ def get_all_outlet_names():
 @login_required
 def get_all_cities():
     """
-    Fetches a distinct list of all cities from both journalists and media_titles tables.
-    Can be filtered by upload_id.
+    Fetches all cities from both journalists and media_titles tables with their
+    number of contacts: [{"value", "count"}] in name order. Can be filtered by upload_id.
     """
     upload_id = request.args.get('upload_id', type=int)
     try:
         conn = database.get_db_connection()
-        params = []
-
-        query_parts = []
-
-        base_query_j = "SELECT DISTINCT City FROM journalists WHERE City IS NOT NULL AND City != ''"
-        if upload_id:
-            base_query_j += " AND upload_id = ?"
-            params.append(upload_id)
-        query_parts.append(base_query_j)
+        cities = facets.facet_counts(conn, 'City', [upload_id] if upload_id else None)
+        conn.close()
+        return jsonify(facets.as_json(cities)), 200
+    except Exception as e:
+        print(f"Error fetching all cities: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
 
-        base_query_m = "SELECT DISTINCT City FROM media_titles WHERE City IS NOT NULL AND City != ''"
-        if upload_id:
-            base_query_m += " AND upload_id = ?"
-            params.append(upload_id)
-        query_parts.append(base_query_m)
+@app.route('/api/typeahead/<string:field>')
+@login_required
+def typeahead_field(field):
+    """
+    Completions for a prefix of an outlet or city, from an in-memory prefix index:
+    [{"value", "count"}], the values with the most contacts first. Can be filtered by upload_id.
+    """
+    prefix = request.args.get('q', '')
+    upload_id = request.args.get('upload_id', type=int)
+    limit = request.args.get('limit', field_index.TYPEAHEAD_LIMIT, type=int)
 
-        query = " UNION ".join(query_parts) + " ORDER BY City"
+    if field not in field_index.SEARCH_FIELDS:
+        return jsonify({"error": "Invalid search field specified"}), 400
+    limit = min(max(limit, 1), field_index.TYPEAHEAD_MAX_LIMIT)
 
-        cities = conn.execute(query, params).fetchall()
+    try:
+        conn = database.get_db_connection()
+        completions = field_index.complete_values(conn, field, prefix, upload_id, limit)
         conn.close()
-        city_names = [row['City'] for row in cities]
-        return jsonify(city_names), 200
+        return jsonify([{"value": value, "count": count} for value, count in completions])
     except Exception as e:
-        print(f"Error fetching all cities: {e}")
+        print(f"Error completing field {field}: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
 
 @app.route('/api/search/<string:field>')
@@ -864,41 +917,16 @@ def search_field(field):
     if not query_str:
         return jsonify([])
 
-    if field not in ['outletName', 'City']:
+    if field not in field_index.SEARCH_FIELDS:
         return jsonify({"error": "Invalid search field specified"}), 400
 
     try:
+        # Candidates come from an in-memory trigram index of the field's distinct values
+        # (kept current per upload_id); they are scored with fuzzywuzzy as before
         conn = database.get_db_connection()
-        params = []
-
-        query_parts = []
-
-        base_query_j = f"SELECT DISTINCT {field} FROM journalists WHERE {field} IS NOT NULL AND {field} != ''"
-        if upload_id:
-            base_query_j += " AND upload_id = ?"
-            params.append(upload_id)
-        query_parts.append(base_query_j)
-
-        base_query_m = f"SELECT DISTINCT {field} FROM media_titles WHERE {field} IS NOT NULL AND {field} != ''"
-        if upload_id:
-            base_query_m += " AND upload_id = ?"
-            params.append(upload_id)
-        query_parts.append(base_query_m)
-
-        full_query = " UNION ".join(query_parts)
-
-        all_values = conn.execute(full_query, params).fetchall()
+        matches = field_index.search_values(conn, field, query_str, upload_id)
         conn.close()
-
-        all_names = [row[field] for row in all_values]
-
-        # Use fuzzywuzzy to find the best matches
-        matches = process.extract(query_str, all_names, limit=10)
-        # Filter out low-score matches
-        matches = [match for match in matches if match[1] >= 80]
-
-        # Return a list of the matching names
-        return jsonify([match[0] for match in matches])
+        return jsonify(matches)
 
     except Exception as e:
         print(f"Error searching field {field}: {e}")
@@ -969,27 +997,53 @@ def delete_staff(staff_id):
 @login_required
 def send_all_to_webhook():
     """
-    Fetches all data from journalists and media_titles tables and sends it to a webhook.
+    Queues all data from the journalists and media_titles tables for the webhook.
+    By default it goes as numbered parts of chunk_size rows (query parameter) with a
+    manifest each; chunk_size=0 sends one payload with every row. The outbox worker
+    delivers them, with retries, after the response.
     """
+    try:
+        chunk_size = int(request.args.get('chunk_size', webhook_export.CHUNK_ROWS))
+        if not 0 <= chunk_size <= webhook_export.MAX_CHUNK_ROWS:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"chunk_size must be an integer from 0 to {webhook_export.MAX_CHUNK_ROWS}."}), 400
+
     try:
         conn = database.get_db_connection()
-        journalists = conn.execute('SELECT * FROM journalists').fetchall()
-        media_titles = conn.execute('SELECT * FROM media_titles').fetchall()
-        conn.close()
+        if chunk_size:
+            export = webhook_export.queue_export(conn, chunk_size, request.headers.get('Idempotency-Key'))
+            conn.close()
+            outbox.notify()
+            message = (f"All data queued for the webhook in {export['parts']} parts." if export['queued']
+                       else "This data is already queued for the webhook.")
+            return jsonify({
+                "message": message,
+                **export,
+                "sent_journalists": export['rows']['journalists'],
+                "sent_media_titles": export['rows']['media_titles']
+            }), 202
+
+        journalists = conn.execute(f'SELECT * FROM journalists WHERE {search.VISIBLE_CONTACT}').fetchall()
+        media_titles = conn.execute(f'SELECT * FROM media_titles WHERE {search.VISIBLE_CONTACT}').fetchall()
 
         payload = {
             "journalists": [dict(row) for row in journalists],
             "media_titles": [dict(row) for row in media_titles]
         }
+        outbox_id, queued = outbox.enqueue(conn, payload, request.headers.get('Idempotency-Key'))
+        conn.commit()
+        conn.close()
+        outbox.notify()
 
-        if database.send_to_webhook(payload):
-            return jsonify({
-                "message": "Successfully sent all data to webhook.",
-                "sent_journalists": len(journalists),
-                "sent_media_titles": len(media_titles)
-            }), 200
-        else:
-            return jsonify({"error": "Failed to send data to webhook."}), 500
+        return jsonify({
+            "message": "All data queued for the webhook." if queued else "This data is already queued for the webhook.",
+            "outbox_id": outbox_id,
+            "queued": queued,
+            "status_url": url_for('get_webhook_outbox_entry', outbox_id=outbox_id),
+            "sent_journalists": len(journalists),
+            "sent_media_titles": len(media_titles)
+        }), 202
 
     except Exception as e:
         print(f"Error in send_all_to_webhook: {e}")
@@ -1022,37 +1076,103 @@ def send_targeted_outreach():
         conn = database.get_db_connection()
         # Create a string of placeholders for the IN clause
         placeholders = ', '.join(['?'] * len(outlet_names))
-        query = f"SELECT * FROM {target_table} WHERE outletName IN ({placeholders})"
+        query = f"SELECT * FROM {target_table} WHERE outletName IN ({placeholders}) AND {search.VISIBLE_CONTACT}"
 
         contacts = conn.execute(query, outlet_names).fetchall()
-        conn.close()
 
         # Structure the payload for the webhook
         payload = {
             "senders": staff_members, # Changed from sender_email
             "outreach_contacts": [dict(row) for row in contacts]
         }
+        outbox_id, queued = outbox.enqueue(conn, payload, request.headers.get('Idempotency-Key'))
+        conn.commit()
+        conn.close()
+        outbox.notify()
 
-        if database.send_to_webhook(payload):
-            return jsonify({
-                "message": f"Successfully sent data for {len(contacts)} contacts from {len(outlet_names)} selected outlets to webhook. Senders: {', '.join(s['staff_name'] for s in staff_members)}",
-                "sent_contacts_count": len(contacts)
-            }), 200
-        else:
-            return jsonify({"error": "Failed to send data to webhook."}), 500
+        action = "Queued" if queued else "Already queued"
+        return jsonify({
+            "message": f"{action} data for {len(contacts)} contacts from {len(outlet_names)} selected outlets for the webhook. Senders: {', '.join(s['staff_name'] for s in staff_members)}",
+            "outbox_id": outbox_id,
+            "queued": queued,
+            "status_url": url_for('get_webhook_outbox_entry', outbox_id=outbox_id),
+            "sent_contacts_count": len(contacts)
+        }), 202
 
     except Exception as e:
         print(f"Error in send_targeted_outreach: {e}")
         return jsonify({"error": "An internal server error occurred."}), 500
 
+@app.route('/api/webhook/sync', methods=['POST'])
+@login_required
+def sync_to_webhook():
+    """
+    Queues, for each webhook destination, only the contacts changed or deleted since
+    the last sync it acknowledged, in parts of chunk_size rows (query parameter).
+    A destination whose previous sync is still being delivered is skipped.
+    """
+    try:
+        chunk_size = int(request.args.get('chunk_size', webhook_export.CHUNK_ROWS))
+        if not 1 <= chunk_size <= webhook_export.MAX_CHUNK_ROWS:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"chunk_size must be an integer from 1 to {webhook_export.MAX_CHUNK_ROWS}."}), 400
+
+    try:
+        conn = database.get_db_connection()
+        syncs = [webhook_sync.queue_sync(conn, destination, chunk_size) for destination in database.WEBHOOK_URLS]
+        conn.close()
+        outbox.notify()
+        return jsonify({"destinations": syncs}), 202
+    except Exception as e:
+        print(f"Error in sync_to_webhook: {e}")
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+@app.route('/api/webhook/sync', methods=['GET'])
+@login_required
+def get_webhook_sync_state():
+    """Returns each webhook destination's acknowledged watermarks and whether a sync is in flight."""
+    conn = database.get_db_connection()
+    states = webhook_sync.get_states(conn, database.WEBHOOK_URLS)
+    conn.close()
+    return jsonify({"destinations": states}), 200
+
+@app.route('/api/webhook/outbox/<int:outbox_id>', methods=['GET'])
+@login_required
+def get_webhook_outbox_entry(outbox_id):
+    """Returns the delivery state of a queued webhook payload, per destination."""
+    conn = database.get_db_connection()
+    status = outbox.get_status(conn, outbox_id)
+    conn.close()
+    if status is None:
+        return jsonify({"error": "Outbox entry not found"}), 404
+    return jsonify(status), 200
 
-import re
 
 # --- Media Contacts API Endpoint ---
+def contact_to_dict(row):
+    return {
+        "id": f"{row['type']}_{row['id']}",
+        "contactName": (row['name'] or "").strip(),
+        "email": row['Email'].strip(),
+        "outletName": (row['outletName'] or "").strip(),
+        "categories": json.loads(row['categories'])
+    }
+
 @app.route('/api/media-contacts', methods=['GET'])
 @login_required
 def list_media_contacts():
+    """
+    Lists contacts with a valid email, filtered by the optional search term q.
+    Pages either by page/page_size (offset) or by passing the previous response's
+    nextCursor as cursor, which seeks straight to the next page however deep it is
+    and is not shifted by contacts added meanwhile. total is only computed for
+    offset pages and the first cursor page; it is cached until the contact data
+    changes. With total=estimate an upper bound is returned instead of counting,
+    unless the exact count is already cached (see totalIsEstimate).
+    """
     q = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
     try:
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 50))
@@ -1064,66 +1184,122 @@ def list_media_contacts():
     page_size = min(max(page_size, 1), 200)
     offset = (page - 1) * page_size
 
-    EMAIL_RE = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
+    # email_valid, name_sort and categories are computed when contacts are written (migration 7)
+    columns = ['id', 'name', 'name_sort', 'outletName', 'Email', 'categories', 'email_valid']
+
+    # With a search term only the contacts_fts matches are read, best (lowest bm25 rank) first
+    match = search.match_expression(q)
+    after = None
+    if cursor:
+        try:
+            after = search.decode_cursor(cursor, ranked=match is not None)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
 
     conn = database.get_db_connection()
 
-    base_query = """
+    contacts_sql, params = search.contacts_sql(columns, match)
+    base_query = f"""
     FROM (
-        SELECT id, name, outletName, Email, Focus, 'journalist' as type FROM journalists
-        UNION ALL
-        SELECT id, name, outletName, Email, Focus, 'media_title' as type FROM media_titles
+        {contacts_sql}
     ) AS contacts
-    WHERE Email IS NOT NULL AND Email != '' AND INSTR(Email, '@') > 1
+    WHERE email_valid = 1
     """
 
-    where_clauses = []
-    params = []
-
-    if q:
-        like_query = f"%{q}%"
-        where_clauses.append("(name LIKE ? OR outletName LIKE ? OR Email LIKE ?)")
-        params.extend([like_query, like_query, like_query])
-
-    count_query = "SELECT COUNT(*) as total " + base_query
-    if where_clauses:
-        count_query += " AND " + " AND ".join(where_clauses)
-
-    total_records = conn.execute(count_query, tuple(params)).fetchone()['total']
-
-    data_query = "SELECT id, name, outletName, Email, Focus, type " + base_query
-    if where_clauses:
-        data_query += " AND " + " AND ".join(where_clauses)
+    total_records = None
+    total_is_estimate = False
+    if not cursor:
+        generation = database.get_data_generation(conn)
+        key = search.count_key(q)
+        if request.args.get('total') == 'estimate' and search.peek_count(key, generation) is None:
+            total_records = search.estimate_count(conn, match)
+            total_is_estimate = True
+        else:
+            # Without a search the count comes from the (email_valid) indexes (migration 12)
+            count_query, count_params = search.count_sql(match)
+            total_records = search.cached_count(
+                key, generation, lambda: conn.execute(count_query, tuple(count_params)).fetchone()['total']
+            )
 
-    data_query += " ORDER BY name ASC LIMIT ? OFFSET ?"
-    params.extend([page_size, offset])
+    # One row more than the page tells us whether there is a next page
+    if match is not None:
+        data_query = f"SELECT {', '.join(columns)}, type, rank " + base_query
+        if after is not None:
+            data_query += " AND (rank, name_sort, type, id) > (?, ?, ?, ?)"
+            params.extend(after)
+        data_query += " ORDER BY rank, name_sort, type, id LIMIT ?"
+        params.append(page_size + 1)
+    elif cursor:
+        data_query, params = search.contacts_after_sql(columns, after, page_size + 1)
+    else:
+        data_query = f"SELECT {', '.join(columns)}, type " + base_query + " ORDER BY name_sort, type, id LIMIT ?"
+        params.append(page_size + 1)
+    if not cursor:
+        data_query += " OFFSET ?"
+        params.append(offset)
 
     items = conn.execute(data_query, tuple(params)).fetchall()
     conn.close()
 
-    def row_to_dict(row):
-        email = (row['Email'] or "").strip()
-        if not EMAIL_RE.match(email):
-            return None
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        if match is not None:
+            next_cursor = search.encode_cursor([last['rank'], last['name_sort'], last['type'], last['id']])
+        else:
+            next_cursor = search.encode_cursor([last['name_sort'], last['type'], last['id']])
 
-        categories = (row['Focus'] or "").split(',') if row['Focus'] else []
-        categories = [c.strip() for c in categories if c.strip()]
+    response = {
+        "items": [contact_to_dict(row) for row in items],
+        "pageSize": page_size,
+        "nextCursor": next_cursor
+    }
+    if not cursor:
+        response["page"] = page
+    if total_records is not None:
+        response["total"] = total_records
+        response["totalIsEstimate"] = total_is_estimate
+    return jsonify(response)
 
-        return {
-            "id": f"{row['type']}_{row['id']}",
-            "contactName": (row['name'] or "").strip(),
-            "email": email,
-            "outletName": (row['outletName'] or "").strip(),
-            "categories": categories
-        }
 
-    valid_items = [item for item in map(row_to_dict, items) if item is not None]
+@app.route('/api/media-contacts/search', methods=['GET'])
+@login_required
+def faceted_contact_search():
+    """
+    Contacts with a valid email narrowed by facet filters and the free text q. Each of
+    outletName, City, Country, MediaType, JobTitle and category can be given several
+    times; values of one facet are alternatives, different facets must all match.
+    Returns one page/page_size page (best text match first, otherwise by name), the
+    total, and for each facet its facet_limit values with the most contacts among
+    those passing the other filters, plus any selected values.
+    """
+    q = request.args.get('q', '').strip()
+    filters = {facet: [value for value in request.args.getlist(facet) if value]
+               for facet in facet_search.FACETS}
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', 50, type=int), 1), 200)
+    facet_limit = min(max(request.args.get('facet_limit', facet_search.FACET_LIMIT, type=int), 0),
+                      facet_search.MAX_FACET_LIMIT)
+
+    try:
+        conn = database.get_db_connection()
+        result = facet_search.search_contacts(conn, filters, q, (page - 1) * page_size, page_size, facet_limit,
+                                              columns=['id', 'name', 'outletName', 'Email', 'categories'])
+        conn.close()
+    except Exception as e:
+        print(f"Error in faceted contact search: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
 
     return jsonify({
-        "items": valid_items,
+        "items": [contact_to_dict(row) for row in result['rows']],
         "page": page,
         "pageSize": page_size,
-        "total": total_records
+        "total": result['total'],
+        "facets": {
+            facet: [{"value": value, "count": count, "selected": selected} for value, count, selected in values]
+            for facet, values in result['facets'].items()
+        }
     })
 
 
@@ -1139,41 +1315,65 @@ def upload_data(upload_id):
             return jsonify({"error": "New name is required"}), 400
 
         conn = database.get_db_connection()
-        conn.execute("UPDATE uploads SET name = ? WHERE id = ?", (new_name, upload_id))
+        cursor = conn.execute("UPDATE uploads SET name = ? WHERE id = ? AND deleted_at IS NULL", (new_name, upload_id))
         conn.commit()
         conn.close()
+        if cursor.rowcount == 0:
+            return jsonify({"error": "Upload not found"}), 404
         return jsonify({"message": "Upload name updated successfully"})
 
     if request.method == 'DELETE':
-        conn = database.get_db_connection()
-        conn.execute("DELETE FROM journalists WHERE upload_id = ?", (upload_id,))
-        conn.execute("DELETE FROM media_titles WHERE upload_id = ?", (upload_id,))
-        conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "Upload deleted successfully"})
+        # Hidden at once; the contacts are deleted in the background in short batches
+        if not jobs.delete_upload(upload_id):
+            return jsonify({"error": "Upload not found"}), 404
+        return jsonify({"message": "Upload deleted successfully"}), 202
 
-    # GET request logic
+    # GET request logic: one page of the upload's rows
     conn = database.get_db_connection()
 
-    upload = conn.execute("SELECT name FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+    upload = conn.execute("SELECT name FROM uploads WHERE id = ? AND deleted_at IS NULL", (upload_id,)).fetchone()
     if not upload:
         conn.close()
         return jsonify({"error": "Upload not found"}), 404
 
-    journalists = conn.execute("SELECT * FROM journalists WHERE upload_id = ?", (upload_id,)).fetchall()
-    media_titles = conn.execute("SELECT * FROM media_titles WHERE upload_id = ?", (upload_id,)).fetchall()
+    tables = upload_rows.upload_tables(conn, upload_id)
+    table_name = tables[0] if tables else 'media_titles'
+    columns = upload_rows.page_columns(conn, table_name)
 
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', upload_rows.PAGE_SIZE, type=int), 1), upload_rows.MAX_PAGE_SIZE)
+    sort = request.args.get('sort', 'id')
+    order = request.args.get('order', 'asc')
+    match = search.match_expression(request.args.get('q', ''))
+    if sort not in columns or order not in ('asc', 'desc'):
+        conn.close()
+        return jsonify({"error": "Invalid sort column or order"}), 400
+    try:
+        filters = upload_rows.parse_filters(request.args.getlist('filter'), columns)
+    except ValueError as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 400
+
+    records, total = [], 0
+    if tables:
+        records = upload_rows.read_page(conn, tables, columns, upload_id, filters, match, sort, order == 'desc', offset, limit)
+        if filters or match is not None or offset or len(records) == limit:
+            total = search.cached_count(
+                ('upload', upload_id, tuple(filters), match), database.get_data_generation(conn),
+                lambda: upload_rows.count_rows(conn, tables, upload_id, filters, match))
+        else:
+            total = len(records) # The whole upload fits on the first page
     conn.close()
 
-    records = [dict(row) for row in journalists] + [dict(row) for row in media_titles]
-
-    table_name = 'journalists' if journalists else 'media_titles'
-
     return jsonify({
         "upload_name": upload['name'],
         "records": records,
-        "table_name": table_name
+        "table_name": table_name,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "sort": sort,
+        "order": order,
     })
 
 @app.route('/api/search')
@@ -1183,28 +1383,21 @@ def search_uploads():
     if not query:
         return jsonify([])
 
-    conn = database.get_db_connection()
-
-    # Find matching upload_ids from journalists and media_titles tables
-    journalist_uploads = conn.execute(
-        "SELECT DISTINCT upload_id FROM journalists WHERE name LIKE ? OR outletName LIKE ? OR Email LIKE ?",
-        (f'%{query}%', f'%{query}%', f'%{query}%')
-    ).fetchall()
-
-    media_title_uploads = conn.execute(
-        "SELECT DISTINCT upload_id FROM media_titles WHERE name LIKE ? OR outletName LIKE ? OR Email LIKE ?",
-        (f'%{query}%', f'%{query}%', f'%{query}%')
-    ).fetchall()
-
-    upload_ids = set([row['upload_id'] for row in journalist_uploads] + [row['upload_id'] for row in media_title_uploads])
-
-    if not upload_ids:
-        conn.close()
+    match = search.match_expression(query)
+    if match is None:
         return jsonify([])
 
-    # Fetch the upload details for the matching upload_ids
-    placeholders = ', '.join(['?'] * len(upload_ids))
-    uploads = conn.execute(f"SELECT * FROM uploads WHERE id IN ({placeholders})", list(upload_ids)).fetchall()
+    conn = database.get_db_connection()
+
+    # Uploads holding a matching contact, the one with the best match first
+    contacts_sql, params = search.contacts_sql(['upload_id'], match)
+    uploads = conn.execute(f"""
+        SELECT uploads.* FROM uploads
+        JOIN (SELECT upload_id, MIN(rank) AS best_rank FROM ({contacts_sql}) GROUP BY upload_id) AS matches
+            ON matches.upload_id = uploads.id
+        WHERE uploads.deleted_at IS NULL
+        ORDER BY matches.best_rank
+    """, params).fetchall()
     conn.close()
 
     return jsonify([dict(row) for row in uploads])
@@ -1348,4 +1541,5 @@ def delete_company_api(company_id): # Renamed
 
 if __name__ == '__main__':
     database.create_tables()
+    outbox.notify() # Resumes deliveries left pending by the last run
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,123 @@
+"""
+Benchmark: /api/media-contacts/search against the same filters and counts in plain SQL.
+
+For each size, a scratch database gets that many contacts with made-up outlets,
+cities, countries, media types, job titles and categories. It reports
+  - build:   building the in-memory facet index on first use
+  - append:  bringing it up to date after 1000 contacts are added
+  - indexed / sql: median milliseconds per query for facet_search.search_contacts()
+    (a page of 50 plus the counts of every facet) and for one SQL statement per
+    facet plus one for the page, with the same filters
+
+    python benchmarks/bench_faceted_search.py --sizes 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import facet_search
+import migrations
+
+CITIES = ['London', 'Leeds', 'Bristol', 'York', 'Bath', 'Oxford', 'Cambridge', 'Manchester', 'Glasgow', 'Cardiff']
+COUNTRIES = ['UK', 'IE', 'FR', 'DE', 'US']
+MEDIA_TYPES = ['Print', 'Online', 'Radio', 'TV', 'Podcast']
+CATEGORIES = ['Tech', 'Health', 'Sport', 'Finance', 'Travel', 'Food', 'Fashion', 'Motoring', 'Property', 'Arts']
+QUERIES = [
+    ('no filter', {}, None),
+    ('city', {'City': ['Leeds']}, None),
+    ('city+type', {'City': ['Leeds', 'York'], 'MediaType': ['Online']}, None),
+    ('outlet+category', {'outletName': ['Outlet 17'], 'category': ['Tech']}, None),
+    ('text+country', {'Country': ['UK']}, 'smith'),
+]
+
+def contacts(count, rng):
+    for i in range(count):
+        name = f"{rng.choice(['Alex', 'Sam', 'Jo', 'Chris', 'Pat'])} {rng.choice(['Smith', 'Jones', 'Brown', 'Taylor'])} {i}"
+        categories = rng.sample(CATEGORIES, rng.randint(0, 2))
+        yield (name, name.lower(), f"c{i}@example.com", 1, f"Outlet {int(rng.paretovariate(1.2)) % 5000}",
+               rng.choice(CITIES), rng.choice(COUNTRIES), rng.choice(MEDIA_TYPES), f"Title {rng.randrange(300)}",
+               ', '.join(categories), json.dumps(categories, separators=(',', ':')))
+
+def insert(conn, rows):
+    conn.executemany(
+        "INSERT INTO journalists (name, name_sort, Email, email_valid, outletName, City, Country, MediaType, JobTitle, "
+        "Focus, categories) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+def plain_sql(conn, filters, q):
+    """The same page and counts with one GROUP BY per facet."""
+    def where(skip=None):
+        conditions, params = ["email_valid = 1"], []
+        for facet, values in filters.items():
+            if facet == skip:
+                continue
+            if facet == 'category':
+                conditions.append(f"EXISTS (SELECT 1 FROM json_each(categories) WHERE value IN ({','.join('?' * len(values))}))")
+            else:
+                conditions.append(f"{facet} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        if q:
+            conditions.append("journalists.id IN (SELECT rowid >> 1 FROM contacts_fts WHERE contacts_fts MATCH ?)")
+            params.append(f'"{q}"*')
+        return ' AND '.join(conditions), params
+
+    condition, params = where()
+    conn.execute(f"SELECT * FROM journalists WHERE {condition} ORDER BY name_sort, id LIMIT 50", params).fetchall()
+    conn.execute(f"SELECT COUNT(*) FROM journalists WHERE {condition}", params).fetchone()
+    for facet in facet_search.FACETS:
+        condition, params = where(skip=facet)
+        if facet == 'category':
+            sql = (f"SELECT j.value, COUNT(*) FROM journalists, json_each(journalists.categories) j "
+                   f"WHERE {condition} GROUP BY j.value")
+        else:
+            sql = f"SELECT {facet}, COUNT(*) FROM journalists WHERE {condition} GROUP BY {facet}"
+        conn.execute(sql, params).fetchall()
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            rng = random.Random(args.seed)
+            database.close_pool()
+            database.DATABASE_NAME = os.path.join(directory, f"bench_{size}.db")
+            conn = database.get_db_connection()
+            migrations.migrate(conn, progress=None)
+            insert(conn, contacts(size, rng))
+            facet_search._index = None
+
+            _, build = timed(facet_search.get_index, conn)
+            insert(conn, contacts(1000, rng))
+            _, append = timed(facet_search.get_index, conn)
+            print(f"\n{size} contacts: build {build:.2f}s, append 1000 {append * 1000:.0f}ms")
+            print(f"{'query':>16}{'matches':>9}{'indexed ms':>12}{'sql ms':>9}")
+            for label, filters, q in QUERIES:
+                indexed, sql = [], []
+                for _ in range(args.repeat):
+                    result, elapsed = timed(facet_search.search_contacts, conn, filters, q)
+                    indexed.append(elapsed)
+                    sql.append(timed(plain_sql, conn, filters, q)[1])
+                print(f"{label:>16}{result['total']:>9}{statistics.median(indexed) * 1000:>12.1f}"
+                      f"{statistics.median(sql) * 1000:>9.1f}")
+            conn.close()
+        database.close_pool()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: /api/search/<field> lookups with the trigram index against a full fuzzywuzzy scan.
+
+For each size, a scratch database gets that many distinct outlet names (made-up
+combinations of common words, a city and a suffix, so many names share words).
+It reports
+  - build:   building the index on first use
+  - refresh: bringing it up to date after 100 contacts are added and 100 deleted
+  - full / indexed: median milliseconds per query for the old scan (DISTINCT query
+    plus process.extract over every value) and for field_index.search_values()
+  - same:    queries for which both return exactly the same list
+
+    python benchmarks/bench_fuzzy_search.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fuzzywuzzy import process
+
+import database
+import field_index
+import migrations
+
+CITIES = ['London', 'Leeds', 'Bristol', 'York', 'Bath', 'Oxford', 'Cambridge', 'Manchester', 'Glasgow', 'Cardiff']
+FIRST = ['Daily', 'Weekly', 'Morning', 'Evening', 'Sunday', 'National', 'Local', 'Tech', 'Business', 'Financial',
+         'Sports', 'Health', 'Home', 'Garden', 'Fashion', 'Travel', 'Food', 'Motor', 'Music', 'Property']
+SECOND = ['News', 'Times', 'Post', 'Herald', 'Gazette', 'Journal', 'Review', 'Chronicle', 'Telegraph', 'Mirror',
+          'Express', 'Star', 'Observer', 'Monitor', 'Digest', 'Magazine', 'Today', 'Insider', 'Report', 'Record']
+QUERIES = ['times', 'Daily News', 'dayli nwes', 'Leeds Herald', 'Manchester Evening News', 'gazete', 'tech insider', 'ny']
+
+def outlet_names(count, rng):
+    names = set()
+    while len(names) < count:
+        name = f"{rng.choice(FIRST)} {rng.choice(SECOND)}"
+        if rng.random() < 0.6:
+            name = f"{rng.choice(CITIES)} {name}"
+        if len(names) > 2000 or rng.random() < 0.3:
+            name += ' ' + ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 8)))
+        names.add(name)
+    return sorted(names)
+
+def typo(value, rng):
+    i = rng.randrange(len(value) - 1)
+    return value[:i] + value[i + 1] + value[i] + value[i + 2:]
+
+def fresh_database(directory, names):
+    database.close_pool()
+    database.DATABASE_NAME = os.path.join(directory, f"bench_{time.monotonic_ns()}.db")
+    conn = database.get_db_connection()
+    migrations.migrate(conn, progress=None)
+    conn.executemany("INSERT INTO media_titles (name, outletName) VALUES ('Bench', ?)", ((name,) for name in names))
+    conn.commit()
+    return conn
+
+def full_scan(conn, query):
+    # The implementation the index replaced
+    values = [row[0] for row in conn.execute(
+        "SELECT DISTINCT outletName FROM journalists WHERE outletName IS NOT NULL AND outletName != '' UNION "
+        "SELECT DISTINCT outletName FROM media_titles WHERE outletName IS NOT NULL AND outletName != ''")]
+    return [match[0] for match in process.extract(query, values, limit=10) if match[1] >= 80]
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=12, help="Queries per size (the fixed ones, then typos of stored names)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'values':>9}{'build s':>9}{'refresh s':>11}{'full ms':>10}{'indexed ms':>12}{'speedup':>9}{'same':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            rng = random.Random(args.seed)
+            names = outlet_names(size, rng)
+            queries = (QUERIES + [typo(rng.choice(names), rng) for _ in range(args.queries)])[:args.queries]
+            conn = fresh_database(directory, names)
+            field_index._indexes.clear()
+
+            _, build = timed(field_index.get_index, conn, 'outletName')
+            conn.execute("DELETE FROM media_titles WHERE id IN (SELECT id FROM media_titles ORDER BY random() LIMIT 100)")
+            conn.executemany("INSERT INTO media_titles (name, outletName) VALUES ('Bench', ?)",
+                             ((f"Added Outlet {i}",) for i in range(100)))
+            conn.commit()
+            _, refresh = timed(field_index.get_index, conn, 'outletName')
+
+            full_times, indexed_times, same = [], [], 0
+            for query in queries:
+                expected, elapsed = timed(full_scan, conn, query)
+                full_times.append(elapsed)
+                found, elapsed = timed(field_index.search_values, conn, 'outletName', query)
+                indexed_times.append(elapsed)
+                same += found == expected
+            conn.close()
+
+            full_ms = statistics.median(full_times) * 1000
+            indexed_ms = statistics.median(indexed_times) * 1000
+            print(f"{size:>9}{build:>9.2f}{refresh:>11.2f}{full_ms:>10.1f}{indexed_ms:>12.1f}"
+                  f"{full_ms / indexed_ms:>9.0f}{f'{same}/{len(queries)}':>7}")
+        database.close_pool()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: CSV ingest throughput against the number of parser processes.
+
+Generates a synthetic agency export (all journalist columns, some quoted
+multi-line fields) and, for each worker count, measures
+  - parse:  splitting, parsing and projecting only (no SQLite)
+  - import: the full import_csv_file_parallel() into a scratch database
+next to the serial import_csv() baseline.
+
+    python benchmarks/bench_parallel_import.py --rows 200000
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import importer
+import migrations
+
+COLUMNS = [
+    'name', 'nameSuffix', 'outletName', 'phone', 'ModeOfAddress', 'Honorific', 'JobTitle', 'MediaType',
+    'Email', 'AddressLine1', 'AddressLine2', 'City', 'County', 'State', 'PostalCode', 'Country',
+    'Twitter', 'Facebook', 'Instagram', 'Pinterest', 'YouTube', 'ShadowEmail', 'ShadowPhone',
+    'ShadowMobile', 'ShadowWebsite', 'ShadowFacebook', 'ShadowTwitter', 'ShadowLinkedIn',
+    'ShadowAddressLine1', 'ShadowAddressLine2', 'ShadowCity', 'ShadowCounty', 'ShadowPostalCode',
+    'ShadowCountry', 'Languages', 'Unsubscribed', 'Focus',
+]
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for i in range(rows):
+            row = [f"{col} value {i}" for col in COLUMNS]
+            row[COLUMNS.index('Email')] = f"contact{i}@outlet{i % 500}.example.com"
+            row[COLUMNS.index('AddressLine1')] = f"{i} High Street\nSuite {i % 40}" # Quoted newline
+            row[COLUMNS.index('Focus')] = "Technology, Startups, \"Venture\" Capital"
+            writer.writerow(row)
+
+def fresh_database(directory):
+    database.close_pool()
+    database.DATABASE_NAME = os.path.join(directory, f"bench_{time.monotonic_ns()}.db")
+    conn = database.get_db_connection()
+    migrations.migrate(conn, progress=None)
+    return conn
+
+def time_parse(path, workers, chunk_bytes):
+    mapping = {col: col for col in COLUMNS}
+    header_end = importer._first_record_end(path)
+    with open(path, encoding='utf-8', newline='') as f:
+        headers = next(csv.reader(f))
+    _, indexes = importer.build_projection(headers, mapping)
+    started = time.monotonic()
+    boundaries = importer.find_record_boundaries(path, header_end, chunk_bytes)
+    stats = importer.new_import_stats(None, 'journalists')
+    count = sum(1 for _ in importer._parallel_values(path, list(zip(boundaries, boundaries[1:])), indexes, workers, stats))
+    return count, time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-bytes', type=int, default=importer.PARALLEL_CHUNK_BYTES)
+    parser.add_argument('--workers', type=int, nargs='*', help="Worker counts to try (default: 1, 2, 4, ... up to the core count)")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, cores} | {2 ** i for i in range(1, 8) if 2 ** i < cores})
+    mapping = {col: col for col in COLUMNS}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'contacts.csv')
+        write_csv(path, args.rows)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"{args.rows} rows, {size_mb:.1f} MB, {cores} cores, {args.chunk_bytes} bytes per range\n")
+
+        conn = fresh_database(directory)
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as stream:
+            importer.import_csv(conn, stream, 'journalists', 'bench', mapping)
+        serial = time.monotonic() - started
+        conn.close()
+        print(f"{'mode':<22}{'seconds':>10}{'rows/s':>12}{'MB/s':>9}{'speedup':>9}")
+        print(f"{'serial import':<22}{serial:>10.2f}{args.rows / serial:>12.0f}{size_mb / serial:>9.1f}{1.0:>9.2f}")
+
+        parse_baseline = None
+        for workers in worker_counts:
+            count, elapsed = time_parse(path, workers, args.chunk_bytes)
+            assert count == args.rows
+            parse_baseline = parse_baseline or elapsed
+            print(f"{f'parse, {workers} workers':<22}{elapsed:>10.2f}{count / elapsed:>12.0f}{size_mb / elapsed:>9.1f}{parse_baseline / elapsed:>9.2f}")
+
+        for workers in worker_counts:
+            conn = fresh_database(directory)
+            started = time.monotonic()
+            importer.import_csv_file_parallel(conn, path, 'journalists', 'bench', mapping,
+                                              workers=workers, chunk_bytes=args.chunk_bytes)
+            elapsed = time.monotonic() - started
+            conn.close()
+            print(f"{f'import, {workers} workers':<22}{elapsed:>10.2f}{args.rows / elapsed:>12.0f}{size_mb / elapsed:>9.1f}{serial / elapsed:>9.2f}")
+        database.close_pool()
+
+if __name__ == '__main__':
+    main()
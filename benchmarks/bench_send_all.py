@@ -0,0 +1,76 @@
+"""
+Benchmark: peak memory of queueing /api/webhook/send_all.
+
+A scratch database gets --sizes journalists (and a tenth as many media titles), then
+the export is queued in the outbox as
+  - one payload: every row fetched, built into one dict and encoded (chunk_size=0)
+  - chunked:     webhook_export.queue_export() parts of --chunk rows
+Peak Python memory is measured with tracemalloc. Nothing is posted.
+
+    python benchmarks/bench_send_all.py --sizes 10000 50000 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import migrations
+import outbox
+import webhook_export
+
+def fill(conn, size):
+    conn.executemany(
+        "INSERT INTO journalists (name, Email, outletName, City, AddressLine1) VALUES (?, ?, ?, ?, ?)",
+        ((f"Contact {i}", f"c{i}@example.com", f"Outlet {i % 500}", f"City {i % 50}", f"{i} Long Street")
+         for i in range(size)))
+    conn.executemany("INSERT INTO media_titles (name, outletName) VALUES (?, ?)",
+                     ((f"Title {i}", f"Outlet {i % 500}") for i in range(size // 10)))
+    conn.commit()
+
+def one_payload(conn, chunk):
+    journalists = conn.execute('SELECT * FROM journalists').fetchall()
+    media_titles = conn.execute('SELECT * FROM media_titles').fetchall()
+    payload = {"journalists": [dict(row) for row in journalists], "media_titles": [dict(row) for row in media_titles]}
+    outbox.enqueue(conn, payload, destinations=['http://example.invalid/hook'])
+    conn.commit()
+
+def chunked(conn, chunk):
+    webhook_export.queue_export(conn, chunk, destinations=['http://example.invalid/hook'])
+
+def measure(send, size, chunk):
+    database.close_pool()
+    conn = database.get_db_connection()
+    migrations.migrate(conn, progress=None)
+    fill(conn, size)
+    tracemalloc.start()
+    started = time.perf_counter()
+    send(conn, chunk)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    largest = conn.execute("SELECT MAX(LENGTH(payload)) FROM webhook_outbox").fetchone()[0]
+    conn.close()
+    database.close_pool()
+    return elapsed, peak, largest
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--chunk', type=int, default=webhook_export.CHUNK_ROWS)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}{'mode':>12}{'seconds':>9}{'peak MB':>9}{'largest body MB':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            for label, send in (('one payload', one_payload), ('chunked', chunked)):
+                database.DATABASE_NAME = os.path.join(directory, f"{size}_{label.replace(' ', '_')}.db")
+                elapsed, peak, largest = measure(send, size, args.chunk)
+                print(f"{size:>8}{label:>12}{elapsed:>9.2f}{peak / 1e6:>9.1f}{largest / 1e6:>17.2f}")
+
+if __name__ == '__main__':
+    main()
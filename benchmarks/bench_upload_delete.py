@@ -0,0 +1,97 @@
+"""
+Benchmark: how long other writers stall while a large upload is deleted.
+
+A scratch database gets one upload of --size contacts. A second thread inserts one
+contact every few milliseconds into another upload and times each insert (its wait
+for the write lock included) while the upload is deleted
+  - at once:   the old DELETE ... WHERE upload_id = ? statements in one transaction
+  - batched:   importer.delete_upload_rows() in DELETE_BATCH transactions, then
+               database.incremental_vacuum()
+It reports the delete time, the median and worst insert latencies, and the file size
+before and after.
+
+    python benchmarks/bench_upload_delete.py --size 200000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import importer
+import migrations
+
+def fill(conn, size):
+    upload_id = conn.execute("INSERT INTO uploads (name) VALUES ('Big')").lastrowid
+    other_id = conn.execute("INSERT INTO uploads (name) VALUES ('Other')").lastrowid
+    conn.executemany(
+        "INSERT INTO journalists (name, Email, outletName, City, AddressLine1, upload_id) VALUES (?, ?, ?, ?, ?, ?)",
+        ((f"Contact {i}", f"c{i}@example.com", f"Outlet {i % 500}", f"City {i % 50}", f"{i} Long Street", upload_id)
+         for i in range(size)))
+    conn.commit()
+    return upload_id, other_id
+
+def delete_at_once(conn, upload_id):
+    for table in importer.CONTACT_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE upload_id = ?", (upload_id,))
+    conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+    conn.commit()
+
+def delete_batched(conn, upload_id):
+    importer.delete_upload_rows(conn, upload_id, pause=0.005)
+    database.incremental_vacuum(conn)
+
+def measure(delete, size):
+    database.close_pool()
+    conn = database.get_db_connection()
+    migrations.migrate(conn, progress=None)
+    upload_id, other_id = fill(conn, size)
+    size_before = os.path.getsize(database.DATABASE_NAME)
+
+    latencies, done = [], threading.Event()
+    def writer():
+        writer_conn = database.get_db_connection()
+        i = 0
+        while not done.is_set():
+            started = time.perf_counter()
+            writer_conn.execute("INSERT INTO journalists (name, Email, upload_id) VALUES (?, ?, ?)",
+                                (f"Writer {i}", f"w{i}@example.com", other_id))
+            writer_conn.commit()
+            latencies.append(time.perf_counter() - started)
+            i += 1
+            time.sleep(0.002)
+        writer_conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(0.1)
+    started = time.perf_counter()
+    delete(conn, upload_id)
+    elapsed = time.perf_counter() - started
+    done.set()
+    thread.join()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    database.close_pool()
+    return elapsed, latencies, size_before, os.path.getsize(database.DATABASE_NAME)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'delete':>8}{'seconds':>9}{'writes':>8}{'median ms':>11}{'max ms':>9}{'MB before':>11}{'MB after':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, delete in (('at once', delete_at_once), ('batched', delete_batched)):
+            database.DATABASE_NAME = os.path.join(directory, f"{label.replace(' ', '_')}.db")
+            elapsed, latencies, before, after = measure(delete, args.size)
+            print(f"{label:>8}{elapsed:>9.2f}{len(latencies):>8}{statistics.median(latencies) * 1000:>11.1f}"
+                  f"{max(latencies) * 1000:>9.1f}{before / 1e6:>11.1f}{after / 1e6:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: webhook request body bytes per payload profile.
+
+A scratch database gets --contacts journalists filled the way imports leave them:
+the common fields set, a few optional ones sometimes, the Shadow* and social
+columns mostly empty. Two payloads are built from SELECT * rows as the endpoints
+build them
+  - outreach: send_targeted_outreach's {"senders", "outreach_contacts"}
+  - send_all part: one webhook_export part of --chunk rows
+and posted to a local stand-in receiver under each profile. The receiver counts
+the bytes of each request body as it arrives (Content-Length).
+
+    python benchmarks/bench_webhook_payloads.py --contacts 2000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import migrations
+import webhook_export
+import webhooks
+
+OUTREACH_COLUMNS = ('name', 'Email', 'outletName', 'JobTitle', 'Honorific', 'City', 'Country', 'Focus', 'upload_id')
+PROFILES = [
+    ('full (before)', webhooks.FULL),
+    ('omit empty', webhooks.PayloadProfile(None, True, False)),
+    ('projection', webhooks.PayloadProfile(OUTREACH_COLUMNS, True, False)),
+    ('compact', webhooks.COMPACT),
+    ('projection + gzip', webhooks.PayloadProfile(OUTREACH_COLUMNS, True, True)),
+]
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.rfile.read(length)
+        self.server.sizes.append(length)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def fill(conn, count):
+    conn.execute("INSERT INTO uploads (name) VALUES ('Bench')")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(journalists)")
+               if row[1] not in migrations.UNTRACKED_COLUMNS and row[1] != 'upload_id']
+    rows = []
+    for i in range(count):
+        row = dict.fromkeys(columns, '') # Blank CSV cells arrive as empty strings
+        row.update(name=f"Contact {i}", Email=f"contact{i}@example.com", outletName=f"Outlet {i % 300}",
+                   JobTitle='Reporter' if i % 3 else 'Editor', MediaType='Online', City=f"City {i % 40}",
+                   Country='United Kingdom', Focus='Business, Technology', Honorific='Ms' if i % 2 else 'Mr')
+        if i % 4 == 0:
+            row.update(phone=f"020 7946 {i % 10000:04d}", Twitter=f"@contact{i}")
+        if i % 10 == 0:
+            row.update(AddressLine1=f"{i} High Street", PostalCode='EC1A 1BB', ShadowEmail=f"desk{i}@example.com")
+        rows.append(row)
+    conn.executemany(f"INSERT INTO journalists (upload_id, {', '.join(columns)}) VALUES (1, {', '.join('?' * len(columns))})",
+                     [tuple(row[col] for col in columns) for row in rows])
+    conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contacts', type=int, default=2000)
+    parser.add_argument('--chunk', type=int, default=webhook_export.CHUNK_ROWS)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    server.sizes = []
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/hook"
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.DATABASE_NAME = os.path.join(directory, 'bench.db')
+        conn = database.get_db_connection()
+        migrations.migrate(conn, progress=None)
+        fill(conn, args.contacts)
+        contacts = [dict(row) for row in conn.execute("SELECT * FROM journalists")]
+        outreach = json.dumps({
+            "senders": [{"staff_name": "Sam", "staff_email": "sam@example.com"}], "outreach_contacts": contacts})
+        part = webhook_export.encode_part('bench', 'journalists', 1, 1, contacts[:args.chunk])
+        conn.close()
+        database.close_pool()
+
+    print(f"{'profile':>18}{'outreach bytes':>16}{'ratio':>7}{'part bytes':>12}{'ratio':>7}")
+    baseline = None
+    for label, profile in PROFILES:
+        dispatcher = webhooks.WebhookDispatcher([url], profiles={url: profile})
+        server.sizes.clear()
+        for body in (outreach, part):
+            dispatcher.post(url, body)
+        dispatcher.close()
+        outreach_bytes, part_bytes = server.sizes
+        baseline = baseline or (outreach_bytes, part_bytes)
+        print(f"{label:>18}{outreach_bytes:>16,}{baseline[0] / outreach_bytes:>6.1f}x"
+              f"{part_bytes:>12,}{baseline[1] / part_bytes:>6.1f}x")
+    server.shutdown()
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
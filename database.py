@@ -1,179 +1,343 @@
+import os
 import sqlite3
+import threading
+import time
+
+from flask import g, has_app_context
+
+import migrations
 
 DATABASE_NAME = 'company_data.db'
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_NAME)
+# --- Storage Profiles ---
+# Named sets of pragmas applied to every connection when it is opened.
+# Select one with the DB_STORAGE_PROFILE environment variable (or the
+# DB_STORAGE_PROFILE Flask config key), and override single settings with
+# DB_AUTO_VACUUM, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_TEMP_STORE,
+# DB_BUSY_TIMEOUT and DB_OPTIMIZE_INTERVAL.
+STORAGE_PROFILES = {
+    # WAL lets readers keep serving while an import is writing.
+    'default': {
+        'auto_vacuum': 'incremental', # Deleted uploads' pages can be given back (incremental_vacuum)
+        'journal_mode': 'wal',
+        'synchronous': 'normal', # Safe with WAL; only the last commits can be lost on power failure
+        'cache_size': -16000, # Negative values are KiB, so 16 MB per connection
+        'mmap_size': 268435456, # 256 MB
+        'temp_store': 'memory',
+        'busy_timeout': 5000, # Milliseconds a writer waits for the lock instead of failing
+        'optimize_interval': 3600, # Seconds between PRAGMA optimize runs per pool
+    },
+    # Same as default, but every commit is fsynced.
+    'durable': {
+        'auto_vacuum': 'incremental',
+        'journal_mode': 'wal',
+        'synchronous': 'full',
+        'cache_size': -16000,
+        'mmap_size': 268435456,
+        'temp_store': 'memory',
+        'busy_timeout': 5000,
+        'optimize_interval': 3600,
+    },
+    # For machines that mostly run large imports: bigger caches, longer lock waits.
+    'bulk': {
+        'auto_vacuum': 'incremental',
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -131072,
+        'mmap_size': 1073741824,
+        'temp_store': 'memory',
+        'busy_timeout': 30000,
+        'optimize_interval': 3600,
+    },
+    # SQLite's own defaults, for comparison and troubleshooting.
+    'legacy': {
+        'auto_vacuum': 'none',
+        'journal_mode': 'delete',
+        'synchronous': 'full',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'default',
+        'busy_timeout': 5000,
+        'optimize_interval': 0,
+    },
+}
+
+# The order pragmas are applied in. auto_vacuum only takes effect on a database that has
+# not been written yet (otherwise it needs a VACUUM), so it goes before journal_mode, which may.
+# Databases created before it was set stay at 'none' until converted once, while the app is
+# stopped:
+#
+#     python database.py --enable-incremental-vacuum
+STORAGE_PRAGMAS = ['auto_vacuum', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout']
+
+def load_storage_profile(name=None, overrides=None):
+    """Builds the storage profile to use from its name, DB_* environment overrides and explicit overrides."""
+    name = name or os.environ.get('DB_STORAGE_PROFILE', 'default')
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile '{name}'. Choose one of: {', '.join(STORAGE_PROFILES)}")
+    profile = dict(STORAGE_PROFILES[name], name=name)
+    for key in STORAGE_PRAGMAS + ['optimize_interval']:
+        env_value = os.environ.get(f'DB_{key.upper()}')
+        if env_value is not None:
+            profile[key] = env_value
+    profile.update(overrides or {})
+    return profile
+
+def apply_storage_profile(conn, profile):
+    """Applies a storage profile's pragmas to an open connection."""
+    for pragma in STORAGE_PRAGMAS:
+        value = profile.get(pragma)
+        if value is not None:
+            # Pragma values cannot be bound as parameters; they come from our own config, not user input
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+STORAGE_PROFILE = load_storage_profile()
+
+def set_storage_profile(name=None, **overrides):
+    """Switches the active storage profile. Connections opened from now on use it."""
+    global STORAGE_PROFILE
+    STORAGE_PROFILE = load_storage_profile(name, overrides)
+    close_pool()
+    return STORAGE_PROFILE
+
+# --- Connection Pool ---
+# Connections are expensive to open relative to our queries (file open, schema
+# parse, cold page cache), so they are kept open and handed out from a pool.
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+STATEMENT_CACHE_SIZE = 256  # Large enough to keep every distinct query the app issues prepared
+CONNECT_HOOKS = []  # Callables run on every newly opened connection, e.g. query_audit's statement recorder
+
+
+def open_connection(database=None, profile=None, factory=sqlite3.Connection):
+    """
+    Opens a connection set up like the pooled ones (Row rows, the storage profile,
+    CONNECT_HOOKS). Outside the pool: for work that would otherwise hold a second
+    pooled connection, such as a long read next to the request's own. The caller closes it.
+    """
+    conn = sqlite3.connect(
+        database or DATABASE_NAME,
+        factory=factory,
+        check_same_thread=False, # Only ever used by one thread at a time, not necessarily the one that opened it
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row  # Allows accessing columns by name
+    apply_storage_profile(conn, profile or STORAGE_PROFILE)
+    for hook in CONNECT_HOOKS:
+        hook(conn)
     return conn
 
-def create_tables():
-    """Creates the necessary tables in the database if they don't already exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    # Create companies table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS companies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            url TEXT,
-            industry TEXT
-        )
-    ''')
-
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            email TEXT UNIQUE,
-            password_hash TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT TRUE,
-            is_admin BOOLEAN DEFAULT FALSE
-            -- Add other fields like created_at, last_login later if needed
-        )
-    ''')
-    # Consider adding an index on username and email for faster lookups
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
-
-    # --- New tables for Sway PR Data ---
-    # Uploads Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS uploads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    print("DEBUG: Attempting to create 'journalists' table...")
-    # Journalists Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS journalists (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            upload_id INTEGER,
-            name TEXT, nameSuffix TEXT, outletName TEXT, phone TEXT, ModeOfAddress TEXT,
-            Honorific TEXT, JobTitle TEXT, MediaType TEXT, Email TEXT, AddressLine1 TEXT,
-            AddressLine2 TEXT, City TEXT, County TEXT, State TEXT, PostalCode TEXT,
-            Country TEXT, Twitter TEXT, Facebook TEXT, Instagram TEXT, Pinterest TEXT,
-            YouTube TEXT, ShadowEmail TEXT, ShadowPhone TEXT, ShadowMobile TEXT,
-            ShadowWebsite TEXT, ShadowFacebook TEXT, ShadowTwitter TEXT, ShadowLinkedIn TEXT,
-            ShadowAddressLine1 TEXT, ShadowAddressLine2 TEXT, ShadowCity TEXT,
-            ShadowCounty TEXT, ShadowPostalCode TEXT, ShadowCountry TEXT,
-            Languages TEXT, Unsubscribed TEXT, Focus TEXT,
-            -- Note: nameSuffix, outletName, phone were duplicated in prompt, using camelCase version
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (upload_id) REFERENCES uploads (id)
-            -- Consider adding UNIQUE constraint on Email if it should be unique
-        )
-    ''')
-    print("DEBUG: 'journalists' table creation command executed.")
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_journalists_email ON journalists (Email)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_journalists_outletName ON journalists (outletName)')
-
-    print("DEBUG: Attempting to create 'media_titles' table...")
-    # Media Titles Table (identical structure to journalists)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS media_titles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            upload_id INTEGER,
-            name TEXT, nameSuffix TEXT, outletName TEXT, phone TEXT, ModeOfAddress TEXT,
-            Honorific TEXT, JobTitle TEXT, MediaType TEXT, Email TEXT, AddressLine1 TEXT,
-            AddressLine2 TEXT, City TEXT, County TEXT, State TEXT, PostalCode TEXT,
-            Country TEXT, Twitter TEXT, Facebook TEXT, Instagram TEXT, Pinterest TEXT,
-            YouTube TEXT, ShadowEmail TEXT, ShadowPhone TEXT, ShadowMobile TEXT,
-            ShadowWebsite TEXT, ShadowFacebook TEXT, ShadowTwitter TEXT, ShadowLinkedIn TEXT,
-            ShadowAddressLine1 TEXT, ShadowAddressLine2 TEXT, ShadowCity TEXT,
-            ShadowCounty TEXT, ShadowPostalCode TEXT, ShadowCountry TEXT,
-            Languages TEXT, Unsubscribed TEXT, Focus TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (upload_id) REFERENCES uploads (id)
-        )
-    ''')
-    print("DEBUG: 'media_titles' table creation command executed.")
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_titles_email ON media_titles (Email)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_titles_outletName ON media_titles (outletName)')
-
-    # Add upload_id column to journalists table if it doesn't exist
-    try:
-        cursor.execute("ALTER TABLE journalists ADD COLUMN upload_id INTEGER REFERENCES uploads(id)")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass # Column already exists
-        else:
-            raise
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within POOL_TIMEOUT."""
 
-    # Add upload_id column to media_titles table if it doesn't exist
-    try:
-        cursor.execute("ALTER TABLE media_titles ADD COLUMN upload_id INTEGER REFERENCES uploads(id)")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass # Column already exists
-        else:
-            raise
 
-    # Staff Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS staff (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            staff_name TEXT NOT NULL,
-            staff_email TEXT NOT NULL UNIQUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_staff_email ON staff (staff_email)')
-
-    # Press Releases Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS press_releases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            image BLOB
-        )
-    ''')
-
-    # Add html_content column if it doesn't exist
-    try:
-        cursor.execute("ALTER TABLE press_releases ADD COLUMN html_content TEXT")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass # Column already exists
+class PooledConnection(sqlite3.Connection):
+    """A sqlite3 connection whose close() hands it back to its pool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.checked_out = False
+        self.request_scoped = False
+
+    def close(self):
+        if self.request_scoped:
+            return # Released by close_request_connection() when the app context ends
+        if self.pool is not None:
+            self.pool.release(self)
         else:
+            super().close()
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of warm connections to a single database file."""
+
+    def __init__(self, database, max_size=POOL_SIZE, timeout=POOL_TIMEOUT, profile=None):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.profile = profile or STORAGE_PROFILE
+        self._last_optimize = time.monotonic()
+        self._idle = [] # Used as a stack so the most recently used (warmest) connection goes out first
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def _connect(self):
+        conn = open_connection(self.database, self.profile, factory=PooledConnection)
+        conn.pool = self
+        return conn
+
+    def _optimize_due(self):
+        interval = float(self.profile.get('optimize_interval') or 0)
+        if interval <= 0:
+            return False
+        with self._lock:
+            if time.monotonic() - self._last_optimize < interval:
+                return False
+            self._last_optimize = time.monotonic()
+        return True
+
+    def acquire(self):
+        """Checks a connection out of the pool, opening a new one if none are idle."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"No database connection became free within {self.timeout} seconds.")
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
             raise
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, discarding any uncommitted work."""
+        if not conn.checked_out:
+            return # Already released (e.g. close() called twice)
+        conn.checked_out = False
+        keep = not self._closed
+        try:
+            if conn.in_transaction:
+                conn.rollback() # Same outcome as closing a connection without committing
+            conn.row_factory = sqlite3.Row
+            if keep and self._optimize_due():
+                # Lets SQLite refresh planner statistics for tables whose shape has changed
+                conn.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            keep = False
+        if keep:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            sqlite3.Connection.close(conn)
+        self._slots.release()
+
+    def close(self):
+        """Closes all idle connections; checked-out ones are closed when released."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                if self.profile.get('optimize_interval'):
+                    conn.execute("PRAGMA optimize") # Recommended by SQLite before closing a long-lived connection
+            except sqlite3.Error as e:
+                print(f"PRAGMA optimize failed while closing the pool: {e}")
+            sqlite3.Connection.close(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the pool for the current DATABASE_NAME, replacing it if the name has changed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != DATABASE_NAME:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE_NAME)
+        return _pool
+
+def close_pool():
+    """Closes every idle pooled connection. Call before deleting or replacing the database file."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_db_connection():
+    """
+    Returns a pooled connection to the SQLite database.
+    Inside a Flask app context the same connection is shared for the whole request
+    and returned to the pool on teardown, so close() on it is a no-op.
+    Outside an app context (CLI, tests) close() returns it to the pool.
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = get_pool().acquire()
+            conn.request_scoped = True
+            g._db_conn = conn
+        return conn
+    return get_pool().acquire()
+
+def close_request_connection(exception=None):
+    """App-context teardown callback: hands the request's connection back to the pool."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.request_scoped = False
+        conn.close()
 
-    # Follow Up Emails Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS follow_up_emails (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            press_release_id INTEGER,
-            staff_id INTEGER,
-            name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            outlets TEXT,
-            FOREIGN KEY (press_release_id) REFERENCES press_releases (id),
-            FOREIGN KEY (staff_id) REFERENCES staff (id)
-        )
-    ''')
-
-    # Coverage Reports Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS coverage_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            link TEXT NOT NULL,
-            article TEXT NOT NULL,
-            date_of_publish TEXT NOT NULL
-        )
-    ''')
+def init_app(app):
+    """Registers the per-request connection teardown with a Flask app and applies its storage config."""
+    if app.config.get('DB_STORAGE_PROFILE') or app.config.get('DB_STORAGE_OVERRIDES'):
+        set_storage_profile(app.config.get('DB_STORAGE_PROFILE'), **app.config.get('DB_STORAGE_OVERRIDES', {}))
+    app.teardown_appcontext(close_request_connection)
 
+def create_tables():
+    """
+    Brings the database schema up to date by applying any pending migrations.
+    When the schema is already current this is a single PRAGMA user_version check.
+    """
+    conn = get_db_connection()
+    try:
+        return migrations.migrate(conn)
+    finally:
+        conn.close()
+
+def get_data_generation(conn):
+    """
+    Value that changes whenever journalists or media_titles change (triggers bump it),
+    so anything cached against it is known to be current. Unique to this database.
+    """
+    row = conn.execute("SELECT instance, generation FROM data_generation WHERE id = 1").fetchone()
+    return f"{row[0]}:{row[1]}"
+
+VACUUM_STEP_PAGES = 256 # Free pages returned per incremental_vacuum transaction
+
+def incremental_vacuum(conn, step_pages=VACUUM_STEP_PAGES):
+    """
+    Gives the database's free pages back to the filesystem, step_pages per short
+    transaction. Only possible with auto_vacuum = incremental (the storage profiles
+    set it on new databases; enable_incremental_vacuum() converts older ones).
+    Returns the number of pages freed.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2: # INCREMENTAL
+        if conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            print("Free pages are kept: run 'python database.py --enable-incremental-vacuum' once to give them back.")
+        return 0
     conn.commit()
-    conn.close()
-    print("Database tables (companies, users, journalists, media_titles, staff, press_releases, follow_up_emails, coverage_reports) checked/created successfully.")
+    start_pages = free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free_pages:
+        # execute() would step the pragma once, freeing a single page; executescript() runs it to the end.
+        # Pragma values cannot be bound as parameters; step_pages is an int.
+        conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+    return start_pages - free_pages
+
+def enable_incremental_vacuum():
+    """
+    One-off conversion of a database created without auto_vacuum. Rewrites the whole
+    file (VACUUM), so run it while the app is stopped: python database.py --enable-incremental-vacuum
+    """
+    conn = get_db_connection()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return True # Already converted; skip the rewrite
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
 
 def add_company(name, url, industry):
     """Adds a new company to the database."""
@@ -265,7 +429,17 @@ def delete_company(company_id):
 
 if __name__ == '__main__':
     # Basic test and setup when running database.py directly
+    import argparse
+    parser = argparse.ArgumentParser(description="Creates or migrates the database tables.")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="convert a database created without auto_vacuum, so deleted uploads' pages can be given back")
+    args = parser.parse_args()
     create_tables()
+    if args.enable_incremental_vacuum:
+        if enable_incremental_vacuum():
+            print(f"{DATABASE_NAME}: auto_vacuum is incremental.")
+        else:
+            print(f"{DATABASE_NAME}: could not enable incremental vacuum.")
 
     # Example usage (optional, for testing)
     # add_company("Test Co", "http://test.co", "Testing")
@@ -286,28 +460,32 @@ if __name__ == '__main__':
     #     print(dict(company))
 
 # --- Webhook Functionality ---
-import requests
-import json
+import webhooks
 
 # Webhook URLs for sending outreach data
 WEBHOOK_URLS = [
     "https://n8n-hosting-u2i6.onrender.com/webhook-test/35b675e5-7215-4d73-9331-3f1f4ec05e8b",
     "https://n8n-hosting-u2i6.onrender.com/webhook/35b675e5-7215-4d73-9331-3f1f4ec05e8b"
 ]
+# Seconds to wait for each destination; the others use webhooks.DEFAULT_TIMEOUT
+WEBHOOK_TIMEOUTS = {}
+# How each destination gets its payloads; the others get webhooks.FULL (the JSON as queued).
+# A destination opts into COMPACT (empty fields left out, gzipped body) by being listed in
+# WEBHOOK_COMPACT_URLS, comma-separated, once its workflow accepts that; a PayloadProfile with
+# columns added here sends only the fields a workflow reads.
+WEBHOOK_PROFILES = {url.strip(): webhooks.COMPACT
+                    for url in os.environ.get('WEBHOOK_COMPACT_URLS', '').split(',') if url.strip()}
+
+def get_webhook_dispatcher():
+    return webhooks.get_dispatcher(WEBHOOK_URLS, WEBHOOK_TIMEOUTS, WEBHOOK_PROFILES)
 
 def send_to_webhook(data_payload):
-    """Sends the given data payload to all configured webhooks."""
-    success_count = 0
-    for url in WEBHOOK_URLS:
-        try:
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(url, data=json.dumps(data_payload), headers=headers, timeout=10)
-            response.raise_for_status() # Raises an HTTPError for bad responses (4XX or 5XX)
-            print(f"Data successfully sent to webhook: {url}. Status: {response.status_code}")
-            success_count += 1
-        except requests.exceptions.RequestException as e:
-            print(f"Error sending data to webhook {url}: {e}")
-    return success_count
+    """Sends the given data payload to all configured webhooks at once. Returns how many accepted it."""
+    return webhooks.report(get_webhook_dispatcher().send(data_payload))
+
+def send_each_to_webhook(data_payloads):
+    """Sends every payload to all configured webhooks, all in parallel. Returns how many accepted each one."""
+    return [webhooks.report(results) for results in get_webhook_dispatcher().send_each(data_payloads)]
 
 def get_company_by_id(company_id):
     """Retrieves a single company by its ID."""
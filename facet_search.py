@@ -0,0 +1,258 @@
+"""
+Faceted contact search for /api/media-contacts/search.
+
+Contacts with a valid email are narrowed by any combination of outlet, city,
+country, media type, job title and Focus category filters plus free text. Each
+facet comes back with its values and the number of matching contacts for each.
+
+A ContactFacetIndex keeps, for every facet, two things. One is the value of each
+contact, in an array indexed by the contact's key (id * 2 + the table bit, as in
+contacts_fts). The other is a posting list of keys for each value. A filter is
+the union of the postings of its selected values, and the filters are
+intersected smallest first.
+
+A facet's counts are taken over the contacts passing every other filter, so they
+show what selecting another of its values would add. When no other filter
+applies, the counts are simply the posting lengths. Free text narrows through
+contacts_fts.
+
+Indexes live in memory in each process and are checked against the data
+generation (migration 6) on every use. While contacts have only been added, the
+index reads just the rows with higher ids. After an update or delete (migration
+10), or once an upload is hidden for deletion, it is rebuilt.
+"""
+import heapq
+import json
+import threading
+from array import array
+from collections import Counter
+from itertools import islice
+
+import database
+import search
+from migrations import CONTACT_FTS_TABLES
+
+FACETS = ('outletName', 'City', 'Country', 'MediaType', 'JobTitle', 'category')
+COLUMN_FACETS = FACETS[:-1] # Contact columns; categories come from the categories column (migration 7)
+FACET_LIMIT = 10
+MAX_FACET_LIMIT = 100
+SPARSE_SELECTION = 2000 # Selections up to this size are paged by sorting them, larger ones by walking the name index
+ID_BATCH = 500 # Ids per IN (...) lookup
+
+_index = None
+_index_lock = threading.Lock()
+
+def intersect(sets):
+    """Intersection of a list of sets, smallest first; None (no restriction) for an empty list."""
+    if not sets:
+        return None
+    smallest, *others = sorted(sets, key=len)
+    return smallest.intersection(*others) if others else smallest
+
+class ContactFacetIndex:
+    def __init__(self):
+        self.generation = None
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.rewrites = None # (instance, rewrites) the index was built at
+        self.max_ids = dict.fromkeys(CONTACT_FTS_TABLES, 0)
+        self.present = bytearray() # key -> 1 for an indexed contact
+        self.size = 0
+        self.values = {facet: [None] for facet in FACETS} # value id -> value; 0 is no value
+        self.value_ids = {facet: {} for facet in FACETS}
+        self.postings = {facet: [array('I')] for facet in FACETS} # value id -> keys
+        # key -> value id; for category, the id of the contact's set of categories
+        self.columns = {facet: array('I') for facet in FACETS}
+        self.category_sets = [()] # category set id -> category value ids
+        self.category_set_ids = {'[]': 0}
+
+    def __len__(self):
+        return self.size
+
+    def _value_id(self, facet, value):
+        value_ids = self.value_ids[facet]
+        value_id = value_ids.get(value)
+        if value_id is None:
+            value_id = value_ids[value] = len(self.values[facet])
+            self.values[facet].append(value)
+            self.postings[facet].append(array('I'))
+        return value_id
+
+    def _category_set_id(self, categories):
+        set_id = self.category_set_ids.get(categories)
+        if set_id is None:
+            value_ids = tuple(dict.fromkeys(self._value_id('category', c) for c in json.loads(categories)))
+            set_id = self.category_set_ids[categories] = len(self.category_sets)
+            self.category_sets.append(value_ids)
+        return set_id
+
+    def _grow(self, size):
+        grow = max(size, len(self.present) * 3 // 2) - len(self.present)
+        self.present.extend(bytes(grow))
+        for column in self.columns.values():
+            column.frombytes(bytes(grow * column.itemsize))
+
+    def add(self, table, rows):
+        """Indexes rows of (id, listed, categories, *COLUMN_FACETS) from table, in id order; unlisted rows are skipped."""
+        bit = CONTACT_FTS_TABLES[table]
+        columns = [(facet, self.columns[facet], self.value_ids[facet], self.postings[facet]) for facet in COLUMN_FACETS]
+        category_column, category_postings = self.columns['category'], self.postings['category']
+        for row in rows:
+            self.max_ids[table] = row[0]
+            if not row[1]:
+                continue
+            key = row[0] * 2 + bit
+            if key >= len(self.present):
+                self._grow(key + 1)
+            self.present[key] = 1
+            self.size += 1
+            for (facet, column, value_ids, postings), value in zip(columns, row[3:]):
+                if value:
+                    value_id = value_ids.get(value) or self._value_id(facet, value)
+                    column[key] = value_id
+                    postings[value_id].append(key)
+            set_id = self.category_set_ids.get(row[2])
+            if set_id is None:
+                set_id = self._category_set_id(row[2])
+            if set_id:
+                category_column[key] = set_id
+                for value_id in self.category_sets[set_id]:
+                    category_postings[value_id].append(key)
+
+    def refresh(self, conn):
+        rewrites = tuple(conn.execute("SELECT instance, rewrites FROM data_generation WHERE id = 1").fetchone())
+        if rewrites != self.rewrites:
+            self.clear() # Contacts were edited or deleted (or this is another database)
+            self.rewrites = rewrites
+        for table in CONTACT_FTS_TABLES:
+            self.add(table, conn.execute(
+                f"SELECT id, email_valid AND {search.VISIBLE_CONTACT}, categories, {', '.join(COLUMN_FACETS)} "
+                f"FROM {table} WHERE id > ? ORDER BY id",
+                (self.max_ids[table],)))
+
+    def filter_keys(self, facet, values):
+        """Keys of the contacts with any of values for facet."""
+        value_ids = self.value_ids[facet]
+        keys = set()
+        for value in values:
+            if value in value_ids:
+                keys.update(self.postings[facet][value_ids[value]])
+        return keys
+
+    def counts(self, facet, keys=None):
+        """{value: contacts} for facet over keys (None for every contact)."""
+        if keys is None:
+            counted = {value_id: len(posting) for value_id, posting in enumerate(self.postings[facet]) if posting}
+        else:
+            counted = Counter(map(self.columns[facet].__getitem__, keys))
+            if facet == 'category':
+                # Counted per set of categories, then added up per category
+                category_sets, by_set = self.category_sets, counted
+                counted = Counter()
+                for set_id, count in by_set.items():
+                    for value_id in category_sets[set_id]:
+                        counted[value_id] += count
+            counted.pop(0, None)
+        values = self.values[facet]
+        return {values[value_id]: count for value_id, count in counted.items()}
+
+    def query(self, filters, matches=None):
+        """
+        Applies {facet: values} filters and the keys matching the free text (None without
+        text). Returns (keys, counts): the keys passing everything, None when nothing
+        narrows the contacts, and {facet: {value: contacts}} over the contacts passing
+        every filter but the facet's own.
+        """
+        present = self.present
+        constraints = {facet: self.filter_keys(facet, values) for facet, values in filters.items() if values}
+        if matches is not None:
+            constraints[None] = {key for key in matches if key < len(present) and present[key]}
+        keys = intersect(list(constraints.values()))
+        counts = {}
+        for facet in FACETS:
+            if facet in constraints:
+                counts[facet] = self.counts(facet, intersect([c for f, c in constraints.items() if f != facet]))
+            else:
+                counts[facet] = self.counts(facet, keys)
+        return keys, counts
+
+def get_index(conn):
+    """The current ContactFacetIndex, built or brought up to date as needed."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ContactFacetIndex()
+        index = _index
+    generation = database.get_data_generation(conn)
+    with index.lock:
+        if index.generation != generation:
+            index.refresh(conn)
+            index.generation = generation
+    return index
+
+def contact_rows(conn, keys, columns):
+    """Rows of columns plus type and key for the contacts with the given keys, in no particular order."""
+    for table, bit in CONTACT_FTS_TABLES.items():
+        ids = [key >> 1 for key in keys if key & 1 == bit]
+        for start in range(0, len(ids), ID_BATCH):
+            batch = ids[start:start + ID_BATCH]
+            yield from conn.execute(
+                f"SELECT {', '.join(columns)}, '{search.CONTACT_TYPES[table]}' AS type, id * 2 + {bit} AS key "
+                f"FROM {table} WHERE id IN ({','.join('?' * len(batch))})", batch)
+
+def name_order(conn):
+    """Keys of every listed contact with a valid email in (name_sort, type, id) order, read lazily through the name indexes."""
+    cursors = [
+        conn.execute(f"SELECT IFNULL(name_sort, ''), '{search.CONTACT_TYPES[table]}', id * 2 + {bit} FROM {table} "
+                     f"WHERE email_valid = 1 AND {search.VISIBLE_CONTACT} ORDER BY name_sort, id")
+        for table, bit in CONTACT_FTS_TABLES.items()
+    ]
+    try:
+        for _, _, key in heapq.merge(*map(lambda cursor: map(tuple, cursor), cursors)):
+            yield key
+    finally:
+        for cursor in cursors:
+            cursor.close()
+
+def page_keys(conn, keys, ranks, offset, limit):
+    """Keys of one page of the selection: best text match (lowest rank) first, otherwise in name order."""
+    if ranks is not None:
+        return [key for _, key in heapq.nsmallest(offset + limit, ((ranks[key], key) for key in keys))][offset:]
+    if keys is not None and len(keys) <= SPARSE_SELECTION:
+        rows = contact_rows(conn, keys, ["IFNULL(name_sort, '')"])
+        ordered = (key for _, _, key in sorted(map(tuple, rows)))
+    else:
+        ordered = name_order(conn)
+        if keys is not None:
+            ordered = (key for key in ordered if key in keys)
+    return list(islice(ordered, offset, offset + limit))
+
+def search_contacts(conn, filters, q=None, offset=0, limit=50, facet_limit=FACET_LIMIT, columns=('*',)):
+    """
+    One page of `columns` (plus type and key) of the contacts passing the filters
+    ({facet: values}, values of one facet being alternatives) and matching the free
+    text q, and the facet_limit values of each facet with the most contacts.
+    Returns {"total", "rows", "facets": {facet: [(value, contacts, selected)]}}.
+    """
+    match = search.match_expression(q)
+    ranks = None
+    if match is not None:
+        # One read of the matches gives both the selection and its bm25 order
+        ranks = dict(map(tuple, conn.execute("SELECT rowid, rank FROM contacts_fts WHERE contacts_fts MATCH ?", (match,))))
+    index = get_index(conn)
+    with index.lock:
+        keys, counts = index.query(filters, ranks)
+        total = len(index) if keys is None else len(keys)
+
+    page = page_keys(conn, keys, ranks, offset, limit)
+    rows = {row['key']: row for row in contact_rows(conn, page, columns)}
+    facets = {}
+    for facet, value_counts in counts.items():
+        selected = set(filters.get(facet, ()))
+        top = heapq.nsmallest(facet_limit, value_counts.items(), key=lambda item: (-item[1], item[0]))
+        # Selected values stay listed, even outside the top or with no contacts left
+        facets[facet] = [(value, count, value in selected) for value, count in top] + [
+            (value, value_counts.get(value, 0), True) for value in sorted(selected.difference(dict(top)))]
+    return {"total": total, "rows": [rows[key] for key in page if key in rows], "facets": facets}
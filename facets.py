@@ -0,0 +1,36 @@
+"""
+Outlet and city lists with contact counts, read from contact_facets.
+
+contact_facets (migration 9) holds one row per (facet, upload, contact table, value)
+with the number of contacts having that value. Triggers on both contact tables keep
+it current as contacts are imported, edited and deleted, so listing the outlets of
+an upload reads a few hundred facet rows instead of every contact in it.
+"""
+from migrations import FACET_COLUMNS
+
+CONTACT_TABLES = ('journalists', 'media_titles')
+
+def facet_counts(conn, facet, upload_ids=None, table=None):
+    """
+    [(value, contacts)] in value order for a facet column, over both contact tables
+    or one, and over all uploads or the given list of upload ids. Uploads being
+    deleted are left out.
+    """
+    if facet not in FACET_COLUMNS:
+        raise ValueError(f"No facet counts for column {facet!r}")
+    conditions = ["facet = ?", "upload_id NOT IN (SELECT id FROM uploads WHERE deleted_at IS NOT NULL)"]
+    params = [facet]
+    if upload_ids is not None:
+        conditions.append(f"upload_id IN ({','.join('?' for _ in upload_ids)})")
+        params.extend(upload_ids)
+    if table is not None:
+        if table not in CONTACT_TABLES:
+            raise ValueError(f"Not a contact table: {table!r}")
+        conditions.append("contact_table = ?")
+        params.append(table)
+    sql = (f"SELECT value, SUM(contact_count) FROM contact_facets WHERE {' AND '.join(conditions)} "
+           "GROUP BY value ORDER BY value")
+    return [tuple(row) for row in conn.execute(sql, params)]
+
+def as_json(counts):
+    return [{"value": value, "count": count} for value, count in counts]
@@ -0,0 +1,333 @@
+"""
+Fuzzy lookup of outlet and city values for /api/search/<field>.
+
+Scoring every distinct value with fuzzywuzzy gets slow as the contact tables grow.
+A FieldIndex holds the distinct values of one field, for one upload or for all of
+them, with inverted indexes from trigrams and words to values. Only a few hundred
+candidates are scored: the values whose shared trigrams promise the best WRatio,
+values made of a run of the query's words or found whole inside the query (partial
+ratio 100), the first values sharing a whole word with it (WRatio ties those at 86),
+every value about as short as a short query and, for very short queries, values
+containing it. Scoring is the same process.extract / WRatio with the same MIN_SCORE
+cut-off, so those always rank as a full scan ranks them. A longer value holding a
+near copy of the query (one letter off) is only found if its trigrams rank it among
+the candidates, so among many such values scoring just over MIN_SCORE the last few
+results can differ (benchmarks/bench_fuzzy_search.py compares against a full scan).
+
+A PrefixIndex serves typeahead: every word start of every value, case-folded, in
+one sorted list, so the completions of a prefix are one bisect range, ranked by the
+number of contacts with that value.
+
+Indexes live in memory in each process and are checked against the data generation
+(migration 6) on every use. After an import or delete the values and their counts are read
+again from contact_facets and only the values that changed are re-indexed.
+"""
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from array import array
+from collections import Counter, OrderedDict
+from operator import itemgetter
+
+from fuzzywuzzy import process, utils
+
+import database
+import facets
+
+SEARCH_FIELDS = ('outletName', 'City')
+CANDIDATES = 300 # Values scored per query
+MIN_SCORE = 80
+COUNT_BUDGET = 500000 # Trigram postings counted per query, rarest trigrams first
+SHORT_QUERY = 3 # Queries shorter than this are also matched as substrings
+SHORT_VALUE = 4 # Values this short share too few trigrams to rank; a query of similar length scores them all
+MAX_LENGTH_RATIO = 8 # WRatio scores at most 60 when one string is more than this many times longer
+INDEX_CACHE_SIZE = 32
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+TYPEAHEAD_SCAN = 200 # Ranges longer than this have their top completions cached
+
+_indexes = OrderedDict() # (kind, field, upload_id) -> index, least recently used first
+_indexes_lock = threading.Lock()
+
+def _process(value):
+    # What WRatio compares: lower case ASCII letters and digits, anything else a space
+    return utils.full_process(value, force_ascii=True)
+
+def trigrams(processed):
+    """
+    Trigrams of each word padded with spaces, so word starts and ends count too
+    (plus the word ending/starting ones across the doubled space between words).
+    """
+    padded = f" {'  '.join(processed.split())} "
+    return set(map(''.join, zip(padded, padded[1:], padded[2:])))
+
+class FieldIndex:
+    def __init__(self, values=(), generation=None):
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.clear()
+        self.add(values)
+
+    def clear(self):
+        self.values = []      # id -> value, None once removed
+        self.processed = []   # id -> processed value
+        self.gram_counts = array('I') # id -> number of trigrams
+        self.word_counts = array('I') # id -> number of distinct words
+        self.ids = {}         # value -> id
+        self.postings = {}    # trigram -> array of ids
+        self.words = {}       # word -> array of ids
+        self.phrases = {}     # processed value, words single-spaced -> ids
+        self.exact = {}       # processed value -> ids
+        self.short = {}       # processed length up to SHORT_VALUE -> ids
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, values):
+        ids, postings, words, phrases, exact = self.ids, self.postings, self.words, self.phrases, self.exact
+        for value in values:
+            if value in ids:
+                continue
+            value_id = len(self.values)
+            processed = _process(value)
+            ids[value] = value_id
+            self.values.append(value)
+            self.processed.append(processed)
+            value_words = processed.split()
+            phrases.setdefault(' '.join(value_words), []).append(value_id)
+            exact.setdefault(processed, []).append(value_id)
+            if len(processed) <= SHORT_VALUE:
+                self.short.setdefault(len(processed), []).append(value_id)
+            grams = trigrams(processed)
+            self.gram_counts.append(len(grams))
+            value_words = set(value_words)
+            self.word_counts.append(len(value_words))
+            for index, keys in ((postings, grams), (words, value_words)):
+                for key in keys:
+                    key_ids = index.get(key)
+                    if key_ids is None:
+                        index[key] = array('I', (value_id,))
+                    else:
+                        key_ids.append(value_id)
+
+    def remove(self, values):
+        for value in values:
+            value_id = self.ids.pop(value, None)
+            if value_id is not None:
+                # Postings keep the id; candidates skip removed values
+                self.values[value_id] = None
+                self.removed += 1
+
+    def update(self, values):
+        """Brings the index up to `values` (a set): indexes new values and drops missing ones."""
+        gone = self.ids.keys() - values
+        if self.removed + len(gone) > len(values):
+            self.clear() # Mostly removed values: cheaper to start over
+        else:
+            self.remove(gone)
+        self.add(sorted(values - self.ids.keys()))
+
+    def refresh(self, conn, field, upload_id):
+        self.update(dict(facets.facet_counts(conn, field, [upload_id] if upload_id else None)).keys())
+
+    def candidates(self, query, limit):
+        """
+        Ids of the values worth scoring against the processed query: the CANDIDATES
+        values with the best estimated WRatio, first in value order among equals, and
+        the first `limit` values (in value order) of each class WRatio scores alike.
+        """
+        query_grams = trigrams(query)
+        counts = Counter()
+        budget = COUNT_BUDGET
+        for ids in sorted((self.postings[g] for g in query_grams if g in self.postings), key=len):
+            # The commonest trigrams are the least telling, and in a large index the most costly to count
+            if len(ids) > budget and counts:
+                break
+            counts.update(ids)
+            budget -= len(ids)
+
+        values, processed, gram_counts = self.values, self.processed, self.gram_counts
+        query_length, query_count = len(query), len(query_grams)
+        ranked = []
+        for i, shared in counts.most_common(4 * CANDIDATES):
+            value = values[i]
+            if value is None:
+                continue
+            length = len(processed[i])
+            longer, shorter = max(length, query_length), min(length, query_length)
+            if longer > shorter * MAX_LENGTH_RATIO:
+                continue
+            # WRatio takes the best of a whole-string ratio and (scaled) token and partial
+            # ratios, which reward one string containing the other: estimate both from trigrams
+            whole = 2 * shared / (gram_counts[i] + query_count)
+            contained = shared / min(gram_counts[i], query_count) * (0.95 if longer < 1.5 * shorter else 0.9)
+            ranked.append((-round(max(whole, contained), 2), value, i))
+        found = {i for _, _, i in heapq.nsmallest(CANDIDATES, ranked)}
+
+        # A value that is a run of the query's words scores 90 or more (partial ratio 100)
+        words = query.split()
+        for start in range(len(words)):
+            for end in range(start + 1, len(words) + 1):
+                found.update(i for i in self.phrases.get(' '.join(words[start:end]), ()) if values[i] is not None)
+
+        # A value inside the query scores 90 (partial ratio 100) when the query is 1.5 to 8 times
+        # as long, however few of its trigrams it shares: look up each substring of that length
+        shortest = -(-query_length // MAX_LENGTH_RATIO)
+        longest = int(query_length / 1.5)
+        exact = self.exact
+        for start in range(query_length - shortest + 1):
+            for end in range(start + shortest, min(start + longest, query_length) + 1):
+                hits = exact.get(query[start:end])
+                if hits:
+                    found.update(i for i in hits if values[i] is not None)
+
+        # Token set ratios score 100 when one string's words are all in the other, and partial
+        # token set ratios when they share any word: ties broken by value order, so only the
+        # first `limit` of each class (95 at similar lengths, 90 as a substring, 86) can make it
+        word_hits = Counter()
+        for word in set(words):
+            word_hits.update(self.words.get(word, ()))
+        query_words, word_counts = len(set(words)), self.word_counts
+        subsets, sharing = [], []
+        for i, hits in word_hits.items():
+            if values[i] is None:
+                continue
+            length = len(processed[i])
+            longer, shorter = max(length, query_length), min(length, query_length)
+            if longer > shorter * MAX_LENGTH_RATIO:
+                continue
+            if hits == query_words or hits == word_counts[i]:
+                tier = 0 if longer < 1.5 * shorter else 1 if query in processed[i] or processed[i] in query else 2
+                subsets.append((tier, values[i], i))
+            if longer >= 1.5 * shorter:
+                sharing.append((values[i], i))
+        found.update(i for _, _, i in heapq.nsmallest(limit, subsets))
+        found.update(i for _, i in heapq.nsmallest(limit, sharing))
+
+        # Whole-string ratios of 80 need the shorter string to be at least 2/3 as long as the other
+        for length in range(-(-2 * query_length // 3), min(SHORT_VALUE, query_length * 3 // 2) + 1):
+            found.update(i for i in self.short.get(length, ()) if values[i] is not None)
+
+        if query_length < SHORT_QUERY:
+            # Too short for trigrams to find it inside words; any value containing it scores 90
+            longest = query_length * MAX_LENGTH_RATIO
+            found.update(i for i, p in enumerate(processed)
+                         if query in p and len(p) <= longest and values[i] is not None)
+        return found
+
+    def search(self, query, limit=10, min_score=MIN_SCORE):
+        """Best matching values for query, scored and ordered as process.extract over every value would."""
+        processed = _process(query)
+        if not processed:
+            return []
+        # Sorted like the full list, so equal scores come back in the same order
+        choices = sorted(self.values[i] for i in self.candidates(processed, limit))
+        return [value for value, score in process.extract(query, choices, limit=limit) if score >= min_score]
+
+def fold(text):
+    """Case-folded text with runs of whitespace as single spaces, for prefix matching."""
+    return re.sub(r'\s+', ' ', text.casefold()).lstrip()
+
+class PrefixIndex:
+    def __init__(self, counts=None, generation=None):
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.counts = {}  # value -> number of contacts
+        self.keys = []    # sorted (folded text from a word start on, value)
+        self.recent = []  # the same for values added since keys was sorted
+        self.stale = 0    # entries in keys for values that are gone
+        self.top = {}     # folded prefix -> best completions, for long ranges
+        if counts:
+            self.update(counts)
+
+    @staticmethod
+    def entries(value):
+        folded = fold(value)
+        return {(folded[m.start():], value) for m in re.finditer(r'\w+', folded)} or {(folded, value)}
+
+    def update(self, counts):
+        """
+        Brings the index up to counts ({value: contacts}). New values go into a short
+        sorted list next to the main one and gone values are skipped when read, until
+        either grows past an eighth of the main list and it is sorted again.
+        """
+        gone = self.counts.keys() - counts.keys()
+        added = counts.keys() - self.counts.keys()
+        if added or gone or counts != self.counts:
+            self.top = {}
+        self.counts = dict(counts)
+        self.stale += sum(len(self.entries(value)) for value in gone)
+        if len(self.recent) + len(added) + self.stale > len(self.keys) // 8:
+            self.keys = sorted(entry for value in self.counts for entry in self.entries(value))
+            self.recent = []
+            self.stale = 0
+        else:
+            for value in added:
+                for entry in self.entries(value):
+                    insort(self.recent, entry)
+
+    def refresh(self, conn, field, upload_id):
+        self.update(dict(facets.facet_counts(conn, field, [upload_id] if upload_id else None)))
+
+    def complete(self, prefix, limit=TYPEAHEAD_LIMIT):
+        """
+        [(value, contacts)] for up to `limit` values with a word starting with prefix
+        (any value for an empty prefix), most contacts first.
+        """
+        prefix = fold(prefix)
+        if prefix in self.top:
+            return self.top[prefix][:limit]
+        counts = self.counts
+        if prefix:
+            ranges = []
+            for keys in (self.keys, self.recent):
+                low = bisect_left(keys, (prefix,))
+                ranges.append(keys[low:bisect_left(keys, (prefix + '\U0010ffff',), low)])
+            matches = list(map(itemgetter(1), heapq.merge(*ranges) if ranges[1] else ranges[0]))
+            # dict keeps the first (alphabetical) position of each value, nlargest keeps that order among equals
+            values = [value for value in dict.fromkeys(matches) if value in counts]
+        else:
+            matches = values = list(counts)
+        long_range = len(matches) > TYPEAHEAD_SCAN
+        best = heapq.nlargest(TYPEAHEAD_MAX_LIMIT if long_range else limit, values, key=counts.__getitem__)
+        completions = [(value, counts[value]) for value in best]
+        if long_range:
+            self.top[prefix] = completions
+        return completions[:limit]
+
+def get_index(conn, field, upload_id=None, kind=FieldIndex):
+    """
+    The current index of `kind` (FieldIndex or PrefixIndex) for field, over all uploads
+    when upload_id is None, built or refreshed as needed.
+    """
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"No value index for field {field!r}")
+    key = (kind, field, upload_id or None)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = kind()
+        _indexes.move_to_end(key)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+
+    generation = database.get_data_generation(conn)
+    with index.lock:
+        if index.generation != generation:
+            index.refresh(conn, field, upload_id)
+            index.generation = generation
+    return index
+
+def search_values(conn, field, query, upload_id=None, limit=10):
+    """Up to `limit` values of field scoring at least MIN_SCORE against query, best first."""
+    index = get_index(conn, field, upload_id)
+    with index.lock:
+        return index.search(query, limit)
+
+def complete_values(conn, field, prefix, upload_id=None, limit=TYPEAHEAD_LIMIT):
+    """[(value, contacts)] completing prefix, most contacts first."""
+    index = get_index(conn, field, upload_id, PrefixIndex)
+    with index.lock:
+        return index.complete(prefix, min(limit, TYPEAHEAD_MAX_LIMIT))
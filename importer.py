@@ -0,0 +1,430 @@
+"""
+CSV import pipeline for the contact tables.
+
+    csv rows -> projection onto the mapped columns (ragged rows go to the error list)
+             -> fixed-size chunks -> executemany -> commit
+
+Each chunk is committed on its own, so an import never holds the write lock for
+longer than one chunk and readers see progress as it happens.
+
+Imports can deduplicate on the normalized Email (see IMPORT_MODES): rows are written
+with INSERT ... ON CONFLICT against the unique email_key index, so matching an
+existing contact is an index lookup inside SQLite rather than a query per row.
+
+Large spooled files can instead be split at record boundaries and parsed and
+projected by a process pool (import_csv_file_parallel); a single writer still
+inserts the results in file order.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import string
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+
+import migrations
+
+CONTACT_TABLES = ['journalists', 'media_titles']
+# insert: append every row (duplicates are kept, as before)
+# update: rows whose email matches an existing contact update it; blank CSV cells keep the stored value
+# skip:   rows whose email matches an existing contact are left out
+IMPORT_MODES = ('insert', 'update', 'skip')
+# Columns the importer fills in itself, never mapped from a CSV
+UNMAPPABLE_COLUMNS = ('id', 'upload_id', 'created_at', 'updated_at', 'email_normalized', 'email_key', 'email_valid',
+                      'name_sort', 'categories')
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+MAX_REPORTED_ERRORS = 100 # Failed rows beyond this are counted but not listed
+DELETE_BATCH = int(os.environ.get('DELETE_BATCH', 50)) # Contacts removed per transaction when an upload is deleted (~5 ms with the triggers)
+
+# Parallel ingest settings
+PARALLEL_IMPORT_WORKERS = int(os.environ.get('PARALLEL_IMPORT_WORKERS', os.cpu_count() or 1))
+PARALLEL_IMPORT_MIN_BYTES = int(os.environ.get('PARALLEL_IMPORT_MIN_BYTES', 64 * 1024 * 1024)) # Smaller files parse faster serially
+PARALLEL_CHUNK_BYTES = int(os.environ.get('PARALLEL_CHUNK_BYTES', 8 * 1024 * 1024))
+
+
+class ImportMappingError(ValueError):
+    """The CSV file or column mapping cannot be imported at all."""
+
+
+class ImportCancelled(Exception):
+    """Raised from a progress callback to stop an import; its rows are removed again."""
+
+
+def build_projection(csv_headers, column_mapping, allowed_columns):
+    """
+    Resolves a {csv_header: db_column} mapping against the CSV headers.
+    Returns (db_columns, indexes): the target columns and the CSV index feeding each one.
+    Every db_column must be one of allowed_columns, since the names go into the SQL.
+    """
+    # The preview shows headers stripped of surrounding whitespace, so match them that way
+    header_index_map = {header.strip(): i for i, header in enumerate(csv_headers)}
+
+    # Only keep columns present in the uploaded CSV and mapped to a real db column
+    valid_mapping = {
+        csv_col.strip(): db_col
+        for csv_col, db_col in column_mapping.items()
+        if csv_col.strip() in header_index_map and db_col
+    }
+    if not valid_mapping:
+        raise ImportMappingError("Column mapping is empty or does not match any headers in the CSV file.")
+    unknown = sorted(set(valid_mapping.values()) - set(allowed_columns))
+    if unknown:
+        raise ImportMappingError(f"Cannot import into column(s): {', '.join(unknown)}.")
+
+    indexes = [header_index_map[csv_col] for csv_col in valid_mapping]
+    return list(valid_mapping.values()), indexes
+
+def mappable_columns(conn, target_table):
+    """The columns of a contact table a CSV column can be mapped onto."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({target_table})") if row[1] not in UNMAPPABLE_COLUMNS]
+
+def make_projector(indexes):
+    """Returns project(row) -> tuple of the values at `indexes`, and the row length it needs."""
+    if len(indexes) == 1:
+        index = indexes[0]
+        project = lambda row: (row[index],) # itemgetter with one index returns a bare value
+    else:
+        project = itemgetter(*indexes)
+    return project, max(indexes) + 1
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def normalize_email(value):
+    """Trimmed, ASCII-lower-cased email or None; matches migrations.normalized_email_sql()."""
+    if value is None:
+        return None
+    return value.strip(' \t\n\r').translate(_ASCII_LOWER) or None
+
+def with_email_key(values, email_index):
+    """Appends the normalized email (None if Email is not mapped) to each value tuple."""
+    if email_index is None:
+        for row in values:
+            yield row + (None,)
+    else:
+        for row in values:
+            yield row + (normalize_email(row[email_index]),)
+
+def new_import_stats(upload_id, target_table, import_mode='insert'):
+    return {
+        "upload_id": upload_id,
+        "target_table": target_table,
+        "import_mode": import_mode,
+        "rows_read": 0,
+        "imported_rows": 0,
+        "new_rows": 0,
+        "updated_rows": 0,
+        "skipped_rows": 0,
+        "failed_rows": 0,
+        "errors": [],
+        "elapsed_seconds": 0.0,
+        "rows_per_second": 0.0,
+    }
+
+def record_error(stats, row_number, message):
+    stats["failed_rows"] += 1
+    if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+        stats["errors"].append({"row": row_number, "error": message})
+
+def project_rows(rows, project, required_length, stats):
+    """Yields projected value tuples. Rows too short for the mapping are recorded as errors and skipped."""
+    row_number = 0
+    for row_number, row in enumerate(rows, start=1):
+        stats["rows_read"] = row_number
+        if len(row) < required_length:
+            if not row:
+                continue # Blank line
+            record_error(stats, row_number, f"Row has {len(row)} columns but the mapping needs {required_length}.")
+            continue
+        yield project(row)
+
+def insert_chunks(conn, sql, values, chunk_size, stats, progress=None, upsert_table=None):
+    """
+    Writes value tuples with executemany, committing after every chunk. Rows the
+    statement ignored (ON CONFLICT DO NOTHING) are counted as skipped. For statements
+    that may update rather than insert, pass upsert_table: rows it gains during the
+    chunk are counted as new and the rest of the written rows as updated.
+    """
+    started = time.monotonic()
+    while True:
+        chunk = list(islice(values, chunk_size))
+        if not chunk:
+            break
+        if upsert_table:
+            conn.execute("BEGIN IMMEDIATE") # So no other writer adds rows between the two id reads
+            last_id = conn.execute(f"SELECT MAX(id) FROM {upsert_table}").fetchone()[0] or 0
+        written = conn.executemany(sql, chunk).rowcount
+        if upsert_table:
+            new = conn.execute(f"SELECT COUNT(*) FROM {upsert_table} WHERE id > ?", (last_id,)).fetchone()[0]
+        else:
+            new = written
+        conn.commit()
+        stats["imported_rows"] += written
+        stats["new_rows"] += new
+        stats["updated_rows"] += written - new
+        stats["skipped_rows"] += len(chunk) - written
+        stats["elapsed_seconds"] = time.monotonic() - started
+        if stats["elapsed_seconds"] > 0:
+            stats["rows_per_second"] = round(stats["imported_rows"] / stats["elapsed_seconds"], 1)
+        if progress:
+            progress(stats)
+    return stats
+
+def summary_message(stats, upload_name):
+    message = f"Import successful. {stats['imported_rows']} rows imported into '{stats['target_table']}' as part of upload '{upload_name}'."
+    if stats['updated_rows']:
+        message += f" {stats['new_rows']} were new and {stats['updated_rows']} updated existing contacts."
+    if stats['skipped_rows']:
+        message += f" {stats['skipped_rows']} rows were skipped as duplicates."
+    if stats['failed_rows']:
+        message += f" {stats['failed_rows']} rows could not be imported."
+    return message
+
+def delete_upload_rows(conn, upload_id, batch_size=None, pause=0):
+    """
+    Removes everything an upload has written so far, then the upload itself. Contacts
+    go in transactions of at most batch_size rows, found through the (upload_id)
+    index, so other writers only ever wait for one batch; pause (seconds) between
+    batches gives them room. Returns the number of contacts removed.
+    """
+    batch_size = max(int(batch_size or DELETE_BATCH), 1)
+    deleted = 0
+    for table in CONTACT_TABLES:
+        while True:
+            cursor = conn.execute(
+                f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE upload_id = ? LIMIT ?)",
+                (upload_id, batch_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+    conn.commit()
+    return deleted
+
+def check_import_options(target_table, import_mode):
+    if target_table not in CONTACT_TABLES:
+        raise ImportMappingError("Invalid target table specified.")
+    if import_mode not in IMPORT_MODES:
+        raise ImportMappingError(f"Invalid import mode. Use one of: {', '.join(IMPORT_MODES)}.")
+
+def build_write_sql(target_table, upload_id, db_columns, import_mode):
+    """
+    The statement each value tuple (mapped columns + normalized email) is written with.
+    New rows take the email_key unless another row already holds it; in 'update' and
+    'skip' mode a held key is a conflict that updates or skips instead. The other
+    derived columns are computed by SQLite from the bound values.
+    """
+    params = {col: f"?{i}" for i, col in enumerate(db_columns, start=1)}
+    key = f"?{len(db_columns) + 1}"
+    derived = migrations.derived_columns_sql(*(params.get(col, 'NULL') for col in ('Email', 'name', 'Focus')))
+    del derived['email_normalized'] # Bound as `key`, already normalized for the upsert
+    # upload_id is an integer we just generated, so it is inlined rather than prepended to every row tuple
+    values = [str(int(upload_id))] + list(params.values()) + [key]
+    if import_mode == 'insert':
+        values.append(f"CASE WHEN EXISTS (SELECT 1 FROM {target_table} WHERE email_key = {key}) THEN NULL ELSE {key} END")
+    else:
+        values.append(key)
+    values.extend(derived.values())
+    sql = (f"INSERT INTO {target_table} (upload_id, {', '.join(db_columns)}, email_normalized, email_key, "
+           f"{', '.join(derived)}) VALUES ({', '.join(values)})")
+
+    if import_mode == 'skip':
+        sql += " ON CONFLICT (email_key) WHERE email_key IS NOT NULL DO NOTHING"
+    elif import_mode == 'update':
+        # The matched contact stays in its original upload; blank cells do not wipe stored values
+        updates = [f"{col} = COALESCE(NULLIF(excluded.{col}, ''), {col})" for col in db_columns if col != 'Email']
+        sql += (" ON CONFLICT (email_key) WHERE email_key IS NOT NULL DO UPDATE SET "
+                + ', '.join(updates or ["email_key = excluded.email_key"]))
+    return sql
+
+def import_csv(conn, stream, target_table, upload_name, column_mapping, chunk_size=None, progress=None,
+               import_mode='insert'):
+    """
+    Imports a text-mode CSV stream into `target_table` as a new upload and returns the import stats.
+    If the import fails part-way, the rows already committed for this upload are removed again
+    (contacts it updated in 'update' mode keep their new values).
+    """
+    check_import_options(target_table, import_mode)
+    chunk_size = max(int(chunk_size or IMPORT_CHUNK_SIZE), 1)
+
+    reader = csv.reader(stream)
+    try:
+        csv_headers = next(reader)
+    except StopIteration:
+        raise ImportMappingError("The CSV file is empty.")
+    db_columns, indexes = build_projection(csv_headers, column_mapping, mappable_columns(conn, target_table))
+    project, required_length = make_projector(indexes)
+
+    return _run_import(
+        conn, target_table, upload_name, db_columns, chunk_size, progress, import_mode,
+        lambda stats: project_rows(reader, project, required_length, stats)
+    )
+
+def _run_import(conn, target_table, upload_name, db_columns, chunk_size, progress, import_mode, make_values):
+    """Creates the upload record and writes the values produced by make_values(stats)."""
+    if import_mode != 'insert' and 'Email' not in db_columns:
+        raise ImportMappingError("Map a column to Email to update or skip existing contacts.")
+    cursor = conn.execute("INSERT INTO uploads (name) VALUES (?)", (upload_name,))
+    upload_id = cursor.lastrowid
+    conn.commit()
+
+    sql = build_write_sql(target_table, upload_id, db_columns, import_mode)
+    email_index = db_columns.index('Email') if 'Email' in db_columns else None
+    stats = new_import_stats(upload_id, target_table, import_mode)
+    try:
+        insert_chunks(conn, sql, with_email_key(make_values(stats), email_index), chunk_size, stats, progress,
+                      upsert_table=target_table if import_mode == 'update' else None)
+    except Exception:
+        conn.rollback()
+        delete_upload_rows(conn, upload_id)
+        raise
+    return stats
+
+# --- Parallel ingest ---
+
+def _first_record_end(path, start=0, block_size=1 << 16):
+    """Byte offset just past the first record starting at `start` (i.e. its first unquoted newline)."""
+    in_quotes = 0
+    pos = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return pos
+            i = 0
+            while True:
+                j = block.find(b'\n', i)
+                if j == -1:
+                    break
+                in_quotes ^= block.count(b'"', i, j) & 1
+                i = j + 1
+                if not in_quotes:
+                    return pos + i
+            in_quotes ^= block.count(b'"', i) & 1
+            pos += len(block)
+
+def find_record_boundaries(path, start, chunk_bytes, block_size=1 << 20):
+    """
+    Splits the file from byte `start` to EOF into pieces of roughly chunk_bytes that each
+    end on a record boundary, and returns the list of offsets [start, ..., file_size].
+
+    A newline ends a record only when an even number of quote characters precede it,
+    which holds for RFC 4180 CSV ("" escapes keep the count even), so newlines inside
+    quoted fields never split a record. '"' and '\n' never occur inside a multi-byte
+    UTF-8 sequence, so the scan can work on raw bytes.
+    """
+    boundaries = [start]
+    next_target = start + chunk_bytes
+    in_quotes = 0
+    pos = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            i = 0 # Quote parity is known up to block[i]
+            while True:
+                scan_from = max(i, next_target - pos)
+                if scan_from >= len(block):
+                    break
+                in_quotes ^= block.count(b'"', i, scan_from) & 1
+                i = scan_from
+                j = block.find(b'\n', i)
+                if j == -1:
+                    break
+                in_quotes ^= block.count(b'"', i, j) & 1
+                i = j + 1
+                if not in_quotes:
+                    boundaries.append(pos + i)
+                    next_target = pos + i + chunk_bytes
+            in_quotes ^= block.count(b'"', i) & 1
+            pos += len(block)
+    if boundaries[-1] != pos:
+        boundaries.append(pos)
+    return boundaries
+
+def parse_file_range(path, start, end, indexes):
+    """
+    Process-pool task: parses and projects the records in bytes [start, end).
+    Returns (values, rows_read, failed_rows, errors) with row numbers relative to the range.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    reader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+    project, required_length = make_projector(indexes)
+    stats = {"rows_read": 0, "failed_rows": 0, "errors": []}
+    values = list(project_rows(reader, project, required_length, stats))
+    return values, stats["rows_read"], stats["failed_rows"], stats["errors"]
+
+def _parallel_values(path, ranges, indexes, workers, stats):
+    """Yields projected rows in file order while up to 2 x workers ranges are parsed ahead."""
+    rows_before = 0
+
+    def merge(result):
+        nonlocal rows_before
+        values, rows_read, failed_rows, errors = result
+        for error in errors:
+            record_error(stats, rows_before + error["row"], error["error"])
+        # record_error counted each listed error; count the unlisted remainder too
+        stats["failed_rows"] += failed_rows - len(errors)
+        rows_before += rows_read
+        stats["rows_read"] = rows_before
+        return values
+
+    if workers <= 1:
+        for start, end in ranges:
+            yield from merge(parse_file_range(path, start, end, indexes))
+        return
+
+    # spawn rather than fork: imports run on a thread of a multi-threaded web process
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        pending = deque()
+        remaining = iter(ranges)
+        for start, end in islice(remaining, workers * 2):
+            pending.append(pool.submit(parse_file_range, path, start, end, indexes))
+        while pending:
+            result = pending.popleft().result()
+            for start, end in islice(remaining, 1):
+                pending.append(pool.submit(parse_file_range, path, start, end, indexes))
+            yield from merge(result)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def import_csv_file_parallel(conn, path, target_table, upload_name, column_mapping,
+                             workers=None, chunk_bytes=None, chunk_size=None, progress=None, import_mode='insert'):
+    """
+    Like import_csv(), for a CSV file on disk: the file is split at record boundaries and
+    the pieces are parsed and projected across `workers` processes, then inserted in order.
+    """
+    check_import_options(target_table, import_mode)
+    workers = max(int(workers or PARALLEL_IMPORT_WORKERS), 1)
+    chunk_bytes = max(int(chunk_bytes or PARALLEL_CHUNK_BYTES), 1)
+    chunk_size = max(int(chunk_size or IMPORT_CHUNK_SIZE), 1)
+
+    header_end = _first_record_end(path)
+    with open(path, 'rb') as f:
+        header_bytes = f.read(header_end)
+    csv_headers = next(csv.reader(io.StringIO(header_bytes.decode('utf-8'), newline='')), None)
+    if not csv_headers:
+        raise ImportMappingError("The CSV file is empty.")
+    db_columns, indexes = build_projection(csv_headers, column_mapping, mappable_columns(conn, target_table))
+
+    boundaries = find_record_boundaries(path, header_end, chunk_bytes)
+    ranges = list(zip(boundaries, boundaries[1:]))
+    return _run_import(
+        conn, target_table, upload_name, db_columns, chunk_size, progress, import_mode,
+        lambda stats: _parallel_values(path, ranges, indexes, workers, stats)
+    )
+
+def should_import_in_parallel(path):
+    return PARALLEL_IMPORT_WORKERS > 1 and os.path.getsize(path) >= PARALLEL_IMPORT_MIN_BYTES
@@ -0,0 +1,255 @@
+"""
+Background jobs for work that is too slow to do inside an HTTP request.
+
+Imports: the uploaded file is spooled to disk, recorded in import_jobs and run on a
+worker thread. Progress and cancellation go through the import_jobs row, so any
+request can poll or cancel a job.
+
+Upload deletions: the upload is hidden (uploads.deleted_at) at once, then its
+contacts are deleted in short batches, the tombstones no webhook sync needs are
+pruned and the freed pages are vacuumed. The hidden
+upload row is the job record: it is removed last, so an interrupted deletion is
+picked up again on restart.
+"""
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import importer
+import webhook_sync
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+IMPORT_SPOOL_DIR = os.environ.get('IMPORT_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'sway_import_spool'))
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+DELETE_PAUSE = float(os.environ.get('DELETE_PAUSE', 0.005)) # Seconds between delete batches, for waiting writers
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Returns the shared worker pool, starting it (and recovering interrupted jobs) on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job-worker')
+            recover_interrupted_jobs()
+        return _executor
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Exists, owned by someone else
+    return True
+
+def recover_interrupted_jobs():
+    """
+    Marks jobs whose worker process on this host has died as failed, and queues
+    jobs that never started. Jobs run by live processes are left alone.
+    """
+    host = socket.gethostname()
+    conn = database.get_db_connection()
+    try:
+        for job in conn.execute("SELECT id, worker FROM import_jobs WHERE status = 'running'").fetchall():
+            worker_host, _, pid = (job['worker'] or '').rpartition(':')
+            if worker_host == host and pid.isdigit() and not _process_alive(int(pid)):
+                conn.execute(
+                    "UPDATE import_jobs SET status = 'failed', message = 'Interrupted by a server restart.', "
+                    "finished_at = CURRENT_TIMESTAMP WHERE id = ?", (job['id'],)
+                )
+        queued = [row['id'] for row in conn.execute("SELECT id FROM import_jobs WHERE status = 'queued'")]
+        deleting = [row['id'] for row in conn.execute("SELECT id FROM uploads WHERE deleted_at IS NOT NULL")]
+        conn.commit()
+    finally:
+        conn.close()
+    for job_id in queued:
+        _executor.submit(run_import_job, job_id)
+    for upload_id in deleting:
+        _executor.submit(run_upload_delete, upload_id) # Deleting again is harmless if another process is at it too
+
+# --- Import Jobs ---
+
+def submit_import_job(file_storage, target_table, upload_name, column_mapping, chunk_size=None, import_mode='insert',
+                      created_by=None):
+    """Spools an uploaded CSV to disk, records an import job and queues it. Returns the job id."""
+    os.makedirs(IMPORT_SPOOL_DIR, exist_ok=True)
+    file_path = os.path.join(IMPORT_SPOOL_DIR, f"{uuid.uuid4().hex}.csv")
+    file_storage.save(file_path) # Streams to disk in blocks rather than reading the upload into memory
+
+    conn = database.get_db_connection()
+    try:
+        cursor = conn.execute(
+            "INSERT INTO import_jobs (target_table, upload_name, column_mapping, chunk_size, import_mode, file_path, created_by) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (target_table, upload_name, json.dumps(column_mapping), chunk_size, import_mode, file_path, created_by)
+        )
+        job_id = cursor.lastrowid
+        conn.commit()
+    except Exception:
+        os.remove(file_path)
+        raise
+    finally:
+        conn.close()
+
+    get_executor().submit(run_import_job, job_id)
+    return job_id
+
+def _finish_job(conn, job_id, status, message, stats=None):
+    stats = stats or {}
+    conn.execute(
+        "UPDATE import_jobs SET status = ?, message = ?, rows_done = ?, rows_failed = ?, rows_new = ?, rows_updated = ?, "
+        "rows_skipped = ?, rows_per_second = ?, errors = ?, upload_id = ?, file_path = NULL, finished_at = CURRENT_TIMESTAMP "
+        "WHERE id = ?",
+        (status, message, stats.get('imported_rows', 0), stats.get('failed_rows', 0), stats.get('new_rows', 0),
+         stats.get('updated_rows', 0), stats.get('skipped_rows', 0), stats.get('rows_per_second'),
+         json.dumps(stats.get('errors', [])), stats.get('upload_id'), job_id)
+    )
+    conn.commit()
+
+def _remove_spool_file(file_path):
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+def run_import_job(job_id):
+    """Worker entry point: runs one queued import job to completion, failure or cancellation."""
+    conn = database.get_db_connection()
+    job = None
+    try:
+        job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None or job['status'] != 'queued':
+            return
+        if job['cancel_requested']:
+            _finish_job(conn, job_id, 'cancelled', "Import cancelled before it started.")
+            return
+
+        # Conditional so a cancel (or another process) that gets there between the SELECT above and here wins
+        cursor = conn.execute(
+            "UPDATE import_jobs SET status = 'running', worker = ?, started_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'queued'",
+            (WORKER_ID, job_id)
+        )
+        conn.commit()
+        if cursor.rowcount == 0:
+            job = None # Taken or cancelled meanwhile; whoever did that owns the spool file
+            return
+
+        def progress(stats):
+            conn.execute(
+                "UPDATE import_jobs SET rows_done = ?, rows_failed = ?, rows_new = ?, rows_updated = ?, rows_skipped = ?, "
+                "rows_per_second = ?, upload_id = ? WHERE id = ?",
+                (stats['imported_rows'], stats['failed_rows'], stats['new_rows'], stats['updated_rows'],
+                 stats['skipped_rows'], stats['rows_per_second'], stats['upload_id'], job_id)
+            )
+            cancel_requested = conn.execute("SELECT cancel_requested FROM import_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            conn.commit()
+            if cancel_requested:
+                raise importer.ImportCancelled()
+
+        if importer.should_import_in_parallel(job['file_path']):
+            stats = importer.import_csv_file_parallel(
+                conn, job['file_path'], job['target_table'], job['upload_name'], json.loads(job['column_mapping']),
+                chunk_size=job['chunk_size'], progress=progress, import_mode=job['import_mode']
+            )
+        else:
+            with open(job['file_path'], encoding='utf-8', newline='') as stream:
+                stats = importer.import_csv(
+                    conn, stream, job['target_table'], job['upload_name'], json.loads(job['column_mapping']),
+                    chunk_size=job['chunk_size'], progress=progress, import_mode=job['import_mode']
+                )
+        _finish_job(conn, job_id, 'completed', importer.summary_message(stats, job['upload_name']), stats)
+    except importer.ImportCancelled:
+        _finish_job(conn, job_id, 'cancelled', "Import cancelled. No rows were kept.")
+    except Exception as e:
+        print(f"Error in import job {job_id}: {e}")
+        conn.rollback()
+        _finish_job(conn, job_id, 'failed', f"An error occurred during the import: {e}")
+    finally:
+        if job is not None:
+            _remove_spool_file(job['file_path'])
+        conn.close()
+
+def get_import_job(job_id):
+    """Returns an import job as a JSON-ready dict, or None."""
+    conn = database.get_db_connection()
+    job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    if job is None:
+        return None
+    job = dict(job)
+    job.pop('file_path')
+    job['errors'] = json.loads(job['errors']) if job['errors'] else []
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+def cancel_import_job(job_id):
+    """
+    Requests cancellation. Queued jobs are cancelled immediately; running jobs stop
+    after their current chunk and remove the rows they imported.
+    Returns False if the job does not exist or has already finished.
+    """
+    conn = database.get_db_connection()
+    try:
+        cursor = conn.execute(
+            "UPDATE import_jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')", (job_id,)
+        )
+        if cursor.rowcount == 0:
+            return False
+        file_path = conn.execute("SELECT file_path FROM import_jobs WHERE id = ?", (job_id,)).fetchone()['file_path']
+        cursor = conn.execute(
+            "UPDATE import_jobs SET status = 'cancelled', message = 'Import cancelled before it started.', "
+            "file_path = NULL, finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'queued'", (job_id,)
+        )
+        cancelled_while_queued = cursor.rowcount == 1
+        conn.commit()
+    finally:
+        conn.close()
+    if cancelled_while_queued:
+        _remove_spool_file(file_path)
+    return True
+
+# --- Upload Deletion ---
+
+def delete_upload(upload_id):
+    """
+    Hides an upload from every upload read and queues the deletion of its contacts.
+    Returns False if there is no such upload or it is already being deleted.
+    """
+    conn = database.get_db_connection()
+    try:
+        cursor = conn.execute(
+            "UPDATE uploads SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND deleted_at IS NULL", (upload_id,))
+        if cursor.rowcount:
+            # Its contacts leave every read now, so cached counts and indexes are stale as after a delete
+            conn.execute("UPDATE data_generation SET generation = generation + 1, rewrites = rewrites + 1 WHERE id = 1")
+        conn.commit()
+    finally:
+        conn.close()
+    if cursor.rowcount == 0:
+        return False
+    get_executor().submit(run_upload_delete, upload_id)
+    return True
+
+def run_upload_delete(upload_id):
+    """Worker entry point: deletes a hidden upload's contacts batch by batch, then the upload, then vacuums."""
+    conn = database.get_db_connection()
+    try:
+        started = time.monotonic()
+        deleted = importer.delete_upload_rows(conn, upload_id, pause=DELETE_PAUSE)
+        webhook_sync.prune_tombstones(conn, database.WEBHOOK_URLS) # Their tombstones, unless a sync still needs them
+        conn.commit()
+        pages = database.incremental_vacuum(conn)
+        print(f"Deleted upload {upload_id}: {deleted} contacts in {time.monotonic() - started:.1f}s, {pages} pages freed")
+    except Exception as e:
+        print(f"Error deleting upload {upload_id}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
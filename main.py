@@ -100,15 +100,18 @@ def main_menu():
             else:
                 confirm = input(f"Are you sure you want to push all {len(companies)} companies to the webhook? (yes/no): ").lower()
                 if confirm == 'yes':
+                    company_dicts = [dict(company_row) for company_row in companies]
+                    print(f"Pushing {len(company_dicts)} companies...")
+                    # Sent together over the dispatcher's pooled connections rather than one after another
+                    accepted = database.send_each_to_webhook(company_dicts)
                     success_count = 0
                     fail_count = 0
-                    for company_row in companies:
-                        company_dict = dict(company_row)
-                        print(f"Pushing company: {company_dict['name']} (ID: {company_dict['id']})")
-                        if database.send_to_webhook(company_dict):
+                    for company_dict, destinations in zip(company_dicts, accepted):
+                        if destinations:
                             success_count += 1
                         else:
                             fail_count += 1
+                            print(f"Failed to push company: {company_dict['name']} (ID: {company_dict['id']})")
                     print(f"\nWebhook push summary: {success_count} succeeded, {fail_count} failed.")
                 else:
                     print("Pushing all companies cancelled.")
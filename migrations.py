@@ -0,0 +1,659 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in SQLite's PRAGMA user_version. Each migration is
+registered with @migration(version, description) and is applied exactly once,
+in version order, inside its own transaction together with the user_version
+bump. Steps filling a large table use backfill_by_id(), which commits batch by
+batch and resumes. When the database is already current, migrate() costs one
+PRAGMA read.
+"""
+import time
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """Registers a function taking (conn, progress) as the migration to `version`."""
+    def register(fn):
+        if any(m['version'] == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append({'version': version, 'description': description, 'apply': fn})
+        MIGRATIONS.sort(key=lambda m: m['version'])
+        return fn
+    return register
+
+def latest_version(migrations=None):
+    migrations = MIGRATIONS if migrations is None else migrations
+    return migrations[-1]['version'] if migrations else 0
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def print_progress(label, done, total):
+    """Default progress reporter for long-running migration steps."""
+    percent = (100 * done // total) if total else 100
+    print(f"Migration progress: {label}: {done}/{total} ({percent}%)")
+
+def migrate(conn, migrations=None, progress=print_progress):
+    """Applies every pending migration and returns the resulting schema version."""
+    migrations = MIGRATIONS if migrations is None else migrations
+    current = get_version(conn)
+    if current >= latest_version(migrations):
+        return current
+
+    if conn.in_transaction:
+        conn.commit()
+    for step in migrations:
+        if step['version'] <= current:
+            continue
+        started = time.monotonic()
+        # IMMEDIATE takes the write lock up front so two processes starting together
+        # cannot both apply the same step; the version is re-read under the lock.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = get_version(conn)
+            if step['version'] <= current:
+                conn.rollback()
+                continue
+            step['apply'](conn, progress)
+            # Pragma values cannot be bound as parameters; the version is an int from our own registry
+            conn.execute(f"PRAGMA user_version = {int(step['version'])}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"Migration {step['version']} ({step['description']}) failed; schema left at version {current}.")
+            raise
+        current = step['version']
+        print(f"Applied migration {current}: {step['description']} ({time.monotonic() - started:.2f}s)")
+    return current
+
+# --- Helpers for migration steps ---
+# Note: executescript() commits the open transaction, so steps must use execute().
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def add_column(conn, table, column, definition):
+    """Adds a column unless it already exists (databases created before migrations may have it)."""
+    if not column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def backfill(conn, table, set_clause, where=None, params=(), batch_size=10000, progress=print_progress):
+    """
+    Runs `UPDATE table SET set_clause` over a large table in rowid-ordered batches,
+    reporting progress after each batch. Returns the number of rows visited.
+    """
+    bounds = conn.execute(f"SELECT MIN(rowid), MAX(rowid), COUNT(*) FROM {table}").fetchone()
+    low, high, total = bounds[0], bounds[1], bounds[2]
+    if not total:
+        return 0
+    condition = f" AND ({where})" if where else ""
+    done = 0
+    start = low
+    while start <= high:
+        end = start + batch_size
+        conn.execute(
+            f"UPDATE {table} SET {set_clause} WHERE rowid >= ? AND rowid < ?{condition}",
+            (start, end) + tuple(params)
+        )
+        done += conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid >= ? AND rowid < ?", (start, end)).fetchone()[0]
+        if progress:
+            progress(f"{table} backfill", done, total)
+        start = end
+    return done
+
+def pending_backfill_sql(name, row):
+    """
+    A trigger WHEN condition, false while row (NEW or OLD) still waits for the unfinished
+    backfill `name`: the backfill reads that row's values when it gets to it.
+    """
+    return (f"NOT EXISTS (SELECT 1 FROM migration_backfills WHERE name = '{name}' "
+            f"AND {row}.id > last_id AND {row}.id <= high_id)")
+
+def backfill_by_id(conn, name, table, statements, batch_size=10000, progress=print_progress):
+    """
+    Runs each of statements, INSERT ... SELECT ... FROM table with `id > ? AND id <= ?`
+    bounds, over the rows table has now in id-ranged batches, committing and reporting
+    progress after each batch so the write lock and the journal stay small. The position
+    is kept in migration_backfills under name: a migration restarted after a failure, or
+    started by a second process meanwhile, carries on from the last committed batch.
+    Rows added later are left to the table's triggers, which should be guarded with
+    pending_backfill_sql(name, ...). Returns the number of rows to fill.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS migration_backfills (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            high_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO migration_backfills (name, last_id, high_id)
+        SELECT ?, IFNULL(MIN(id), 1) - 1, IFNULL(MAX(id), 0) FROM {table} WHERE true
+        ON CONFLICT DO NOTHING
+    ''', (name,))
+    high_id = conn.execute("SELECT high_id FROM migration_backfills WHERE name = ?", (name,)).fetchone()[0]
+    total = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE id <= ?", (high_id,)).fetchone()[0]
+    while True:
+        # Re-read under the write lock: another process may have done the next batch
+        last_id = conn.execute("SELECT last_id FROM migration_backfills WHERE name = ?", (name,)).fetchone()[0]
+        if last_id >= high_id:
+            break
+        end = min(last_id + batch_size, high_id)
+        for sql in statements:
+            conn.execute(sql, (last_id, end))
+        conn.execute("UPDATE migration_backfills SET last_id = ? WHERE name = ?", (end, name))
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        if progress:
+            progress(name, conn.execute(f"SELECT COUNT(*) FROM {table} WHERE id <= ?", (end,)).fetchone()[0], total)
+    return total
+
+# --- Migrations ---
+
+CONTACT_COLUMNS_SQL = '''
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            upload_id INTEGER,
+            name TEXT, nameSuffix TEXT, outletName TEXT, phone TEXT, ModeOfAddress TEXT,
+            Honorific TEXT, JobTitle TEXT, MediaType TEXT, Email TEXT, AddressLine1 TEXT,
+            AddressLine2 TEXT, City TEXT, County TEXT, State TEXT, PostalCode TEXT,
+            Country TEXT, Twitter TEXT, Facebook TEXT, Instagram TEXT, Pinterest TEXT,
+            YouTube TEXT, ShadowEmail TEXT, ShadowPhone TEXT, ShadowMobile TEXT,
+            ShadowWebsite TEXT, ShadowFacebook TEXT, ShadowTwitter TEXT, ShadowLinkedIn TEXT,
+            ShadowAddressLine1 TEXT, ShadowAddressLine2 TEXT, ShadowCity TEXT,
+            ShadowCounty TEXT, ShadowPostalCode TEXT, ShadowCountry TEXT,
+            Languages TEXT, Unsubscribed TEXT, Focus TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (upload_id) REFERENCES uploads (id)
+'''
+
+@migration(1, "baseline schema")
+def baseline_schema(conn, progress):
+    # IF NOT EXISTS because databases created before versioning already have these tables
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS companies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            url TEXT,
+            industry TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT UNIQUE,
+            password_hash TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            is_admin BOOLEAN DEFAULT FALSE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # journalists and media_titles share an identical structure
+    for table in ('journalists', 'media_titles'):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({CONTACT_COLUMNS_SQL})")
+        # Tables created before uploads existed lack upload_id
+        add_column(conn, table, 'upload_id', 'INTEGER REFERENCES uploads(id)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_email ON {table} (Email)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_outletName ON {table} (outletName)')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS staff (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_name TEXT NOT NULL,
+            staff_email TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_staff_email ON staff (staff_email)')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS press_releases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            content TEXT NOT NULL,
+            image BLOB
+        )
+    ''')
+    add_column(conn, 'press_releases', 'html_content', 'TEXT')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS follow_up_emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            press_release_id INTEGER,
+            staff_id INTEGER,
+            name TEXT NOT NULL,
+            content TEXT NOT NULL,
+            outlets TEXT,
+            FOREIGN KEY (press_release_id) REFERENCES press_releases (id),
+            FOREIGN KEY (staff_id) REFERENCES staff (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coverage_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link TEXT NOT NULL,
+            article TEXT NOT NULL,
+            date_of_publish TEXT NOT NULL
+        )
+    ''')
+
+@migration(2, "import_jobs table for background imports")
+def import_jobs_table(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'queued', -- queued, running, completed, failed, cancelled
+            target_table TEXT NOT NULL,
+            upload_name TEXT NOT NULL,
+            column_mapping TEXT NOT NULL, -- JSON
+            chunk_size INTEGER,
+            file_path TEXT, -- Spooled upload; removed once the job finishes
+            upload_id INTEGER,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            rows_failed INTEGER NOT NULL DEFAULT 0,
+            rows_per_second REAL,
+            errors TEXT, -- JSON list of row errors
+            message TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            worker TEXT, -- host:pid of the process running the job
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (upload_id) REFERENCES uploads (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_import_jobs_status ON import_jobs (status)')
+
+# Emails are normalized by trimming whitespace and lower-casing ASCII letters, which is
+# exactly what SQLite's trim()/lower() do, so SQL and importer.normalize_email() agree.
+def normalized_email_sql(column):
+    return f"NULLIF(lower(trim({column}, ' ' || char(9, 10, 13))), '')"
+
+@migration(3, "normalized email keys for deduplicating imports")
+def email_keys(conn, progress):
+    new_email = normalized_email_sql('NEW.Email')
+    for table in ('journalists', 'media_titles'):
+        add_column(conn, table, 'email_normalized', 'TEXT')
+        # email_key is set on one canonical row per normalized email; it is what imports upsert on.
+        # Duplicates added by plain (insert-only) imports leave it NULL.
+        add_column(conn, table, 'email_key', 'TEXT')
+        backfill(conn, table, f"email_normalized = {normalized_email_sql('Email')}", progress=progress)
+        conn.execute(f'''
+            UPDATE {table} SET email_key = email_normalized
+            WHERE id IN (SELECT MIN(id) FROM {table} WHERE email_normalized IS NOT NULL GROUP BY email_normalized)
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_email_normalized ON {table} (email_normalized)')
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_email_key ON {table} (email_key) WHERE email_key IS NOT NULL')
+
+        # Keep the columns right for rows written outside the importer (which fills them itself)
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_email_normalized_insert AFTER INSERT ON {table}
+            WHEN NEW.email_normalized IS NOT {new_email}
+            BEGIN
+                UPDATE {table} SET email_normalized = {new_email} WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_email_normalized_update AFTER UPDATE OF Email ON {table}
+            BEGIN
+                UPDATE {table} SET
+                    email_normalized = {new_email},
+                    email_key = CASE WHEN EXISTS (SELECT 1 FROM {table} WHERE email_key = {new_email} AND id != NEW.id)
+                                     THEN NULL ELSE {new_email} END
+                WHERE id = NEW.id;
+            END
+        ''')
+
+    add_column(conn, 'import_jobs', 'import_mode', "TEXT NOT NULL DEFAULT 'insert'")
+    add_column(conn, 'import_jobs', 'rows_new', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'import_jobs', 'rows_updated', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'import_jobs', 'rows_skipped', 'INTEGER NOT NULL DEFAULT 0')
+
+# contacts_fts indexes both contact tables; its rowid encodes the source row as id * 2 + table bit
+CONTACT_FTS_TABLES = {'journalists': 0, 'media_titles': 1}
+CONTACT_FTS_COLUMNS = ('name', 'outletName', 'Email', 'Focus')
+
+@migration(4, "full-text index over contacts")
+def contacts_fts(conn, progress):
+    columns = ', '.join(CONTACT_FTS_COLUMNS)
+    # Contentless: the text lives in the contact tables, the index only maps terms to rowids
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+            {columns}, content='', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    # The hidden rank column ranks by bm25, a name hit weighing most and a Focus hit least
+    conn.execute("INSERT INTO contacts_fts (contacts_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')")
+    for table, bit in CONTACT_FTS_TABLES.items():
+        new_values = ', '.join(f"NEW.{col}" for col in CONTACT_FTS_COLUMNS)
+        old_values = ', '.join(f"OLD.{col}" for col in CONTACT_FTS_COLUMNS)
+        insert_new = f"INSERT INTO contacts_fts (rowid, {columns}) VALUES (NEW.id * 2 + {bit}, {new_values});"
+        # A contentless index is told the old values so it can remove their terms
+        delete_old = f"INSERT INTO contacts_fts (contacts_fts, rowid, {columns}) VALUES ('delete', OLD.id * 2 + {bit}, {old_values});"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table} BEGIN {insert_new} END")
+        # Rows the backfill has not indexed yet have no terms to remove
+        backfill = f"{table} full-text index"
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table}
+            WHEN {pending_backfill_sql(backfill, 'OLD')} BEGIN {delete_old} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE OF {columns} ON {table}
+            WHEN {pending_backfill_sql(backfill, 'OLD')} BEGIN {delete_old} {insert_new} END
+        ''')
+
+        backfill_by_id(conn, backfill, table, [
+            f"INSERT INTO contacts_fts (rowid, {columns}) SELECT id * 2 + {bit}, {columns} FROM {table} WHERE id > ? AND id <= ?"
+        ], progress=progress)
+
+@migration(5, "(name, id) indexes for keyset paging of contacts")
+def contact_name_indexes(conn, progress):
+    for table in ('journalists', 'media_titles'):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_name_id ON {table} (name, id)')
+
+@migration(6, "data generation counter for cached contact counts")
+def data_generation(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            instance TEXT NOT NULL,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # instance tells apart databases that happen to share a file name and generation
+    conn.execute("INSERT OR IGNORE INTO data_generation (id, instance, generation) VALUES (1, lower(hex(randomblob(8))), 0)")
+    # Every write to the contact tables, whoever makes it, starts a new generation
+    for table in ('journalists', 'media_titles'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_generation_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_generation SET generation = generation + 1 WHERE id = 1;
+                END
+            ''')
+
+# Derived contact columns. Each is an SQL expression over the source column, so the importer
+# (over its bound parameters), the backfill below and the trigger compute exactly the same thing.
+_TRIM_CHARS = "' ' || char(9, 10, 13)"
+
+def email_valid_sql(column):
+    """1 if the trimmed email looks like local@domain.tld with no whitespace, else 0."""
+    email = f"trim({column}, {_TRIM_CHARS})"
+    at = f"instr({email}, '@')"
+    return (f"({column} IS NOT NULL AND {at} > 1 AND instr(substr({email}, {at} + 1), '@') = 0"
+            f" AND instr(substr({email}, {at} + 2, length({email}) - {at} - 2), '.') > 0"
+            f" AND {email} NOT GLOB '*[' || char(9, 10, 11, 12, 13, 32) || ']*')")
+
+def name_sort_sql(column):
+    return f"lower(trim(IFNULL({column}, ''), {_TRIM_CHARS}))"
+
+def categories_sql(column):
+    """Focus split on commas into a JSON array of trimmed, non-empty categories."""
+    escaped = f"replace(replace(IFNULL({column}, ''), '\\', '\\\\'), '\"', '\\\"')"
+    escaped = f"replace(replace(replace({escaped}, char(9), ' '), char(10), ' '), char(13), ' ')"
+    as_json = f"('[\"' || replace({escaped}, ',', '\",\"') || '\"]')"
+    return (f"(SELECT json_group_array(trim(value, {_TRIM_CHARS})) FROM json_each("
+            f"CASE WHEN json_valid({as_json}) THEN {as_json} ELSE '[]' END) WHERE trim(value, {_TRIM_CHARS}) != '')")
+
+def derived_columns_sql(email, name, focus):
+    """{derived column: expression} for the given Email, name and Focus expressions."""
+    return {
+        'email_normalized': normalized_email_sql(email),
+        'email_valid': email_valid_sql(email),
+        'name_sort': name_sort_sql(name),
+        'categories': categories_sql(focus),
+    }
+
+@migration(7, "precomputed email validity, sort name and categories")
+def derived_contact_columns(conn, progress):
+    for table in ('journalists', 'media_titles'):
+        add_column(conn, table, 'email_valid', 'INTEGER NOT NULL DEFAULT 0')
+        # NULL until computed; the importer always fills it, the trigger below fills it for other writers
+        add_column(conn, table, 'name_sort', 'TEXT')
+        add_column(conn, table, 'categories', "TEXT NOT NULL DEFAULT '[]'")
+        derived = derived_columns_sql('Email', 'name', 'Focus')
+        backfill(conn, table, ', '.join(f"{col} = {expr}" for col, expr in derived.items()), progress=progress)
+
+        # One pair of triggers maintains every derived column, replacing migration 3's
+        new = derived_columns_sql('NEW.Email', 'NEW.name', 'NEW.Focus')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_email_normalized_insert')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_email_normalized_update')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_derived_insert AFTER INSERT ON {table}
+            WHEN NEW.name_sort IS NULL
+            BEGIN
+                UPDATE {table} SET {', '.join(f"{col} = {expr}" for col, expr in new.items())} WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_derived_update AFTER UPDATE OF Email, name, Focus ON {table}
+            BEGIN
+                UPDATE {table} SET
+                    {', '.join(f"{col} = {expr}" for col, expr in new.items())},
+                    email_key = CASE WHEN OLD.Email IS NEW.Email THEN email_key
+                                     WHEN EXISTS (SELECT 1 FROM {table} WHERE email_key = {new['email_normalized']} AND id != NEW.id)
+                                     THEN NULL ELSE {new['email_normalized']} END
+                WHERE id = NEW.id;
+            END
+        ''')
+
+        # Listings read valid contacts in name order; the partial index holds nothing else
+        conn.execute(f'DROP INDEX IF EXISTS idx_{table}_name_id')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_valid_name_sort ON {table} (name_sort, id) WHERE email_valid = 1')
+
+@migration(8, "(upload_id, value) indexes for outlet and city lookups")
+def field_value_indexes(conn, progress):
+    for table in ('journalists', 'media_titles'):
+        # Distinct outlets and cities, for all uploads or one, are read from these without touching the table
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_city ON {table} (City)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_upload_outletName ON {table} (upload_id, outletName)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_upload_city ON {table} (upload_id, City)')
+
+# Columns with materialized per-upload value counts in contact_facets
+FACET_COLUMNS = ('outletName', 'City')
+
+def facet_change_sql(table, row, delta):
+    """Statements adding delta (+1 or -1) to the facet counts of row (NEW or OLD) of table."""
+    statements = []
+    for facet in FACET_COLUMNS:
+        key = f"facet = '{facet}' AND upload_id = IFNULL({row}.upload_id, 0) AND contact_table = '{table}' AND value = {row}.{facet}"
+        if delta > 0:
+            # NULL != '' is not true either, so blank values are never counted
+            statements.append(f'''
+                INSERT INTO contact_facets (facet, upload_id, contact_table, value, contact_count)
+                SELECT '{facet}', IFNULL({row}.upload_id, 0), '{table}', {row}.{facet}, 1 WHERE {row}.{facet} != ''
+                ON CONFLICT DO UPDATE SET contact_count = contact_count + 1;''')
+        else:
+            statements.append(f"UPDATE contact_facets SET contact_count = contact_count - 1 WHERE {key};")
+            statements.append(f"DELETE FROM contact_facets WHERE {key} AND contact_count <= 0;")
+    return '\n'.join(statements)
+
+@migration(9, "materialized outlet and city counts per upload")
+def contact_facets(conn, progress):
+    # upload_id 0 stands for contacts without an upload: NULLs would never conflict in the key
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS contact_facets (
+            facet TEXT NOT NULL,
+            upload_id INTEGER NOT NULL,
+            contact_table TEXT NOT NULL,
+            value TEXT NOT NULL,
+            contact_count INTEGER NOT NULL,
+            PRIMARY KEY (facet, upload_id, contact_table, value)
+        ) WITHOUT ROWID
+    ''')
+
+    for table in ('journalists', 'media_titles'):
+        # Imports, edits and deletes from any writer keep the counts current in their own transaction.
+        # Rows the backfill has not counted yet are left to it.
+        backfill = f"{table} facet counts"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_facets_insert AFTER INSERT ON {table} BEGIN {facet_change_sql(table, 'NEW', 1)} END")
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_facets_delete AFTER DELETE ON {table}
+            WHEN {pending_backfill_sql(backfill, 'OLD')} BEGIN {facet_change_sql(table, 'OLD', -1)} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_facets_update AFTER UPDATE OF upload_id, {', '.join(FACET_COLUMNS)} ON {table}
+            WHEN {pending_backfill_sql(backfill, 'OLD')} BEGIN {facet_change_sql(table, 'OLD', -1)} {facet_change_sql(table, 'NEW', 1)} END
+        ''')
+
+        # Each batch adds its counts to those of the batches (and the new rows) before it
+        backfill_by_id(conn, backfill, table, [f'''
+            INSERT INTO contact_facets (facet, upload_id, contact_table, value, contact_count)
+            SELECT '{facet}', IFNULL(upload_id, 0), '{table}', {facet}, COUNT(*) FROM {table}
+            WHERE {facet} != '' AND id > ? AND id <= ? GROUP BY IFNULL(upload_id, 0), {facet}
+            ON CONFLICT DO UPDATE SET contact_count = contact_count + excluded.contact_count
+        ''' for facet in FACET_COLUMNS], progress=progress)
+
+@migration(10, "rewrite counter for in-memory contact indexes")
+def rewrite_generation(conn, progress):
+    # Bumped only by updates and deletes: while it stays the same, contacts have only been
+    # added (with higher ids), so an in-memory index can read just the new rows.
+    add_column(conn, 'data_generation', 'rewrites', 'INTEGER NOT NULL DEFAULT 0')
+    for table in ('journalists', 'media_titles'):
+        for event in ('UPDATE', 'DELETE'):
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_generation_{event.lower()}')
+            conn.execute(f'''
+                CREATE TRIGGER trg_{table}_generation_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_generation SET generation = generation + 1, rewrites = rewrites + 1 WHERE id = 1;
+                END
+            ''')
+
+@migration(11, "upload_id indexes for paging an upload's contacts")
+def upload_id_indexes(conn, progress):
+    for table in ('journalists', 'media_titles'):
+        # Holds an upload's rows in id order, so its default page stops after `limit` entries
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_upload_id ON {table} (upload_id)')
+
+@migration(12, "email_valid indexes for counting listable contacts")
+def email_valid_indexes(conn, progress):
+    for table in ('journalists', 'media_titles'):
+        # The contact listing's total counts entries of this narrow index instead of reading every row
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_email_valid ON {table} (email_valid)')
+
+@migration(13, "hidden flag for uploads being deleted")
+def upload_deleted_at(conn, progress):
+    # Set when a deletion is queued: reads leave the upload out while its rows are removed in batches
+    add_column(conn, 'uploads', 'deleted_at', 'TIMESTAMP')
+
+@migration(14, "webhook outbox, per-destination deliveries and dead letters")
+def webhook_outbox(conn, progress):
+    # One row per payload; the idempotency key makes enqueueing the same payload twice a no-op
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Retry state per destination, so one that is down does not hold back (or repeat to) the others.
+    # next_attempt_at is a Unix time; delivered rows are kept until the payload is pruned.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            outbox_id INTEGER NOT NULL,
+            destination TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            delivered_at TIMESTAMP,
+            UNIQUE (outbox_id, destination)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_due
+        ON webhook_deliveries (next_attempt_at) WHERE delivered_at IS NULL
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Maintained by triggers or the importer from the stored columns, so never a change of their own
+UNTRACKED_COLUMNS = ('id', 'created_at', 'updated_at', 'email_normalized', 'email_key', 'email_valid', 'name_sort',
+                     'categories')
+
+@migration(15, "updated_at triggers, contact tombstones and webhook sync state")
+def contact_change_tracking(conn, progress):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS contact_tombstones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contact_table TEXT NOT NULL,
+            contact_id INTEGER NOT NULL,
+            upload_id INTEGER,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for table in ('journalists', 'media_titles'):
+        backfill(conn, table, "updated_at = IFNULL(created_at, CURRENT_TIMESTAMP)", where="updated_at IS NULL",
+                 progress=progress)
+        # Fires for the stored columns only: the derived-column triggers rewrite their columns on every
+        # insert, and its own update of updated_at must not fire it again. A migration that adds a
+        # column to the table should recreate it.
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in UNTRACKED_COLUMNS]
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_touch')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_touch AFTER UPDATE OF {', '.join(columns)} ON {table}
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_tombstone AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO contact_tombstones (contact_table, contact_id, upload_id) VALUES ('{table}', OLD.id, OLD.upload_id);
+            END
+        ''')
+        # Delta syncs read the rows changed since a watermark in (updated_at, id) order from this
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)')
+
+    # Per destination: the highest updated_at and tombstone id it has acknowledged, and the sync in flight
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_sync_state (
+            destination TEXT PRIMARY KEY,
+            updated_watermark TEXT,
+            tombstone_watermark INTEGER NOT NULL DEFAULT 0,
+            pending_outbox_ids TEXT,
+            pending_updated_watermark TEXT,
+            pending_tombstone_watermark INTEGER,
+            acknowledged_at TIMESTAMP
+        )
+    ''')
+
+@migration(16, "contact tombstones only while a webhook sync is set up")
+def conditional_tombstones(conn, progress):
+    # Only a destination's delta sync reads tombstones, and its first sync skips those logged before it
+    for table in ('journalists', 'media_titles'):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_tombstone')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_tombstone AFTER DELETE ON {table}
+            WHEN EXISTS (SELECT 1 FROM webhook_sync_state)
+            BEGIN
+                INSERT INTO contact_tombstones (contact_table, contact_id, upload_id) VALUES ('{table}', OLD.id, OLD.upload_id);
+            END
+        ''')
+    conn.execute("DELETE FROM contact_tombstones WHERE NOT EXISTS (SELECT 1 FROM webhook_sync_state)")
@@ -0,0 +1,239 @@
+"""
+Webhook outbox: payloads are stored first and delivered in the background.
+
+enqueue() records a payload in webhook_outbox, with a webhook_deliveries row per
+destination, on the caller's connection and without committing, so it is written
+in the same transaction as the data it describes. After the commit, notify()
+wakes the delivery worker, a thread that posts due deliveries through the shared
+WebhookDispatcher. Payloads written in several transactions (the parts of a
+chunked export) are stored first and scheduled together at the end, so no part is
+sent unless all of them were written.
+  - a delivery is claimed by moving its next_attempt_at a lease ahead, so two
+    processes never post it at once and one that dies mid-post is retried later;
+  - a failed post is retried with exponential backoff; after OUTBOX_MAX_ATTEMPTS,
+    or on a 4xx that retrying cannot fix, it moves to webhook_dead_letters;
+  - every payload has an idempotency key: the client's Idempotency-Key, or a new
+    one per call. Enqueueing a key already in the outbox sends nothing new to a
+    destination that has it pending or delivered, but re-arms one whose delivery
+    was dead-lettered. The key is sent as the Idempotency-Key header so a receiver
+    can drop a repeat whose first response was lost.
+The worker exits when nothing is left to deliver; notify() starts it again.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import database
+
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_BASE_DELAY = float(os.environ.get('OUTBOX_BASE_DELAY', 5)) # Seconds before the first retry, doubling each time
+OUTBOX_MAX_DELAY = float(os.environ.get('OUTBOX_MAX_DELAY', 900))
+OUTBOX_RETENTION = float(os.environ.get('OUTBOX_RETENTION', 7 * 24 * 3600)) # Seconds delivered payloads (and keys) are kept
+OUTBOX_LEASE = 120 # Seconds a claimed delivery is left to its worker before another may retry it
+OUTBOX_BATCH = 20 # Deliveries claimed, and posted in parallel, at a time
+PRUNE_INTERVAL = 3600
+RETRYABLE_STATUSES = (408, 425, 429) # 4xx responses worth retrying; other 4xx are dead-lettered at once
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+_pruned_at = 0
+
+def enqueue(conn, payload, idempotency_key=None, destinations=None):
+    """
+    Records payload for delivery to each destination (default: database.WEBHOOK_URLS).
+    Without an idempotency key it is always queued as new; only a repeated key is
+    deduplicated. Does not commit. Returns (outbox_id, queued). If the key is already in the outbox,
+    only the destinations without a delivery (one that was dead-lettered, say) are
+    scheduled again; queued is False if there were none.
+    """
+    body = json.dumps(payload)
+    outbox_id, _ = store(conn, body, idempotency_key or uuid.uuid4().hex)
+    return outbox_id, schedule(conn, [outbox_id], destinations) > 0
+
+def store(conn, body, idempotency_key):
+    """
+    Adds an encoded payload to the outbox without scheduling it; schedule() makes it
+    deliverable. Does not commit. Returns (outbox_id, stored); stored is False if the
+    key was already there.
+    """
+    cursor = conn.execute(
+        "INSERT INTO webhook_outbox (idempotency_key, payload) VALUES (?, ?) ON CONFLICT (idempotency_key) DO NOTHING",
+        (idempotency_key, body)
+    )
+    if cursor.rowcount == 0:
+        return conn.execute("SELECT id FROM webhook_outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()[0], False
+    return cursor.lastrowid, True
+
+def schedule(conn, outbox_ids, destinations=None):
+    """
+    Creates the due deliveries of stored payloads, skipping any that already exist.
+    Does not commit. Returns how many were created.
+    """
+    now = time.time()
+    destinations = database.WEBHOOK_URLS if destinations is None else destinations
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT INTO webhook_deliveries (outbox_id, destination, next_attempt_at) VALUES (?, ?, ?) "
+        "ON CONFLICT (outbox_id, destination) DO NOTHING",
+        [(outbox_id, url, now) for outbox_id in outbox_ids for url in destinations]
+    )
+    return conn.total_changes - before
+
+def backoff(attempts):
+    """Seconds to wait after the given number of failed attempts, randomised so retries spread out."""
+    delay = min(OUTBOX_BASE_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+def retryable(result):
+    status = result.status_code
+    return status is None or status >= 500 or status in RETRYABLE_STATUSES # None: no response (timeout, refused)
+
+def claim_due(conn, now, limit=OUTBOX_BATCH):
+    """Leases up to `limit` due deliveries to this worker and commits. Returns their rows."""
+    claimed = conn.execute('''
+        UPDATE webhook_deliveries SET next_attempt_at = ?
+        WHERE id IN (SELECT id FROM webhook_deliveries WHERE delivered_at IS NULL AND next_attempt_at <= ?
+                     ORDER BY next_attempt_at LIMIT ?)
+        RETURNING id, outbox_id, destination, attempts
+    ''', (now + OUTBOX_LEASE, now, limit)).fetchall()
+    conn.commit()
+    return claimed
+
+def record_result(conn, delivery, message, result, now):
+    """Marks a delivery delivered, schedules its retry, or moves it to the dead letters."""
+    attempts = delivery['attempts'] + 1
+    if result.ok:
+        conn.execute("UPDATE webhook_deliveries SET attempts = ?, last_error = NULL, delivered_at = CURRENT_TIMESTAMP "
+                     "WHERE id = ?", (attempts, delivery['id']))
+    elif attempts >= OUTBOX_MAX_ATTEMPTS or not retryable(result):
+        conn.execute(
+            "INSERT INTO webhook_dead_letters (idempotency_key, destination, payload, attempts, last_error) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (message['idempotency_key'], delivery['destination'], message['payload'], attempts, result.error)
+        )
+        conn.execute("DELETE FROM webhook_deliveries WHERE id = ?", (delivery['id'],))
+        print(f"Gave up on webhook {delivery['destination']} for outbox entry {delivery['outbox_id']} "
+              f"after {attempts} attempts: {result.error}")
+    else:
+        conn.execute("UPDATE webhook_deliveries SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                     (attempts, result.error, now + backoff(attempts), delivery['id']))
+
+def deliver_due(dispatcher=None):
+    """Posts every delivery that is due, a batch at a time. Returns how many posts were made."""
+    dispatcher = dispatcher or database.get_webhook_dispatcher()
+    conn = database.get_db_connection()
+    posted = 0
+    try:
+        while True:
+            claimed = claim_due(conn, time.time())
+            if not claimed:
+                return posted
+            outbox_ids = sorted({delivery['outbox_id'] for delivery in claimed})
+            messages = {row['id']: row for row in conn.execute(
+                f"SELECT id, idempotency_key, payload FROM webhook_outbox WHERE id IN ({', '.join('?' * len(outbox_ids))})",
+                outbox_ids)}
+            # Posted outside any transaction: the lease keeps other workers off these deliveries meanwhile
+            results = dispatcher.post_all([
+                (d['destination'], messages[d['outbox_id']]['payload'],
+                 {'Idempotency-Key': messages[d['outbox_id']]['idempotency_key']})
+                for d in claimed
+            ])
+            now = time.time()
+            for delivery, result in zip(claimed, results):
+                record_result(conn, delivery, messages[delivery['outbox_id']], result, now)
+            conn.commit()
+            posted += len(claimed)
+    finally:
+        conn.close()
+
+def next_attempt_at(conn):
+    """When the earliest undelivered delivery is due (Unix time), or None if there are none."""
+    return conn.execute("SELECT MIN(next_attempt_at) FROM webhook_deliveries WHERE delivered_at IS NULL").fetchone()[0]
+
+def prune(conn, older_than):
+    """Removes payloads created before `older_than` (Unix time) once every delivery of them is finished."""
+    conn.execute('''
+        DELETE FROM webhook_deliveries WHERE delivered_at IS NOT NULL
+        AND outbox_id IN (SELECT id FROM webhook_outbox WHERE created_at < datetime(?, 'unixepoch'))
+    ''', (older_than,))
+    cursor = conn.execute('''
+        DELETE FROM webhook_outbox WHERE created_at < datetime(?, 'unixepoch')
+        AND NOT EXISTS (SELECT 1 FROM webhook_deliveries d WHERE d.outbox_id = webhook_outbox.id)
+    ''', (older_than,))
+    conn.commit()
+    return cursor.rowcount
+
+def requeue_dead_letter(conn, dead_letter_id):
+    """Puts a dead-lettered delivery back in the outbox with its attempts reset. Commits; returns the outbox id or None."""
+    letter = conn.execute("SELECT * FROM webhook_dead_letters WHERE id = ?", (dead_letter_id,)).fetchone()
+    if letter is None:
+        return None
+    conn.execute("INSERT INTO webhook_outbox (idempotency_key, payload) VALUES (?, ?) ON CONFLICT (idempotency_key) DO NOTHING",
+                 (letter['idempotency_key'], letter['payload']))
+    outbox_id = conn.execute("SELECT id FROM webhook_outbox WHERE idempotency_key = ?",
+                             (letter['idempotency_key'],)).fetchone()[0]
+    conn.execute('''
+        INSERT INTO webhook_deliveries (outbox_id, destination, next_attempt_at) VALUES (?, ?, ?)
+        ON CONFLICT (outbox_id, destination) DO UPDATE SET
+            attempts = 0, last_error = NULL, delivered_at = NULL, next_attempt_at = excluded.next_attempt_at
+    ''', (outbox_id, letter['destination'], time.time()))
+    conn.execute("DELETE FROM webhook_dead_letters WHERE id = ?", (dead_letter_id,))
+    conn.commit()
+    return outbox_id
+
+def get_status(conn, outbox_id):
+    """An outbox entry's deliveries and dead letters as a JSON-ready dict, or None."""
+    message = conn.execute("SELECT id, idempotency_key, created_at FROM webhook_outbox WHERE id = ?", (outbox_id,)).fetchone()
+    if message is None:
+        return None
+    deliveries = conn.execute(
+        "SELECT destination, attempts, last_error, delivered_at, next_attempt_at FROM webhook_deliveries "
+        "WHERE outbox_id = ? ORDER BY id", (outbox_id,)).fetchall()
+    dead_letters = conn.execute(
+        "SELECT id, destination, attempts, last_error, failed_at FROM webhook_dead_letters "
+        "WHERE idempotency_key = ? ORDER BY id", (message['idempotency_key'],)).fetchall()
+    return {
+        **dict(message),
+        'deliveries': [{**dict(row), 'status': 'delivered' if row['delivered_at'] else 'pending'} for row in deliveries],
+        'dead_letters': [dict(row) for row in dead_letters],
+    }
+
+# --- Delivery Worker ---
+
+def notify():
+    """Wakes the delivery worker after a commit that enqueued payloads, starting it if it is not running."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, name='webhook-outbox', daemon=True)
+            _worker.start()
+        else:
+            _wake.set()
+
+def _run_worker():
+    global _worker, _pruned_at
+    while True:
+        try:
+            deliver_due()
+            conn = database.get_db_connection()
+            try:
+                if time.time() - _pruned_at > PRUNE_INTERVAL:
+                    prune(conn, time.time() - OUTBOX_RETENTION)
+                    _pruned_at = time.time()
+                due = next_attempt_at(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error in webhook outbox worker: {e}")
+            due = time.time() + OUTBOX_BASE_DELAY
+        with _worker_lock:
+            # Checked under the lock so a notify() that found this thread running is not lost
+            if due is None and not _wake.is_set():
+                _worker = None
+                return
+        _wake.wait(0 if due is None else max(0.0, due - time.time()))
+        _wake.clear()
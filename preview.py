@@ -0,0 +1,179 @@
+"""
+Import preview: what is in a CSV file and how it most likely maps onto a contact table.
+
+One pass over at most PREVIEW_SCAN_ROWS records keeps the first rows, a reservoir
+sample of the rows after them and fixed-size statistics per column, so memory does
+not grow with the size of the file.
+"""
+import csv
+import heapq
+import os
+import random
+import re
+
+from fuzzywuzzy import fuzz
+
+PREVIEW_FIRST_ROWS = 10
+PREVIEW_MAX_FIRST_ROWS = 100
+PREVIEW_SAMPLE_SIZE = 20
+PREVIEW_SCAN_ROWS = int(os.environ.get('PREVIEW_SCAN_ROWS', 20000))
+DISTINCT_SKETCH_SIZE = 256 # Distinct counts are exact below this, estimated above it
+SUGGEST_MIN_SCORE = 80
+
+_HASH_SPACE = 1 << 64
+_TYPE_PATTERNS = [
+    ('integer', re.compile(r'[+-]?(0|[1-9]\d{0,14})')),
+    ('number', re.compile(r'[+-]?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?')),
+    ('boolean', re.compile(r'(?i)true|false|yes|no')),
+    ('date', re.compile(r'(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})([ T]\d{1,2}:\d{2}(:\d{2})?)?')),
+    ('email', re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')),
+    ('url', re.compile(r'(?i)(https?://|www\.)\S+')),
+    ('phone', re.compile(r'\+?[\d\s().-]{7,20}')),
+]
+
+
+def infer_type(value):
+    """Best type name for a non-empty cell value, 'text' if nothing more specific fits."""
+    for name, pattern in _TYPE_PATTERNS:
+        if pattern.fullmatch(value):
+            return name
+    return 'text'
+
+
+class DistinctSketch:
+    """
+    K-minimum-values estimate of the number of distinct values: keeps the k smallest
+    value hashes, so it is exact up to k values and uses O(k) memory after that.
+    """
+    def __init__(self, k=DISTINCT_SKETCH_SIZE):
+        self.k = k
+        self.heap = [] # Negated hashes: a max-heap of the k smallest
+        self.members = set()
+
+    def add(self, value):
+        h = hash(value) % _HASH_SPACE
+        if h in self.members:
+            return
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, -h)
+            self.members.add(h)
+        elif h < -self.heap[0]:
+            self.members.discard(-heapq.heapreplace(self.heap, -h))
+            self.members.add(h)
+
+    @property
+    def exact(self):
+        return len(self.heap) < self.k
+
+    def estimate(self):
+        if self.exact:
+            return len(self.heap)
+        return int((self.k - 1) * _HASH_SPACE / (-self.heap[0] + 1))
+
+
+class ColumnProfile:
+    def __init__(self, header, index):
+        self.header = header
+        self.index = index
+        self.filled = 0
+        self.types = {}
+        self.distinct = DistinctSketch()
+
+    def add(self, value):
+        value = value.strip()
+        if not value:
+            return
+        self.filled += 1
+        value_type = infer_type(value)
+        self.types[value_type] = self.types.get(value_type, 0) + 1
+        self.distinct.add(value)
+
+    def summary(self, rows_scanned):
+        inferred_type, type_count = max(self.types.items(), key=lambda item: item[1], default=('empty', 0))
+        return {
+            "header": self.header,
+            "index": self.index,
+            "fill_rate": round(self.filled / rows_scanned, 3) if rows_scanned else 0.0,
+            "distinct_estimate": self.distinct.estimate(),
+            "distinct_exact": self.distinct.exact,
+            "inferred_type": inferred_type,
+            "type_share": round(type_count / self.filled, 3) if self.filled else 0.0,
+        }
+
+
+def _name_key(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+def suggest_mapping(headers, db_columns, min_score=SUGGEST_MIN_SCORE):
+    """
+    Fuzzy-matches CSV headers onto db columns. The best scoring pairs are taken first
+    and every header and column is used at most once. Returns {header: db_column}.
+    """
+    column_keys = {col: _name_key(col) for col in db_columns}
+    candidates = []
+    for header in headers:
+        header_key = _name_key(header)
+        if not header_key:
+            continue
+        for col, col_key in column_keys.items():
+            score = 101 if header_key == col_key else fuzz.WRatio(header_key, col_key)
+            if score >= min_score:
+                candidates.append((score, header, col))
+
+    mapping = {}
+    used_columns = set()
+    for score, header, col in sorted(candidates, key=lambda c: -c[0]):
+        if header not in mapping and col not in used_columns:
+            mapping[header] = col
+            used_columns.add(col)
+    return mapping
+
+def preview_csv(stream, db_columns=(), first_rows=PREVIEW_FIRST_ROWS, sample_size=PREVIEW_SAMPLE_SIZE,
+                scan_rows=PREVIEW_SCAN_ROWS, seed=0):
+    """
+    Reads the header and at most scan_rows records from a text-mode CSV stream.
+    Returns the headers, the first rows, a uniform sample of the other scanned rows,
+    per-column statistics and a suggested mapping onto db_columns.
+    """
+    reader = csv.reader(stream)
+    headers = [header.strip() for header in next(reader)] # StopIteration: empty file
+    profiles = [ColumnProfile(header, i) for i, header in enumerate(headers)]
+    head, sample = [], []
+    rng = random.Random(seed)
+    rows_scanned = ragged_rows = 0
+    complete = True
+
+    for row in reader:
+        if not row:
+            continue # Blank line
+        if rows_scanned == scan_rows:
+            complete = False
+            break
+        rows_scanned += 1
+        if len(row) != len(headers):
+            ragged_rows += 1
+        for profile, value in zip(profiles, row):
+            profile.add(value)
+
+        if len(head) < first_rows:
+            head.append(row)
+        else:
+            # Reservoir sampling (algorithm R) over the rows after the first ones
+            seen = rows_scanned - len(head)
+            if len(sample) < sample_size:
+                sample.append(row)
+            else:
+                slot = rng.randrange(seen)
+                if slot < sample_size:
+                    sample[slot] = row
+
+    return {
+        "headers": headers,
+        "first_rows": head,
+        "sample_rows": sample,
+        "rows_scanned": rows_scanned,
+        "ragged_rows": ragged_rows,
+        "complete": complete,
+        "columns": [profile.summary(rows_scanned) for profile in profiles],
+        "suggested_mapping": suggest_mapping(headers, db_columns),
+    }
@@ -0,0 +1,247 @@
+"""
+Query-plan audit: finds the statements the app issues that read a whole contact table.
+
+recording() collects the SQL every pooled connection runs, with its parameters bound
+in (the sqlite3 trace callback). full_scans() runs EXPLAIN QUERY PLAN on each of
+them and reports those whose plan has a plain SCAN of a hot table, i.e. no usable
+index. Their cost grows with the table. The few scans made on purpose are listed
+in ALLOWED_SCANS.
+
+test_query_plans.py drives the API over a seeded database with exercise() and fails
+on any other scan. Run this module to print the plan of every statement instead:
+
+    python query_audit.py [--contacts 5000]
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from unittest import mock
+
+import database
+import outbox
+import webhooks
+
+HOT_TABLES = ('journalists', 'media_titles', 'contact_facets')
+
+# search.VISIBLE_CONTACT as normalized
+VISIBLE = r"IFNULL\(upload_id, \?\) NOT IN \(SELECT id FROM uploads WHERE deleted_at IS NOT NULL\)"
+
+# (pattern over the normalized statement, why reading the whole table is intended)
+ALLOWED_SCANS = [
+    (re.compile(rf"^SELECT \* FROM (journalists|media_titles)( WHERE {VISIBLE})?$"),
+     "send_all exports both tables in full"),
+    (re.compile(rf"^SELECT .+ FROM (journalists|media_titles|companies|uploads) (WHERE {VISIBLE} )?ORDER BY id LIMIT \?$"),
+     "the first batch of a table read walks the rowid order and stops at the limit"),
+]
+
+STATEMENT_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+NOT_ALIASES = {'where', 'join', 'inner', 'left', 'cross', 'on', 'using', 'order', 'group', 'limit', 'union',
+               'natural', 'indexed', 'not', 'as', 'set', 'values', 'having', 'window', 'except', 'intersect'}
+
+@contextmanager
+def recording():
+    """
+    Yields a list that collects the SQL of every statement run on a pooled connection
+    until the block ends. The pool is emptied on the way in and out, so every
+    connection used in between is a traced one.
+    """
+    statements = []
+    lock = threading.Lock()
+
+    def record(sql):
+        with lock:
+            statements.append(sql)
+
+    def hook(conn):
+        conn.set_trace_callback(record)
+
+    database.close_pool()
+    database.CONNECT_HOOKS.append(hook)
+    try:
+        yield statements
+    finally:
+        database.CONNECT_HOOKS.remove(hook)
+        database.close_pool()
+
+def normalize(sql):
+    """sql with its literals replaced by ? and whitespace collapsed, so repeats of a statement compare equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'(?<![\w.])-?\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\?(?:\s*,\s*\?)+', '?', sql) # IN lists of any length
+    return ' '.join(sql.split())
+
+def is_query(sql):
+    """Whether sql is a statement with a query plan (not PRAGMA, DDL, a transaction or a trigger marker)."""
+    words = sql.lstrip().split(None, 1)
+    return bool(words) and words[0].upper() in STATEMENT_KEYWORDS
+
+def table_aliases(sql):
+    """
+    {name or alias used in sql: [tables]}, for reading plan lines that name an alias.
+    An alias reused across the arms of a UNION maps to each of its tables in turn.
+    """
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases.setdefault(table, []).append(table)
+        if alias and alias.lower() not in NOT_ALIASES:
+            aliases.setdefault(alias, []).append(table)
+    return aliases
+
+def query_plan(conn, sql):
+    """The detail lines of EXPLAIN QUERY PLAN for sql."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+def scanned_tables(sql, plan, tables=HOT_TABLES):
+    """The tables among `tables` that a plan reads in full, without an index."""
+    aliases = table_aliases(sql)
+    scanned = []
+    for detail in plan:
+        match = re.fullmatch(r'SCAN (\w+)', detail)
+        if not match:
+            continue
+        candidates = aliases.get(match.group(1), [match.group(1)])
+        # Plan lines come in the order the tables appear in the statement
+        table = candidates.pop(0) if len(candidates) > 1 else candidates[0]
+        if table in tables:
+            scanned.append(table)
+    return scanned
+
+def allowed_reason(statement):
+    """Why a normalized statement may scan a table, or None."""
+    for pattern, reason in ALLOWED_SCANS:
+        if pattern.match(statement):
+            return reason
+    return None
+
+def full_scans(conn, statements, tables=HOT_TABLES):
+    """
+    {normalized statement: (scanned tables, plan)} for the statements that scan any of
+    tables and are not in ALLOWED_SCANS. Each distinct statement is planned once.
+    """
+    found, seen = {}, set()
+    for sql in statements:
+        statement = normalize(sql)
+        if statement in seen or not is_query(sql):
+            continue
+        seen.add(statement)
+        try:
+            plan = query_plan(conn, sql)
+        except sqlite3.Error:
+            continue # Temporary objects or a schema that has moved on since the statement ran
+        scanned = scanned_tables(sql, plan, tables)
+        if scanned and allowed_reason(statement) is None:
+            found[statement] = (scanned, plan)
+    return found
+
+# --- Workload ---
+
+CITIES = ['London', 'Leeds', 'Bristol', 'York', 'Bath']
+
+def seed(conn, contacts=2000, uploads=4):
+    """Fills the contact tables with contacts spread over uploads, and refreshes the planner statistics."""
+    upload_ids = [conn.execute("INSERT INTO uploads (name) VALUES (?)", (f"Upload {i}",)).lastrowid for i in range(uploads)]
+    for table in ('journalists', 'media_titles'):
+        conn.executemany(
+            f"INSERT INTO {table} (name, Email, outletName, City, Country, MediaType, JobTitle, Focus, upload_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((f"Contact {i}", f"{table}{i}@example.com", f"Outlet {i % 97}", CITIES[i % len(CITIES)], 'UK', 'Online',
+              f"Editor {i % 13}", 'Tech, Health', upload_ids[i % uploads]) for i in range(contacts)))
+    conn.execute("INSERT INTO staff (staff_name, staff_email) VALUES ('Sam', 'sam@example.com')")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    return upload_ids
+
+def exercise(client, upload_ids):
+    """Calls the contact endpoints the way the pages do, as a logged-in client."""
+    upload = upload_ids[0]
+    gets = [
+        '/api/uploads', '/api/media-contacts', '/api/media-contacts?page=3&page_size=20', '/api/media-contacts?q=contact',
+        '/api/media-contacts/search', '/api/media-contacts/search?City=Leeds&q=contact&page=2',
+        f'/api/upload/{upload}', f'/api/upload/{upload}?sort=City&order=desc&offset=100',
+        f'/api/upload/{upload}?filter=outletName:outlet 1&q=contact',
+        '/api/outlets/journalists', '/api/outlets/media_titles', '/api/outlets/all', f'/api/outlets/all?upload_id={upload}',
+        '/api/cities/all', f'/api/cities/all?upload_id={upload}', '/api/typeahead/outletName?q=out',
+        f'/api/typeahead/City?q=le&upload_id={upload}', '/api/search/outletName?q=outlet', '/api/search?q=contact',
+        '/api/table/journalists', '/api/table/media_titles?limit=50&after=100', '/api/table/journalists/schema',
+    ]
+    for url in gets:
+        client.get(url)
+    client.post('/api/outreach/prepare-follow-up', json={
+        'press_release_id': 1, 'staff_id': 1, 'upload_ids': [str(upload)], 'subject': 'Hello'})
+    with mock.patch.object(outbox, 'notify'):
+        sent = client.post('/api/webhook/send_targeted_outreach', json={
+            'target_table': 'journalists', 'outlet_names': ['Outlet 1', 'Outlet 2'],
+            'staff_members': [{'staff_name': 'Sam', 'staff_email': 'sam@example.com'}]})
+        client.post('/api/webhook/send_all')
+        client.post('/api/webhook/send_all?chunk_size=0')
+        client.post('/api/webhook/sync')
+    client.get('/api/webhook/sync')
+    client.get(f"/api/webhook/outbox/{sent.get_json()['outbox_id']}")
+    # The worker's statements, run here with every post accepted
+    dispatcher = mock.Mock()
+    dispatcher.post_all.side_effect = lambda posts: [webhooks.DeliveryResult(url, True, 200, 0, None) for url, _, _ in posts]
+    outbox.deliver_due(dispatcher)
+    client.post('/api/import/run', content_type='multipart/form-data', data={
+        'file': (io.BytesIO(b"Name,Email,Outlet\nNew Contact,contact1@example.com,Outlet 1\nOther,other@example.com,Outlet 2\n"),
+                 'contacts.csv'),
+        'target_table': 'journalists', 'upload_name': 'Audit upload', 'import_mode': 'update',
+        'column_mapping': json.dumps({'Name': 'name', 'Email': 'Email', 'Outlet': 'outletName'}),
+    })
+    client.put(f'/api/upload/{upload_ids[-1]}', json={'name': 'Renamed'})
+    client.delete(f'/api/upload/{upload_ids[-1]}')
+
+def login(client):
+    """Creates and logs in an admin user for exercise()."""
+    from user import User
+    user = User(username='audit', is_admin=True)
+    user.set_password('audit')
+    user.save()
+    client.post('/login', data={'username': 'audit', 'password': 'audit'})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contacts', type=int, default=5000)
+    args = parser.parse_args()
+
+    from app import app
+    app.config['TESTING'] = True
+    with tempfile.TemporaryDirectory() as directory:
+        database.close_pool()
+        database.DATABASE_NAME = os.path.join(directory, 'audit.db')
+        database.create_tables()
+        conn = database.get_db_connection()
+        upload_ids = seed(conn, args.contacts)
+        conn.close()
+        client = app.test_client()
+        login(client)
+        with recording() as statements:
+            exercise(client, upload_ids)
+
+        conn = sqlite3.connect(database.DATABASE_NAME)
+        planned = set()
+        for sql in statements:
+            statement = normalize(sql)
+            if statement in planned or not is_query(sql):
+                continue
+            planned.add(statement)
+            plan = query_plan(conn, sql)
+            scanned = scanned_tables(sql, plan)
+            flag = ('SCAN ' + allowed_reason(statement) if allowed_reason(statement) else 'FULL SCAN') if scanned else 'ok'
+            print(f"[{flag}] {statement[:200]}")
+            for detail in plan:
+                print(f"    {detail}")
+        scans = full_scans(conn, statements)
+        conn.close()
+        database.close_pool()
+    print(f"\n{len(planned)} statements, {len(scans)} with unexpected full scans")
+
+if __name__ == '__main__':
+    main()
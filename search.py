@@ -0,0 +1,162 @@
+"""
+Contact search over the contacts_fts full-text index (migration 4).
+
+Listings page with opaque keyset cursors: a page ends with the sort key of its
+last row, and the next page seeks past that key through each table's (name_sort, id)
+index (migrations 5 and 7) instead of skipping OFFSET rows.
+
+The index covers name, outletName, Email and Focus of both contact tables and is
+kept current by triggers. Its rowid is id * 2 + the table bit from
+migrations.CONTACT_FTS_TABLES, so a match joins back to its row by primary key.
+"""
+import base64
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from migrations import CONTACT_FTS_TABLES
+
+CONTACT_TYPES = {'journalists': 'journalist', 'media_titles': 'media_title'}
+COUNT_CACHE_SIZE = 256
+# Leaves out the contacts of uploads being deleted (jobs.delete_upload) until their rows are gone
+VISIBLE_CONTACT = "IFNULL(upload_id, 0) NOT IN (SELECT id FROM uploads WHERE deleted_at IS NOT NULL)"
+
+_count_cache = OrderedDict() # (query key, data generation) -> count, least recently used first
+_count_cache_lock = threading.Lock()
+
+def match_expression(q):
+    """
+    FTS5 query for free text: every word of q must start a word of the contact
+    (so "jo smi" finds "John Smith"). Returns None if q has no words.
+    """
+    terms = re.findall(r'\w+', q or '')
+    if not terms:
+        return None
+    # \w+ terms cannot contain quotes or FTS5 operators
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def contacts_sql(columns, match=None):
+    """
+    Returns (sql, params) for a SELECT of `columns` over both contact tables, with a
+    `type` column and a `rank` column (bm25, lower is better; 0 when not searching).
+    With a match expression only the matching contacts are selected, via the index.
+    Contacts of uploads being deleted are left out.
+    """
+    selects = []
+    params = []
+    for table, bit in CONTACT_FTS_TABLES.items():
+        select = ', '.join(f"c.{col}" for col in columns)
+        if match is None:
+            selects.append(f"SELECT {select}, '{CONTACT_TYPES[table]}' AS type, 0 AS rank FROM {table} c WHERE {VISIBLE_CONTACT}")
+        else:
+            selects.append(
+                f"SELECT {select}, '{CONTACT_TYPES[table]}' AS type, f.rank AS rank "
+                f"FROM contacts_fts f JOIN {table} c ON c.id = f.rowid >> 1 "
+                f"WHERE contacts_fts MATCH ? AND f.rowid & 1 = {bit} AND {VISIBLE_CONTACT}"
+            )
+            params.append(match)
+    return "\nUNION ALL\n".join(selects), params
+
+def count_sql(match=None):
+    """
+    Returns (sql, params) counting the listed contacts with a valid email (matching
+    the search, if any). Without a search, each table's count is read from its
+    (email_valid) index, less the contacts of hidden uploads found through (upload_id).
+    """
+    if match is not None:
+        sql, params = contacts_sql(['email_valid'], match)
+        return f"SELECT COUNT(*) AS total FROM ({sql}) AS contacts WHERE email_valid = 1", params
+    # CROSS JOIN keeps uploads outermost, so only hidden uploads' contacts are read
+    counts = [f"(SELECT COUNT(*) FROM {table} WHERE email_valid = 1) - "
+              f"(SELECT COUNT(*) FROM uploads u CROSS JOIN {table} c ON c.upload_id = u.id "
+              f"WHERE u.deleted_at IS NOT NULL AND c.email_valid = 1)"
+              for table in CONTACT_FTS_TABLES]
+    return f"SELECT {' + '.join(counts)} AS total", []
+
+def encode_cursor(key):
+    """Opaque, URL-safe cursor for the sort key of the last row on a page."""
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, ranked=False):
+    """
+    Sort key from encode_cursor(): [name_sort, type, id], or [rank, name_sort, type, id]
+    for a ranked search. Raises ValueError for anything else.
+    """
+    key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if ranked:
+        if not isinstance(key, list) or len(key) != 4 or not isinstance(key[0], (int, float)):
+            raise ValueError("Invalid cursor")
+        name_key = key[1:]
+    else:
+        name_key = key
+    if (not isinstance(name_key, list) or len(name_key) != 3 or not isinstance(name_key[0], str)
+            or name_key[1] not in CONTACT_TYPES.values() or not isinstance(name_key[2], int)):
+        raise ValueError("Invalid cursor")
+    return key
+
+def contacts_after_sql(columns, after, limit):
+    """
+    Returns (sql, params) for the first `limit` listed contacts with a valid email in
+    (name_sort, type, id) order after the sort key `after` (None for the first page).
+    Each table is read in its (name_sort, id) index order from the seek point, so the
+    cost does not depend on how deep the page is.
+    """
+    selects = []
+    params = []
+    for table in CONTACT_FTS_TABLES:
+        contact_type = CONTACT_TYPES[table]
+        conditions = ["email_valid = 1", VISIBLE_CONTACT] # email_valid also selects the partial index
+        if after is not None:
+            name_sort, after_type, after_id = after
+            # Within the same name, this table's rows come after the key if its type sorts later,
+            # and from after_id on if it is the cursor's own table
+            if contact_type == after_type:
+                conditions.append("(name_sort, id) > (?, ?)")
+                params.extend([name_sort, after_id])
+            else:
+                conditions.append("name_sort >= ?" if contact_type > after_type else "name_sort > ?")
+                params.append(name_sort)
+        select = ', '.join(columns)
+        selects.append(
+            f"SELECT * FROM (SELECT {select}, '{contact_type}' AS type FROM {table} "
+            f"WHERE {' AND '.join(conditions)} ORDER BY name_sort, id LIMIT ?)"
+        )
+        params.append(limit)
+    return "\nUNION ALL\n".join(selects) + "\nORDER BY name_sort, type, id LIMIT ?", params + [limit]
+
+def count_key(q):
+    """Cache key for the contacts matching q: its FTS query, ignoring case and punctuation."""
+    return match_expression((q or '').lower()) or ''
+
+def cached_count(key, generation, count):
+    """
+    Returns count() for `key`, reusing the result for as long as the data generation
+    (database.get_data_generation) is the same.
+    """
+    cache_key = (key, generation)
+    with _count_cache_lock:
+        if cache_key in _count_cache:
+            _count_cache.move_to_end(cache_key)
+            return _count_cache[cache_key]
+    total = count()
+    with _count_cache_lock:
+        _count_cache[cache_key] = total
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total
+
+def peek_count(key, generation):
+    """The cached count for `key` at this generation, or None."""
+    with _count_cache_lock:
+        return _count_cache.get((key, generation))
+
+def estimate_count(conn, match=None):
+    """
+    Cheap upper bound for the number of contacts: all indexed matches of the search,
+    or the highest ids handed out (ids are AUTOINCREMENT, so never reused), ignoring
+    email validity either way.
+    """
+    if match is not None:
+        return conn.execute("SELECT COUNT(*) FROM contacts_fts WHERE contacts_fts MATCH ?", (match,)).fetchone()[0]
+    return sum(conn.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0] for table in CONTACT_FTS_TABLES)
@@ -2,7 +2,13 @@
 let uploadedFile = null;
 let currentOutreachStep = 1;
 let outreachSelections = { staff: [], outlets: [] };
+let currentImportJobId = null;
 const API_BASE_URL = '/api';
+const IMPORT_POLL_INTERVAL_MS = 1000;
+const OUTLET_TYPEAHEAD_LIMIT = 50;
+const OUTLET_SEARCH_DELAY_MS = 150;
+let outletSearchTimer = null;
+let outletSearchRequest = 0;
 
 // --- Main App Initialization ---
 function initApp() {
@@ -31,9 +37,12 @@ function initApp() {
 
     if (mappingModal) {
         mappingModal.addEventListener('click', (event) => {
-            if (event.target.id === 'closeMappingModalBtn' || event.target.id === 'cancelMappingBtn') closeMappingModal();
+            if (event.target.id === 'closeMappingModalBtn' || event.target.id === 'cancelMappingBtn') {
+                if (currentImportJobId) handleCancelImport();
+                else closeMappingModal();
+            }
             else if (event.target.id === 'runImportBtn') handleRunImport();
-            else if (event.target === mappingModal) closeMappingModal();
+            else if (event.target === mappingModal && !currentImportJobId) closeMappingModal();
         });
     }
 
@@ -44,6 +53,17 @@ function initApp() {
             else if (event.target.id === 'outreachSendBtn') handleSendTargetedOutreach();
             else if (event.target === outreachModal) resetOutreachModal();
         });
+        outreachModal.addEventListener('change', (event) => {
+            if (event.target.name === 'outlet') toggleOutreachOutlet(event.target.value, event.target.checked);
+        });
+    }
+
+    const outreachOutletSearch = document.getElementById('outreach-outlet-search');
+    if (outreachOutletSearch) {
+        outreachOutletSearch.addEventListener('input', () => {
+            clearTimeout(outletSearchTimer);
+            outletSearchTimer = setTimeout(() => loadOutreachOutlets(outreachOutletSearch.value), OUTLET_SEARCH_DELAY_MS);
+        });
     }
 
     if (mobileNavToggle && leftSidebar) {
@@ -190,6 +210,8 @@ async function handleFileSelect(event) {
     }
     const formData = new FormData();
     formData.append('file', uploadedFile);
+    const targetTableSelect = document.getElementById('targetTableSelect');
+    if (targetTableSelect) formData.append('target_table', targetTableSelect.value);
 
     const mappingTableContainer = document.getElementById('mapping-table-container');
     if (mappingTableContainer) mappingTableContainer.innerHTML = '<p><i>Analyzing CSV headers...</i></p>';
@@ -202,7 +224,7 @@ async function handleFileSelect(event) {
             throw new Error(errorData.error || 'Failed to preview CSV.');
         }
         const data = await response.json();
-        buildMappingUI(data.headers);
+        buildMappingUI(data);
     } catch (error) {
         console.error('Error during CSV preview:', error);
         alert(`Error: ${error.message}`);
@@ -210,7 +232,15 @@ async function handleFileSelect(event) {
     }
 }
 
-async function buildMappingUI(csvHeaders) {
+function describeColumn(column, firstRow) {
+    if (!column) return '';
+    const distinct = column.distinct_exact ? column.distinct_estimate : `~${column.distinct_estimate}`;
+    const example = firstRow && firstRow[column.index] ? firstRow[column.index] : '';
+    return `${column.inferred_type}, ${Math.round(column.fill_rate * 100)}% filled, ${distinct} distinct` +
+        (example ? `<br><small>e.g. ${escapeHTML(example)}</small>` : '');
+}
+
+async function buildMappingUI(preview) {
     const targetTableSelect = document.getElementById('targetTableSelect');
     const mappingTableContainer = document.getElementById('mapping-table-container');
     const runImportBtn = document.getElementById('runImportBtn');
@@ -218,6 +248,8 @@ async function buildMappingUI(csvHeaders) {
         alert("Mapping modal elements are missing. Cannot proceed."); return;
     }
     const targetTable = targetTableSelect.value;
+    const csvHeaders = preview.headers;
+    const suggestedMapping = preview.suggested_mapping || {};
     try {
         const response = await fetch(`${API_BASE_URL}/table/${targetTable}/schema`);
         if (!response.ok) throw new Error("Could not fetch table schema.");
@@ -225,18 +257,18 @@ async function buildMappingUI(csvHeaders) {
         const dbColumns = schemaData.columns;
         let optionsHtml = '<option value="">-- Ignore this column --</option>';
         dbColumns.forEach(col => { optionsHtml += `<option value="${col}">${col}</option>`; });
-        let mappingHtml = `<table class="mapping-table"><thead><tr><th>CSV Column</th><th>Database Field</th></tr></thead><tbody>`;
-        csvHeaders.forEach(header => {
-            mappingHtml += `<tr><td>${escapeHTML(header)}</td><td><select class="form-control mapping-select" data-csv-header="${escapeHTML(header)}">${optionsHtml}</select></td></tr>`;
+        let mappingHtml = `<p><small>Based on the first ${preview.rows_scanned}${preview.complete ? '' : '+'} rows` +
+            (preview.ragged_rows ? `; ${preview.ragged_rows} rows have the wrong number of columns` : '') + `.</small></p>`;
+        mappingHtml += `<table class="mapping-table"><thead><tr><th>CSV Column</th><th>Contents</th><th>Database Field</th></tr></thead><tbody>`;
+        csvHeaders.forEach((header, i) => {
+            mappingHtml += `<tr><td>${escapeHTML(header)}</td><td class="mapping-profile">${describeColumn(preview.columns[i], preview.first_rows[0])}</td>` +
+                `<td><select class="form-control mapping-select" data-csv-header="${escapeHTML(header)}">${optionsHtml}</select></td></tr>`;
         });
         mappingHtml += '</tbody></table>';
         mappingTableContainer.innerHTML = mappingHtml;
-        csvHeaders.forEach(header => {
-            const matchingColumn = dbColumns.find(col => col.toLowerCase() === header.toLowerCase().trim());
-            if (matchingColumn) {
-                const selectElement = mappingTableContainer.querySelector(`select[data-csv-header="${escapeHTML(header)}"]`);
-                if(selectElement) selectElement.value = matchingColumn;
-            }
+        mappingTableContainer.querySelectorAll('.mapping-select').forEach(selectElement => {
+            const suggestion = suggestedMapping[selectElement.dataset.csvHeader];
+            if (suggestion && dbColumns.includes(suggestion)) selectElement.value = suggestion;
         });
         runImportBtn.disabled = false;
     } catch (error) {
@@ -272,21 +304,62 @@ async function handleRunImport() {
     formData.append('target_table', targetTable);
     formData.append('column_mapping', JSON.stringify(columnMapping));
     formData.append('upload_name', uploadName);
+    const importModeSelect = document.getElementById('importModeSelect');
+    if (importModeSelect) formData.append('import_mode', importModeSelect.value);
     try {
-        const response = await fetch(`${API_BASE_URL}/import/run`, { method: 'POST', body: formData });
+        // The import runs as a background job; we poll it instead of holding one long request open
+        const response = await fetch(`${API_BASE_URL}/import/jobs`, { method: 'POST', body: formData });
         const result = await response.json();
         if (!response.ok) throw new Error(result.error || 'An unknown error occurred.');
-        showFlashMessage(result.message, 'success');
-        closeMappingModal();
-        loadUploads();
+        currentImportJobId = result.job_id;
+        const job = await pollImportJob(result.status_url, runImportBtn);
+        if (job.status === 'completed') {
+            showFlashMessage(job.message, job.rows_failed ? 'warning' : 'success');
+            closeMappingModal();
+            loadUploads();
+        } else if (job.status === 'cancelled') {
+            showFlashMessage(job.message, 'info');
+            closeMappingModal();
+        } else {
+            throw new Error(job.message || 'The import did not complete.');
+        }
     } catch (error) {
         console.error("Error running import:", error);
         showFlashMessage(`Import Failed: ${error.message}`, 'danger');
     } finally {
+        currentImportJobId = null;
         if (runImportBtn) { runImportBtn.disabled = false; runImportBtn.textContent = 'Run Import'; }
     }
 }
 
+async function pollImportJob(statusUrl, runImportBtn) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        if (!response.ok) throw new Error(job.error || 'Could not fetch import progress.');
+        if (['completed', 'failed', 'cancelled'].includes(job.status)) return job;
+        if (runImportBtn) {
+            runImportBtn.textContent = job.status === 'queued'
+                ? 'Queued...'
+                : `Importing... ${job.rows_done.toLocaleString()} rows`;
+        }
+        await new Promise(resolve => setTimeout(resolve, IMPORT_POLL_INTERVAL_MS));
+    }
+}
+
+async function handleCancelImport() {
+    if (!confirm("Cancel this import? Rows imported so far will be removed.")) return;
+    try {
+        const response = await fetch(`${API_BASE_URL}/import/jobs/${currentImportJobId}/cancel`, { method: 'POST' });
+        const result = await response.json();
+        if (!response.ok) throw new Error(result.error || 'Could not cancel the import.');
+        // pollImportJob() picks up the cancelled status and closes the modal
+    } catch (error) {
+        console.error("Error cancelling import:", error);
+        showFlashMessage(`Error: ${error.message}`, 'danger');
+    }
+}
+
 // --- Outreach Modal Logic ---
 function showOutreachStep(stepNumber) {
     const outreachNextBtn = document.getElementById('outreachNextBtn');
@@ -308,10 +381,12 @@ function resetOutreachModal() {
     const outreachModal = document.getElementById('outreachModal');
     const staffContainer = document.getElementById('outreach-staff-list-container');
     const outletsContainer = document.getElementById('outreach-outlets-list-container');
+    const outletSearch = document.getElementById('outreach-outlet-search');
     outreachSelections = { staff: [], outlets: [] };
     showOutreachStep(1);
     if(staffContainer) staffContainer.innerHTML = '<p>Loading staff...</p>';
     if(outletsContainer) outletsContainer.innerHTML = '<p>Loading outlets...</p>';
+    if(outletSearch) outletSearch.value = '';
     if (outreachModal) outreachModal.style.display = 'none';
 }
 
@@ -345,30 +420,47 @@ async function handleOutreachNext() {
         showOutreachStep(2);
     } else if (currentOutreachStep === 2) {
         showOutreachStep(3);
-        const outletsContainer = document.getElementById('outreach-outlets-list-container');
-        try {
-            const response = await fetch(`${API_BASE_URL}/outlets/all`);
-            const outlets = await response.json();
-            let listHtml = '';
-            outlets.forEach(outlet => {
-                listHtml += `<div class="multi-select-item"><input type="checkbox" id="outlet_${outlet.replace(/\s+/g, '')}" name="outlet" value="${escapeHTML(outlet)}"><label for="outlet_${outlet.replace(/\s+/g, '')}">${escapeHTML(outlet)}</label></div>`;
-            });
-            outletsContainer.innerHTML = listHtml || '<p>No outlets found in the database.</p>';
-        } catch (error) {
-            console.error("Error loading outlets for outreach:", error);
-            outletsContainer.innerHTML = '<p class="alert alert-danger">Could not load outlets.</p>';
-        }
+        loadOutreachOutlets('');
     } else if (currentOutreachStep === 3) {
-        outreachSelections.outlets = [];
-        const checkedOutlets = document.querySelectorAll('#outreach-outlets-list-container input[type="checkbox"]:checked');
-        if (checkedOutlets.length === 0) { alert("Please select at least one outlet."); return; }
-        checkedOutlets.forEach(checkbox => { outreachSelections.outlets.push(checkbox.value); });
+        if (outreachSelections.outlets.length === 0) { alert("Please select at least one outlet."); return; }
         document.getElementById('outreach-final-staff-list').innerHTML = '<ul>' + outreachSelections.staff.map(s => `<li>${escapeHTML(s.staff_name)}</li>`).join('') + '</ul>';
         document.getElementById('outreach-final-outlets-list').innerHTML = '<ul>' + outreachSelections.outlets.map(o => `<li>${escapeHTML(o)}</li>`).join('') + '</ul>';
         showOutreachStep(4);
     }
 }
 
+async function loadOutreachOutlets(query) {
+    // Completions come from the server; the full outlet list is never downloaded
+    const outletsContainer = document.getElementById('outreach-outlets-list-container');
+    if (!outletsContainer) return;
+    const request = ++outletSearchRequest;
+    try {
+        const response = await fetch(`${API_BASE_URL}/typeahead/outletName?q=${encodeURIComponent(query)}&limit=${OUTLET_TYPEAHEAD_LIMIT}`);
+        const completions = await response.json();
+        if (!response.ok) throw new Error(completions.error || 'Could not load outlets.');
+        if (request !== outletSearchRequest) return; // A newer search has been sent
+
+        // Selected outlets stay listed whatever the search, above its results
+        const shown = outreachSelections.outlets.map(value => ({ value, count: null }));
+        completions.forEach(outlet => { if (!outreachSelections.outlets.includes(outlet.value)) shown.push(outlet); });
+        let listHtml = '';
+        shown.forEach((outlet, i) => {
+            const checked = outreachSelections.outlets.includes(outlet.value) ? 'checked' : '';
+            const count = outlet.count === null ? '' : ` <span class="outlet-count">(${outlet.count} contacts)</span>`;
+            listHtml += `<div class="multi-select-item"><input type="checkbox" id="outlet_${i}" name="outlet" value="${escapeHTML(outlet.value)}" ${checked}><label for="outlet_${i}">${escapeHTML(outlet.value)}${count}</label></div>`;
+        });
+        outletsContainer.innerHTML = listHtml || (query ? '<p>No outlets match your search.</p>' : '<p>No outlets found in the database.</p>');
+    } catch (error) {
+        console.error("Error loading outlets for outreach:", error);
+        if (request === outletSearchRequest) outletsContainer.innerHTML = '<p class="alert alert-danger">Could not load outlets.</p>';
+    }
+}
+
+function toggleOutreachOutlet(outlet, selected) {
+    const others = outreachSelections.outlets.filter(value => value !== outlet);
+    outreachSelections.outlets = selected ? [...others, outlet] : others;
+}
+
 async function handleSendTargetedOutreach() {
     const outreachSendBtn = document.getElementById('outreachSendBtn');
     if(outreachSendBtn) { outreachSendBtn.disabled = true; outreachSendBtn.textContent = 'Sending...'; }
@@ -2,53 +2,156 @@ document.addEventListener('DOMContentLoaded', function() {
     const uploadId = window.location.pathname.split('/').pop();
     const uploadNameSpan = document.getElementById('upload-name');
     const uploadDataContainer = document.getElementById('upload-data-container');
+    const uploadSearchInput = document.getElementById('upload-search');
+    const uploadDataStatus = document.getElementById('upload-data-status');
+
+    const PAGE_SIZE = 100;
+    const FILTER_DELAY_MS = 250;
+
+    // Rows are fetched a window at a time as the user scrolls; changing the sort,
+    // a filter or the search starts again from the first window.
+    const state = { headers: null, sort: 'id', order: 'asc', q: '', filters: {}, loaded: 0, total: 0, loading: false };
+    let requestGeneration = 0; // Responses for an older sort/filter are dropped
+    let tableBody = null;
+    let sentinelObserver = null;
+    let filterTimer = null;
+
+    function pageUrl(offset) {
+        const params = new URLSearchParams({ offset, limit: PAGE_SIZE, sort: state.sort, order: state.order });
+        if (state.q) params.append('q', state.q);
+        Object.entries(state.filters).forEach(([column, text]) => {
+            if (text) params.append('filter', `${column}:${text}`);
+        });
+        return `/api/upload/${uploadId}?${params}`;
+    }
+
+    async function fetchJSON(url) {
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+    }
 
     async function loadUploadData() {
         try {
-            const uploadResponse = await fetch(`/api/upload/${uploadId}`);
-            if (!uploadResponse.ok) {
-                throw new Error(`HTTP error! status: ${uploadResponse.status}`);
-            }
-            const uploadData = await uploadResponse.json();
+            const uploadData = await fetchJSON(pageUrl(0));
 
             if (uploadNameSpan) {
                 uploadNameSpan.textContent = uploadData.upload_name;
             }
 
-            if (uploadData.records.length === 0) {
+            if (uploadData.total === 0) {
                 uploadDataContainer.innerHTML = '<p>No data found for this upload.</p>';
                 return;
             }
 
-            const schemaResponse = await fetch(`/api/table/${uploadData.table_name}/schema`);
-            if (!schemaResponse.ok) {
-                throw new Error(`HTTP error! status: ${schemaResponse.status}`);
-            }
-            const schemaData = await schemaResponse.json();
-            const headers = schemaData.columns;
+            const schemaData = await fetchJSON(`/api/table/${uploadData.table_name}/schema`);
+            state.headers = schemaData.columns;
+            renderTable();
+            showRows(uploadData, true);
+        } catch (error) {
+            console.error('Error loading upload data:', error);
+            uploadDataContainer.innerHTML = '<p class="alert alert-danger">Error loading data. Please try again later.</p>';
+        }
+    }
 
-            let tableHtml = '<table class="companies-table"><thead><tr>';
-            headers.forEach(header => {
-                tableHtml += `<th>${escapeHTML(header)}</th>`;
+    function renderTable() {
+        let tableHtml = '<table class="companies-table"><thead><tr>';
+        state.headers.forEach(header => {
+            tableHtml += `<th class="sortable" data-column="${escapeHTML(header)}" style="cursor: pointer;">${escapeHTML(header)}<span class="sort-indicator"></span></th>`;
+        });
+        tableHtml += '</tr><tr>';
+        state.headers.forEach(header => {
+            tableHtml += `<th><input type="search" class="form-control form-control-sm column-filter" data-column="${escapeHTML(header)}" placeholder="Filter"></th>`;
+        });
+        tableHtml += '</tr></thead><tbody></tbody></table><div id="upload-data-sentinel"></div>';
+        uploadDataContainer.innerHTML = tableHtml;
+        tableBody = uploadDataContainer.querySelector('tbody');
+
+        uploadDataContainer.querySelectorAll('th.sortable').forEach(th => {
+            th.addEventListener('click', () => {
+                const column = th.dataset.column;
+                state.order = state.sort === column && state.order === 'asc' ? 'desc' : 'asc';
+                state.sort = column;
+                reload();
             });
-            tableHtml += '</tr></thead><tbody>';
-
-            uploadData.records.forEach(record => {
-                tableHtml += '<tr>';
-                headers.forEach(header => {
-                    tableHtml += `<td>${escapeHTML(record[header])}</td>`;
-                });
-                tableHtml += '</tr>';
+        });
+        uploadDataContainer.querySelectorAll('.column-filter').forEach(input => {
+            input.addEventListener('input', () => {
+                state.filters[input.dataset.column] = input.value.trim();
+                scheduleReload();
             });
-            tableHtml += '</tbody></table>';
-            uploadDataContainer.innerHTML = tableHtml;
+        });
+
+        if (sentinelObserver) sentinelObserver.disconnect();
+        sentinelObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+        }, { rootMargin: '400px' });
+        sentinelObserver.observe(document.getElementById('upload-data-sentinel'));
+        updateSortIndicators();
+    }
 
+    function showRows(page, replace) {
+        let rowsHtml = '';
+        page.records.forEach(record => {
+            rowsHtml += '<tr>';
+            state.headers.forEach(header => {
+                rowsHtml += `<td>${escapeHTML(record[header])}</td>`;
+            });
+            rowsHtml += '</tr>';
+        });
+        if (replace) {
+            tableBody.innerHTML = rowsHtml;
+            state.loaded = 0;
+        } else {
+            tableBody.insertAdjacentHTML('beforeend', rowsHtml);
+        }
+        state.loaded += page.records.length;
+        state.total = page.total;
+        if (uploadDataStatus) {
+            uploadDataStatus.textContent = `Showing ${state.loaded} of ${state.total} rows`;
+        }
+    }
+
+    async function loadNextPage() {
+        if (state.loading || !tableBody || state.loaded >= state.total) return;
+        state.loading = true;
+        const generation = requestGeneration;
+        try {
+            const page = await fetchJSON(pageUrl(state.loaded));
+            if (generation === requestGeneration) showRows(page, false);
+        } catch (error) {
+            console.error('Error loading more upload data:', error);
+        } finally {
+            if (generation === requestGeneration) state.loading = false;
+        }
+    }
+
+    async function reload() {
+        const generation = ++requestGeneration;
+        state.loading = false;
+        updateSortIndicators();
+        try {
+            const page = await fetchJSON(pageUrl(0));
+            if (generation === requestGeneration) showRows(page, true);
         } catch (error) {
             console.error('Error loading upload data:', error);
-            uploadDataContainer.innerHTML = '<p class="alert alert-danger">Error loading data. Please try again later.</p>';
         }
     }
 
+    function scheduleReload() {
+        clearTimeout(filterTimer);
+        filterTimer = setTimeout(reload, FILTER_DELAY_MS);
+    }
+
+    function updateSortIndicators() {
+        uploadDataContainer.querySelectorAll('th.sortable').forEach(th => {
+            const indicator = th.querySelector('.sort-indicator');
+            indicator.textContent = th.dataset.column === state.sort ? (state.order === 'asc' ? ' ▲' : ' ▼') : '';
+        });
+    }
+
     function escapeHTML(str) {
         if (str === null || str === undefined) return '';
         return String(str).replace(/[&<>"']/g, match => ({
@@ -56,5 +159,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }[match]));
     }
 
+    if (uploadSearchInput) {
+        uploadSearchInput.addEventListener('input', () => {
+            state.q = uploadSearchInput.value.trim();
+            if (tableBody) scheduleReload();
+        });
+    }
+
     loadUploadData();
 });
@@ -0,0 +1,78 @@
+"""
+Whole-table reads for /api/table/<table_name>.
+
+Rows are read in id order in keyset batches (WHERE id > last id ... LIMIT n). Each
+batch is its own short statement, so a full-table read never holds every row in
+memory, nor a read snapshot open for as long as the client takes to download it.
+pooled_row_batches() also holds a pooled connection only while it reads a batch.
+"""
+TABLES = ('journalists', 'media_titles', 'companies', 'uploads')
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH = 500
+
+def table_columns(conn, table):
+    """Column names of table in schema order: what a projection may ask for."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def parse_columns(conn, table, requested):
+    """
+    Columns listed in the comma-separated string `requested` (every column when it is
+    empty), in the order given. Raises ValueError naming any the table does not have.
+    """
+    allowed = table_columns(conn, table)
+    if not requested:
+        return allowed
+    columns = list(dict.fromkeys(col.strip() for col in requested.split(',') if col.strip()))
+    unknown = [col for col in columns if col not in allowed]
+    if unknown or not columns:
+        raise ValueError(f"Unknown columns for {table}: {', '.join(unknown) or requested!r}")
+    return columns
+
+def select_after(conn, table, columns, after, limit, where=None):
+    """
+    Up to `limit` rows of id plus columns with id greater than `after` (None for the
+    start), in id order; where is an extra SQL condition the rows must meet.
+    """
+    select = ', '.join(dict.fromkeys(['id', *columns]))
+    conditions = ([] if after is None else ["id > ?"]) + ([] if where is None else [where])
+    where_sql = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+    params = ([] if after is None else [after]) + [limit]
+    return conn.execute(f"SELECT {select} FROM {table} {where_sql}ORDER BY id LIMIT ?", params).fetchall()
+
+def read_page(conn, table, columns, after=None, limit=PAGE_SIZE):
+    """Returns ([{column: value}], next_after): one page and the `after` of the next one, None on the last page."""
+    rows = select_after(conn, table, columns, after, limit + 1)
+    next_after = rows[limit - 1]['id'] if len(rows) > limit else None
+    return [{col: row[col] for col in columns} for row in rows[:limit]], next_after
+
+def row_batches(conn, table, columns, after=None, limit=None, batch_size=STREAM_BATCH, where=None):
+    """Yields lists of {column: value} for the rows after `after` (and meeting where) in id order, at most `limit` rows in all."""
+    return _batches(lambda after, size: select_after(conn, table, columns, after, size, where),
+                    columns, after, limit, batch_size)
+
+def pooled_row_batches(pool, table, columns, after=None, limit=None, batch_size=STREAM_BATCH):
+    """
+    row_batches() checking a connection out of pool for each batch and back in before
+    yielding it, so a slow download keeps none from other requests.
+    """
+    def select(after, size):
+        conn = pool.acquire()
+        try:
+            return select_after(conn, table, columns, after, size)
+        finally:
+            conn.close()
+    return _batches(select, columns, after, limit, batch_size)
+
+def _batches(select, columns, after, limit, batch_size):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        rows = select(after, size)
+        if rows:
+            yield [{col: row[col] for col in columns} for row in rows]
+        if len(rows) < size:
+            return
+        after = rows[-1]['id']
+        if remaining is not None:
+            remaining -= len(rows)
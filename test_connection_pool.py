@@ -0,0 +1,77 @@
+import unittest
+import os
+import threading
+import database
+from app import app
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.db_name = 'test_connection_pool.db'
+        database.DATABASE_NAME = self.db_name
+        database.create_tables()
+
+    def tearDown(self):
+        database.close_pool()
+        os.remove(self.db_name)
+
+    def test_close_returns_connection_to_pool(self):
+        conn = database.get_db_connection()
+        conn.close()
+        # The same warm connection is handed out again instead of opening a new one
+        self.assertIs(database.get_db_connection(), conn)
+        conn.close()
+
+    def test_uncommitted_work_is_discarded_on_release(self):
+        conn = database.get_db_connection()
+        conn.execute("INSERT INTO companies (name) VALUES ('Uncommitted Co')")
+        conn.close()
+        conn = database.get_db_connection()
+        count = conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+        conn.close()
+        self.assertEqual(count, 0)
+
+    def test_one_connection_per_app_context(self):
+        with app.app_context():
+            first = database.get_db_connection()
+            first.close() # No-op inside an app context
+            second = database.get_db_connection()
+            self.assertIs(first, second)
+            self.assertTrue(first.checked_out)
+        # Teardown handed it back to the pool
+        self.assertFalse(first.checked_out)
+
+    def test_pool_is_bounded(self):
+        pool = database.ConnectionPool(self.db_name, max_size=2, timeout=0.1)
+        conns = [pool.acquire(), pool.acquire()]
+        with self.assertRaises(database.PoolTimeoutError):
+            pool.acquire()
+        conns[0].close()
+        conns.append(pool.acquire())
+        for conn in conns[1:]:
+            conn.close()
+        pool.close()
+
+    def test_pool_is_thread_safe(self):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(50):
+                    conn = database.get_db_connection()
+                    conn.execute("SELECT COUNT(*) FROM users").fetchone()
+                    conn.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(database.get_pool()._idle), database.POOL_SIZE)
+
+if __name__ == '__main__':
+    unittest.main()
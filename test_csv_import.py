@@ -0,0 +1,240 @@
+import unittest
+import os
+import io
+import json
+import database
+import importer
+import preview
+from app import app
+
+class CsvImportTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.db_name = 'test_csv_import.db'
+        database.DATABASE_NAME = self.db_name
+        database.create_tables()
+
+        from user import User
+        user = User(username='testuser', is_admin=True)
+        user.set_password('password')
+        user.save()
+        self.app.post('/login', data=dict(username='testuser', password='password'), follow_redirects=True)
+
+    def tearDown(self):
+        database.close_pool()
+        os.remove(self.db_name)
+
+    def run_import(self, csv_text, mapping, **extra):
+        data = {
+            'file': (io.BytesIO(csv_text.encode('utf-8')), 'contacts.csv'),
+            'target_table': 'journalists',
+            'column_mapping': json.dumps(mapping),
+            'upload_name': 'Test Upload',
+        }
+        data.update(extra)
+        return self.app.post('/api/import/run', content_type='multipart/form-data', data=data)
+
+    def test_ragged_rows_are_reported_not_fatal(self):
+        csv_text = (
+            "Name,Outlet,Email\n"
+            "John Smith,Test News,john@example.com\n"
+            "Short Row\n"
+            "\n"
+            "Jane Doe,Another Paper,jane@example.com\n"
+        )
+        response = self.run_import(csv_text, {'Name': 'name', 'Outlet': 'outletName', 'Email': 'Email'})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['imported_rows'], 2)
+        self.assertEqual(data['failed_rows'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertIn('rows_per_second', data)
+
+        conn = database.get_db_connection()
+        rows = conn.execute("SELECT name, outletName, Email, upload_id FROM journalists ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual([tuple(r)[:3] for r in rows], [
+            ('John Smith', 'Test News', 'john@example.com'),
+            ('Jane Doe', 'Another Paper', 'jane@example.com'),
+        ])
+        self.assertEqual(rows[0]['upload_id'], data['upload_id'])
+
+    def test_import_fills_derived_columns(self):
+        csv_text = 'Name,Email,Focus\n  Zoe Adams ,zoe@example.com," Tech, Startups ,,"\nNo Mail,not-an-email,\n'
+        self.run_import(csv_text, {'Name': 'name', 'Email': 'Email', 'Focus': 'Focus'})
+        conn = database.get_db_connection()
+        rows = conn.execute("SELECT email_valid, name_sort, categories FROM journalists ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual([tuple(r) for r in rows], [
+            (1, 'zoe adams', '["Tech","Startups"]'),
+            (0, 'no mail', '[]'),
+        ])
+
+    def test_single_column_mapping(self):
+        response = self.run_import("Email,Ignored\na@example.com,x\nb@example.com,y\n", {'Email': 'Email', 'Ignored': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['imported_rows'], 2)
+
+    def test_unmatched_mapping_is_rejected_without_upload(self):
+        response = self.run_import("Email\na@example.com\n", {'Missing': 'Email'})
+        self.assertEqual(response.status_code, 400)
+        conn = database.get_db_connection()
+        uploads = conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+        conn.close()
+        self.assertEqual(uploads, 0)
+
+    def test_derived_and_unknown_columns_are_not_mappable(self):
+        conn = database.get_db_connection()
+        columns = importer.mappable_columns(conn, 'journalists')
+        conn.close()
+        for derived in ('email_valid', 'name_sort', 'categories'):
+            self.assertNotIn(derived, columns)
+        for target in ('categories', 'email_valid', 'name = 1, Email'):
+            response = self.run_import("Email,Other\nnotanemail,x\n", {'Email': 'Email', 'Other': target})
+            self.assertEqual(response.status_code, 400, target)
+
+    def test_commits_between_chunks(self):
+        csv_text = "Name\n" + "".join(f"Contact {i}\n" for i in range(10))
+        seen = []
+
+        def progress(stats):
+            # Each chunk is already committed and visible to other connections
+            other = database.get_db_connection()
+            seen.append(other.execute("SELECT COUNT(*) FROM journalists").fetchone()[0])
+            other.close()
+
+        conn = database.get_db_connection()
+        stats = importer.import_csv(conn, io.StringIO(csv_text), 'journalists', 'Chunked', {'Name': 'name'},
+                                    chunk_size=4, progress=progress)
+        conn.close()
+        self.assertEqual(stats['imported_rows'], 10)
+        self.assertEqual(seen, [4, 8, 10])
+
+    def test_preview_profiles_columns_and_suggests_mapping(self):
+        csv_text = "Full Name,Outlet,E-mail,Job Title,Zip,Notes\n" + "".join(
+            f"Contact {i},Paper {i % 3},c{i}@example.com,Editor,{10000 + i},{'x' if i % 4 == 0 else ''}\n" for i in range(60)
+        )
+        response = self.app.post('/api/import/preview', content_type='multipart/form-data', data={
+            'file': (io.BytesIO(csv_text.encode('utf-8')), 'contacts.csv'), 'target_table': 'journalists', 'rows': '5',
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['headers'][2], 'E-mail')
+        self.assertEqual(len(data['first_rows']), 5)
+        self.assertEqual(len(data['sample_rows']), 20)
+        self.assertEqual((data['rows_scanned'], data['complete']), (60, True))
+        self.assertEqual(data['suggested_mapping'],
+                         {'Full Name': 'name', 'Outlet': 'outletName', 'E-mail': 'Email', 'Job Title': 'JobTitle'})
+
+        columns = {c['header']: c for c in data['columns']}
+        self.assertEqual((columns['E-mail']['inferred_type'], columns['E-mail']['distinct_estimate']), ('email', 60))
+        self.assertEqual((columns['Outlet']['distinct_estimate'], columns['Outlet']['distinct_exact']), (3, True))
+        self.assertEqual(columns['Zip']['inferred_type'], 'integer')
+        self.assertEqual(columns['Notes']['fill_rate'], 0.25)
+
+    def test_preview_stops_after_scan_limit(self):
+        stream = io.StringIO("Email\n" + "".join(f"c{i}@example.com\n" for i in range(5000)))
+        result = preview.preview_csv(stream, ['Email'], scan_rows=1000)
+        self.assertEqual((result['rows_scanned'], result['complete']), (1000, False))
+        self.assertEqual(len(result['sample_rows']), preview.PREVIEW_SAMPLE_SIZE)
+
+        sketch = preview.DistinctSketch(k=64)
+        for i in range(20000):
+            sketch.add(f"value {i % 5000}")
+        self.assertFalse(sketch.exact)
+        self.assertLess(len(sketch.members), 65)
+        self.assertTrue(3500 < sketch.estimate() < 7000)
+
+    def contact_rows(self):
+        conn = database.get_db_connection()
+        rows = conn.execute("SELECT name, outletName, Email, email_key, upload_id FROM journalists ORDER BY id").fetchall()
+        conn.close()
+        return [tuple(r) for r in rows]
+
+    def test_import_modes_deduplicate_on_normalized_email(self):
+        mapping = {'Name': 'name', 'Outlet': 'outletName', 'Email': 'Email'}
+        first = self.run_import("Name,Outlet,Email\nJohn Smith,Test News,John@Example.com\n", mapping).get_json()
+
+        csv_text = (
+            "Name,Outlet,Email\n"
+            "John S.,, john@example.COM \n"     # Same contact, blank outlet
+            "Jane Doe,Another Paper,jane@example.com\n"
+            "Jane D.,Third Paper,JANE@example.com\n" # Duplicate within the file
+            "No Email,Somewhere,\n"
+        )
+        skipped = self.run_import(csv_text, mapping, import_mode='skip').get_json()
+        self.assertEqual((skipped['new_rows'], skipped['updated_rows'], skipped['skipped_rows']), (2, 0, 2))
+        self.assertIn('2 rows were skipped', skipped['message'])
+
+        updated = self.run_import(csv_text, mapping, import_mode='update').get_json()
+        self.assertEqual((updated['new_rows'], updated['updated_rows'], updated['skipped_rows']), (1, 3, 0))
+        self.assertEqual(updated['imported_rows'], 4)
+
+        self.assertEqual(self.contact_rows(), [
+            # Updated in place: stays in its upload and keeps its outlet where the new cell was blank
+            ('John S.', 'Test News', 'John@Example.com', 'john@example.com', first['upload_id']),
+            ('Jane D.', 'Third Paper', 'jane@example.com', 'jane@example.com', skipped['upload_id']),
+            ('No Email', 'Somewhere', '', None, skipped['upload_id']),
+            ('No Email', 'Somewhere', '', None, updated['upload_id']),
+        ])
+
+        # Plain inserts keep duplicates, without taking the key from the existing contact
+        inserted = self.run_import(csv_text, mapping).get_json()
+        self.assertEqual((inserted['new_rows'], inserted['updated_rows'], inserted['skipped_rows']), (4, 0, 0))
+        conn = database.get_db_connection()
+        keyed = conn.execute("SELECT COUNT(*) FROM journalists WHERE email_key = 'jane@example.com'").fetchone()[0]
+        normalized = conn.execute("SELECT COUNT(*) FROM journalists WHERE email_normalized = 'jane@example.com'").fetchone()[0]
+        conn.close()
+        self.assertEqual((keyed, normalized), (1, 3))
+
+    def test_dedupe_modes_need_an_email_mapping(self):
+        response = self.run_import("Name\nJohn\n", {'Name': 'name'}, import_mode='update')
+        self.assertEqual(response.status_code, 400)
+        response = self.run_import("Name\nJohn\n", {'Name': 'name'}, import_mode='merge')
+        self.assertEqual(response.status_code, 400)
+
+    def write_tricky_csv(self, rows=40):
+        path = 'test_parallel_import.csv'
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write('Name,"Notes\nheader",Email\r\n')
+            for i in range(rows):
+                if i % 7 == 3:
+                    f.write(f"Short {i}\r\n") # Ragged
+                else:
+                    f.write(f'Contact {i},"Line one\nline ""two"", café {i}",c{i}@example.com\r\n')
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_record_boundaries_respect_quoted_newlines(self):
+        path = self.write_tricky_csv()
+        header_end = importer._first_record_end(path)
+        boundaries = importer.find_record_boundaries(path, header_end, chunk_bytes=50)
+        self.assertGreater(len(boundaries), 10)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(boundaries[-1], len(data))
+        for start, end in zip(boundaries, boundaries[1:]):
+            piece = data[start:end].decode('utf-8')
+            self.assertEqual(piece.count('"') % 2, 0) # No record is cut inside a quoted field
+            self.assertTrue(piece.endswith('\r\n'))
+
+    def test_parallel_import_matches_serial_import(self):
+        path = self.write_tricky_csv()
+        mapping = {'Name': 'name', 'Notes\nheader': 'Focus', 'Email': 'Email'}
+        conn = database.get_db_connection()
+        with open(path, encoding='utf-8', newline='') as stream:
+            serial = importer.import_csv(conn, stream, 'journalists', 'Serial', mapping, chunk_size=7)
+        parallel = importer.import_csv_file_parallel(conn, path, 'media_titles', 'Parallel', mapping,
+                                                     workers=2, chunk_bytes=200, chunk_size=7)
+        serial_rows = conn.execute("SELECT name, Focus, Email FROM journalists ORDER BY id").fetchall()
+        parallel_rows = conn.execute("SELECT name, Focus, Email FROM media_titles ORDER BY id").fetchall()
+        conn.close()
+
+        self.assertEqual([tuple(r) for r in parallel_rows], [tuple(r) for r in serial_rows])
+        for key in ('rows_read', 'imported_rows', 'failed_rows', 'errors'):
+            self.assertEqual(parallel[key], serial[key], key)
+        self.assertEqual(serial['failed_rows'], 6)
+
+if __name__ == '__main__':
+    unittest.main()
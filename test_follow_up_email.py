@@ -30,6 +30,8 @@ class FollowUpEmailTestCase(unittest.TestCase):
 
     def tearDown(self):
         # Clean up the test database
+        import database
+        database.close_pool()
         os.remove(self.db_name)
 
     def test_add_and_get_follow_up_email(self):
@@ -99,10 +101,11 @@ class FollowUpEmailTestCase(unittest.TestCase):
         response = self.app.get('/api/cities/all')
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
-        self.assertEqual(len(data), 3)
-        self.assertIn('City A', data)
-        self.assertIn('City B', data)
-        self.assertIn('City C', data)
+        self.assertEqual(data, [
+            {'value': 'City A', 'count': 2},
+            {'value': 'City B', 'count': 1},
+            {'value': 'City C', 'count': 1},
+        ])
 
     def test_search_field(self):
         # Add some data to the journalists table
@@ -0,0 +1,171 @@
+import unittest
+import unittest.mock
+import os
+import io
+import json
+import shutil
+import tempfile
+import time
+import database
+import importer
+import jobs
+from app import app
+
+class ImportJobsTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.db_name = 'test_import_jobs.db'
+        database.DATABASE_NAME = self.db_name
+        database.create_tables()
+        self.spool_dir = tempfile.mkdtemp()
+        jobs.IMPORT_SPOOL_DIR = self.spool_dir
+
+        from user import User
+        user = User(username='testuser', is_admin=True)
+        user.set_password('password')
+        user.save()
+        self.app.post('/login', data=dict(username='testuser', password='password'), follow_redirects=True)
+
+    def tearDown(self):
+        database.close_pool()
+        os.remove(self.db_name)
+        shutil.rmtree(self.spool_dir)
+
+    def csv_text(self, rows):
+        return "Name,Email\n" + "".join(f"Contact {i},contact{i}@example.com\n" for i in range(rows))
+
+    def queue_job(self, rows, chunk_size=2):
+        path = os.path.join(self.spool_dir, 'queued.csv')
+        with open(path, 'w') as f:
+            f.write(self.csv_text(rows))
+        conn = database.get_db_connection()
+        cursor = conn.execute(
+            "INSERT INTO import_jobs (target_table, upload_name, column_mapping, chunk_size, file_path) VALUES (?, ?, ?, ?, ?)",
+            ('journalists', 'Queued Upload', json.dumps({'Name': 'name', 'Email': 'Email'}), chunk_size, path)
+        )
+        conn.commit()
+        conn.close()
+        return cursor.lastrowid, path
+
+    def count_journalists(self):
+        conn = database.get_db_connection()
+        count = conn.execute("SELECT COUNT(*) FROM journalists").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_job_runs_in_background_and_reports_progress(self):
+        response = self.app.post('/api/import/jobs', content_type='multipart/form-data', data={
+            'file': (io.BytesIO(self.csv_text(25).encode('utf-8')), 'contacts.csv'),
+            'target_table': 'journalists',
+            'column_mapping': json.dumps({'Name': 'name', 'Email': 'Email'}),
+            'upload_name': 'Background Upload',
+            'chunk_size': '10',
+        })
+        self.assertEqual(response.status_code, 202)
+        status_url = response.get_json()['status_url']
+
+        deadline = time.monotonic() + 10
+        while True:
+            job = self.app.get(status_url).get_json()
+            if job['status'] in jobs.FINISHED_STATUSES or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['rows_done'], 25)
+        self.assertEqual(job['rows_failed'], 0)
+        self.assertIsNotNone(job['upload_id'])
+        self.assertNotIn('file_path', job)
+        self.assertEqual(os.listdir(self.spool_dir), []) # Spooled upload removed
+        self.assertEqual(self.count_journalists(), 25)
+
+    def test_cancel_queued_job(self):
+        job_id, path = self.queue_job(5)
+        response = self.app.post(f'/api/import/jobs/{job_id}/cancel')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'cancelled')
+        self.assertFalse(os.path.exists(path))
+
+        jobs.run_import_job(job_id) # A worker picking it up afterwards does nothing
+        self.assertEqual(self.count_journalists(), 0)
+        self.assertEqual(self.app.post(f'/api/import/jobs/{job_id}/cancel').status_code, 409)
+
+    def test_cancel_running_job_removes_its_rows(self):
+        job_id, path = self.queue_job(10, chunk_size=2)
+        real_insert_chunks = importer.insert_chunks
+
+        def cancel_after_start(conn, sql, values, chunk_size, stats, progress=None, **kwargs):
+            jobs.cancel_import_job(job_id)
+            return real_insert_chunks(conn, sql, values, chunk_size, stats, progress, **kwargs)
+
+        with unittest.mock.patch('importer.insert_chunks', side_effect=cancel_after_start):
+            jobs.run_import_job(job_id)
+
+        job = jobs.get_import_job(job_id)
+        self.assertEqual(job['status'], 'cancelled')
+        self.assertEqual(self.count_journalists(), 0)
+        conn = database.get_db_connection()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0], 0)
+        conn.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_unknown_job(self):
+        self.assertEqual(self.app.get('/api/import/jobs/999').status_code, 404)
+        self.assertEqual(self.app.post('/api/import/jobs/999/cancel').status_code, 404)
+
+    def test_upload_delete_hides_then_removes_in_batches(self):
+        conn = database.get_db_connection()
+        doomed, kept = (conn.execute("INSERT INTO uploads (name) VALUES (?)", (name,)).lastrowid for name in ('Doomed', 'Kept'))
+        conn.executemany("INSERT INTO journalists (name, Email, outletName, AddressLine1, upload_id) VALUES (?, ?, 'Daily Post', ?, ?)",
+                         [(f"Contact {i}", f"c{i}@example.com", 'x' * 500, doomed if i % 5 else kept) for i in range(2000)])
+        conn.commit()
+        conn.close()
+        # Cached counts and the in-memory facet index are built before the upload is hidden
+        self.assertEqual(self.app.get('/api/media-contacts').get_json()['total'], 2000)
+        self.assertEqual(self.app.get('/api/media-contacts/search').get_json()['total'], 2000)
+
+        with unittest.mock.patch.object(jobs, 'get_executor') as executor:
+            self.assertEqual(self.app.delete(f'/api/upload/{doomed}').status_code, 202)
+        executor.return_value.submit.assert_called_once_with(jobs.run_upload_delete, doomed)
+        # Hidden straight away, before any row is deleted
+        self.assertEqual(self.count_journalists(), 2000)
+        self.assertEqual([u['id'] for u in self.app.get('/api/uploads').get_json()], [kept])
+        self.assertEqual(self.app.get(f'/api/upload/{doomed}').status_code, 404)
+        self.assertEqual(self.app.get(f'/api/outlets/all?upload_id={doomed}').get_json(), [])
+        self.assertEqual(self.app.delete(f'/api/upload/{doomed}').status_code, 404)
+        self.assertEqual(self.app.get('/api/media-contacts').get_json()['total'], 400)
+        self.assertEqual(self.app.get('/api/media-contacts?q=contact&page_size=200').get_json()['total'], 400)
+        self.assertEqual(self.app.get('/api/media-contacts/search?outletName=Daily+Post').get_json()['total'], 400)
+        cursor_page = self.app.get('/api/media-contacts?cursor=' + self.app.get('/api/media-contacts').get_json()['nextCursor'])
+        self.assertTrue(all(int(item['id'].split('_')[1]) % 5 == 1 for item in cursor_page.get_json()['items']))
+        with unittest.mock.patch('outbox.notify'):
+            outreach = self.app.post('/api/webhook/send_targeted_outreach', json={
+                'target_table': 'journalists', 'outlet_names': ['Daily Post'],
+                'staff_members': [{'staff_name': 'Sam', 'staff_email': 'sam@example.com'}]})
+        self.assertEqual(outreach.get_json()['sent_contacts_count'], 400)
+        with unittest.mock.patch('outbox.notify'):
+            chunked = self.app.post('/api/webhook/send_all?chunk_size=300').get_json()
+            single = self.app.post('/api/webhook/send_all?chunk_size=0').get_json()
+        self.assertEqual((chunked['rows']['journalists'], chunked['parts']), (400, 2))
+        self.assertEqual(single['sent_journalists'], 400)
+        conn = database.get_db_connection()
+        exported = [json.loads(row[0]) for row in conn.execute("SELECT payload FROM webhook_outbox ORDER BY id")]
+        conn.close()
+        self.assertFalse([row for payload in exported for row in payload.get('journalists', ())
+                          if row['upload_id'] == doomed])
+
+        with unittest.mock.patch.object(importer, 'DELETE_BATCH', 300), unittest.mock.patch('time.sleep') as pause:
+            jobs.run_upload_delete(doomed)
+        self.assertEqual(pause.call_count, 5) # Between the six batches of the 1600 rows
+
+        conn = database.get_db_connection()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM journalists").fetchone()[0], 400)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM uploads WHERE id = ?", (doomed,)).fetchone()[0], 0)
+        self.assertEqual(conn.execute("SELECT SUM(contact_count) FROM contact_facets").fetchone()[0], 400)
+        self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0) # Vacuumed
+        conn.close()
+        self.assertEqual(self.app.get(f'/api/outlets/all?upload_id={kept}').get_json(), [{'value': 'Daily Post', 'count': 400}])
+
+if __name__ == '__main__':
+    unittest.main()
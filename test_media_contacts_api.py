@@ -1,6 +1,16 @@
 import unittest
 import os
+import io
 import json
+import random
+from collections import Counter
+from unittest import mock
+from fuzzywuzzy import process
+import facet_search
+import field_index
+import importer
+import jobs
+import table_data
 from app import app
 from database import create_tables, get_db_connection
 
@@ -19,6 +29,8 @@ class MediaContactsApiTestCase(unittest.TestCase):
         self.populate_test_data()
 
     def tearDown(self):
+        import database
+        database.close_pool()
         os.remove(self.db_name)
 
     def populate_test_data(self):
@@ -83,6 +95,231 @@ class MediaContactsApiTestCase(unittest.TestCase):
         self.assertEqual(len(data['items']), 2)
         self.assertEqual(data['page'], 2)
 
+    def walk_cursor_pages(self, url):
+        names, cursor = [], None
+        while True:
+            data = json.loads(self.app.get(url + (f'&cursor={cursor}' if cursor else '')).data)
+            names.extend(item['contactName'] for item in data['items'])
+            cursor = data['nextCursor']
+            if not cursor:
+                return names
+
+    def test_cursor_pages_match_offset_order(self):
+        self.login()
+        conn = get_db_connection()
+        # Same names in both tables, repeated names and missing names exercise every tie-break
+        for i in range(12):
+            for table in ('journalists', 'media_titles'):
+                conn.execute(f"INSERT INTO {table} (name, Email) VALUES (?, ?)",
+                             (None if i % 5 == 0 else f"Shared {i % 4}", f"s{i}@{table}.com"))
+        conn.commit()
+        conn.close()
+
+        everything = json.loads(self.app.get('/api/media-contacts?page_size=200').data)
+        self.assertEqual(everything['total'], 28)
+        expected = [item['contactName'] for item in everything['items']]
+        self.assertEqual(self.walk_cursor_pages('/api/media-contacts?page_size=3'), expected)
+
+        # Ranked search results page the same way
+        ranked = json.loads(self.app.get('/api/media-contacts?q=shared&page_size=200').data)
+        self.assertEqual(ranked['total'], 18)
+        self.assertEqual(self.walk_cursor_pages('/api/media-contacts?q=shared&page_size=4'),
+                         [item['contactName'] for item in ranked['items']])
+
+    def test_cursor_is_not_shifted_by_new_contacts(self):
+        self.login()
+        first = json.loads(self.app.get('/api/media-contacts?page_size=2').data)
+        self.assertEqual([item['contactName'] for item in first['items']], ['Jane Doe', 'John Smith'])
+        conn = get_db_connection()
+        conn.execute("INSERT INTO journalists (name, Email) VALUES ('Adam Early', 'adam@example.com')")
+        conn.commit()
+        conn.close()
+        second = json.loads(self.app.get(f"/api/media-contacts?page_size=2&cursor={first['nextCursor']}").data)
+        self.assertEqual([item['contactName'] for item in second['items']], ['Peter Jones', 'Test Magazine'])
+        self.assertNotIn('total', second)
+        self.assertIsNone(second['nextCursor'])
+
+        self.assertEqual(self.app.get('/api/media-contacts?cursor=not-a-cursor').status_code, 400)
+
+    def facet_search(self, query):
+        # The defaults come last, so the query's own page_size wins
+        return json.loads(self.app.get(f'/api/media-contacts/search?{query}&page_size=200&facet_limit=100').data)
+
+    def test_faceted_search_matches_filtering_every_contact(self):
+        self.login()
+        conn = get_db_connection()
+        for i in range(120):
+            conn.execute(f"INSERT INTO {('journalists', 'media_titles')[i % 2]} "
+                         "(name, Email, outletName, City, Country, MediaType, JobTitle, Focus) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (f"Contact {i % 37}", f"c{i}@example.com" if i % 11 else 'no-email', f"Outlet {i % 7}",
+                          ['London', 'Leeds', ''][i % 3], ['UK', 'IE'][i % 2], ['Print', 'Online', 'Radio'][i % 3 // 2],
+                          f"Editor {i % 4}", ['Tech', 'Tech, Health', 'Sport', None][i % 4]))
+        conn.commit()
+        contacts = {}
+        for table, contact_type in (('journalists', 'journalist'), ('media_titles', 'media_title')):
+            for row in conn.execute(f"SELECT * FROM {table} WHERE email_valid = 1"):
+                contacts[f"{contact_type}_{row['id']}"] = dict(row, category=json.loads(row['categories']))
+        conn.close()
+        # The plain listing gives the name order every page should follow
+        in_name_order = [item['id'] for item in json.loads(self.app.get('/api/media-contacts?page_size=200').data)['items']]
+
+        def passes(contact, filters, skip=None):
+            return all(facet == skip or (set(contact[facet]) if facet == 'category' else {contact[facet]}) & set(values)
+                       for facet, values in filters.items())
+
+        cases = [{}, {'City': ['London']}, {'City': ['London', 'Leeds'], 'category': ['Health']},
+                 {'outletName': ['Outlet 3'], 'MediaType': ['Online'], 'JobTitle': ['Editor 1', 'Editor 3'], 'Country': ['IE']},
+                 {'category': ['Nothing']}]
+        for sparse in (0, 1000): # Both ways of ordering a page
+            with mock.patch.object(facet_search, 'SPARSE_SELECTION', sparse):
+                for filters in cases:
+                    query = '&'.join(f"{facet}={value}" for facet, values in filters.items() for value in values)
+                    data = self.facet_search(query)
+                    expected = [key for key in in_name_order if passes(contacts[key], filters)]
+                    self.assertEqual([item['id'] for item in data['items']], expected, query)
+                    self.assertEqual(data['total'], len(expected))
+                    for facet, values in data['facets'].items():
+                        counts = Counter()
+                        for contact in contacts.values():
+                            if passes(contact, filters, skip=facet):
+                                counts.update(contact[facet] if facet == 'category' else [contact[facet]] if contact[facet] else [])
+                        self.assertEqual({v['value']: v['count'] for v in values if v['count']}, dict(counts), (query, facet))
+                        self.assertEqual({v['value'] for v in values if v['selected']}, set(filters.get(facet, ())))
+
+        # Free text ranks first, pages follow on
+        data = self.facet_search('q=contact&City=Leeds&page_size=5&page=2')
+        self.assertEqual(data['total'], sum(c['City'] == 'Leeds' for c in contacts.values()))
+        self.assertEqual(len(data['items']), 5)
+        self.assertEqual(self.facet_search('q=john&category=Tech')['items'][0]['contactName'], 'John Smith')
+
+    def test_faceted_search_follows_imports_and_deletes(self):
+        self.login()
+        self.assertEqual(self.facet_search('Country=FR')['total'], 0)
+        conn = get_db_connection()
+        importer.import_csv(conn, io.StringIO("Name,Email,Country\nNew One,new@example.com,FR\n"), 'journalists', 'More',
+                            {'Name': 'name', 'Email': 'Email', 'Country': 'Country'})
+        conn.close()
+        data = self.facet_search('Country=FR')
+        self.assertEqual([item['contactName'] for item in data['items']], ['New One'])
+        self.assertEqual(data['facets']['outletName'], [])
+        conn = get_db_connection()
+        conn.execute("DELETE FROM journalists WHERE name = 'New One'")
+        conn.commit()
+        conn.close()
+        data = self.facet_search('Country=FR')
+        self.assertEqual((data['total'], data['facets']['Country']), (0, [{'value': 'FR', 'count': 0, 'selected': True}]))
+
+    def test_table_data_streams_pages_and_projects(self):
+        self.login()
+        conn = get_db_connection()
+        expected = [dict(row) for row in conn.execute("SELECT * FROM journalists ORDER BY id")]
+        conn.close()
+
+        with mock.patch.object(table_data, 'STREAM_BATCH', 2): # Several batches
+            self.assertEqual(json.loads(self.app.get('/api/table/journalists').data), expected)
+            lines = self.app.get('/api/table/journalists?format=ndjson&columns=name,id&after=1').data.decode().splitlines()
+            self.assertEqual([json.loads(line) for line in lines],
+                             [{'name': row['name'], 'id': row['id']} for row in expected[1:]])
+        self.assertEqual(json.loads(self.app.get('/api/table/companies').data), [])
+
+        # A download that is still being read holds no pooled connection between batches
+        import database
+        pool = database.get_pool()
+        held = [pool.acquire() for _ in range(pool.max_size - 1)]
+        try:
+            batches = table_data.pooled_row_batches(pool, 'journalists', ['name'], batch_size=2)
+            first = next(batches)
+            with mock.patch.object(pool, 'timeout', 0.1):
+                pool.acquire().close()
+            names = [row['name'] for batch in [first, *batches] for row in batch]
+        finally:
+            for conn in held:
+                conn.close()
+        self.assertEqual(names, [row['name'] for row in expected])
+
+        rows, after = [], None
+        while True:
+            page = json.loads(self.app.get('/api/table/journalists?columns=Email&limit=2' + (f'&after={after}' if after else '')).data)
+            rows.extend(page['rows'])
+            after = page['nextAfter']
+            if after is None:
+                break
+        self.assertEqual(rows, [{'Email': row['Email']} for row in expected])
+
+        self.assertEqual(self.app.get('/api/table/journalists?columns=name,password').status_code, 400)
+        self.assertEqual(self.app.get('/api/table/users').status_code, 400)
+
+    def test_upload_data_pages_sorts_and_filters(self):
+        self.login()
+        conn = get_db_connection()
+        upload_id = conn.execute("INSERT INTO uploads (name) VALUES ('Spring')").lastrowid
+        conn.executemany("INSERT INTO journalists (name, outletName, City, Email, upload_id) VALUES (?, ?, ?, ?, ?)", [
+            (f'Writer {i:02}', 'Daily Post' if i % 3 else 'Evening 50%', ['Leeds', 'york', 'Bath'][i % 3], f'w{i}@example.com', upload_id)
+            for i in range(25)
+        ])
+        ids = [row[0] for row in conn.execute("SELECT id FROM journalists WHERE upload_id = ? ORDER BY id", (upload_id,))]
+        conn.commit()
+        conn.close()
+
+        def page(query=''):
+            return json.loads(self.app.get(f'/api/upload/{upload_id}?{query}').data)
+
+        first = page('limit=10')
+        self.assertEqual((first['upload_name'], first['table_name'], first['total']), ('Spring', 'journalists', 25))
+        self.assertEqual([r['id'] for r in first['records']], ids[:10])
+        self.assertEqual(set(first['records'][0]) & {'upload_id', 'email_normalized', 'email_key', 'name_sort', 'categories'}, set())
+        self.assertEqual([r['id'] for r in page('limit=10&offset=20')['records']], ids[20:])
+
+        by_city = page('sort=City&order=desc&limit=25')['records']
+        self.assertEqual([r['City'] for r in by_city], ['york'] * 8 + ['Leeds'] * 9 + ['Bath'] * 8)
+        self.assertEqual([r['id'] for r in by_city[:8]], sorted((r['id'] for r in by_city[:8]), reverse=True))
+
+        filtered = page('filter=outletName:50%25&filter=City:YORK')
+        self.assertEqual(filtered['total'], 0)
+        filtered = page('filter=outletName:50%25&filter=City:leeds')
+        self.assertEqual((filtered['total'], {r['name'] for r in filtered['records']}),
+                         (9, {f'Writer {i:02}' for i in range(0, 25, 3)}))
+        self.assertEqual([r['name'] for r in page('q=writer 07')['records']], ['Writer 07'])
+
+        self.assertEqual(self.app.get(f'/api/upload/{upload_id}?sort=password').status_code, 400)
+        self.assertEqual(self.app.get(f'/api/upload/{upload_id}?filter=Email').status_code, 400)
+        self.assertEqual(self.app.get(f'/api/upload/{upload_id}?sort=name_sort').status_code, 400)
+        self.assertEqual(self.app.get(f'/api/upload/{upload_id}?filter=email_key:w1').status_code, 400)
+        self.assertEqual(self.app.get('/api/upload/999').status_code, 404)
+
+    def test_total_is_cached_until_contacts_change(self):
+        self.login()
+        self.assertEqual(json.loads(self.app.get('/api/media-contacts?q=Test%20News').data)['total'], 2)
+        # Plant a marker in the cache: a repeat of the same (normalized) query must not recount
+        import database, search
+        conn = get_db_connection()
+        search._count_cache[(search.count_key('test news'), database.get_data_generation(conn))] = 999
+        conn.close()
+        self.assertEqual(json.loads(self.app.get('/api/media-contacts?q=test,news').data)['total'], 999)
+
+        conn = get_db_connection()
+        conn.execute("INSERT INTO journalists (name, outletName, Email) VALUES ('New Hire', 'Test News', 'new@test.com')")
+        conn.commit()
+        conn.close()
+        self.assertEqual(json.loads(self.app.get('/api/media-contacts?q=test%20news').data)['total'], 3)
+
+    def test_estimated_total(self):
+        self.login()
+        data = json.loads(self.app.get('/api/media-contacts?total=estimate').data)
+        self.assertTrue(data['totalIsEstimate'])
+        self.assertGreaterEqual(data['total'], 4) # Upper bound: the invalid emails are not filtered out
+        self.assertEqual(len(data['items']), 4)
+
+        exact = json.loads(self.app.get('/api/media-contacts').data)
+        self.assertEqual((exact['total'], exact['totalIsEstimate']), (4, False))
+        # Once the exact count is cached it is returned even when an estimate would do
+        data = json.loads(self.app.get('/api/media-contacts?total=estimate').data)
+        self.assertEqual((data['total'], data['totalIsEstimate']), (4, False))
+
+        data = json.loads(self.app.get('/api/media-contacts?q=test&total=estimate').data)
+        self.assertTrue(data['totalIsEstimate'])
+        self.assertGreaterEqual(data['total'], 2)
+
     def test_search(self):
         self.login()
         response = self.app.get('/api/media-contacts?q=jones')
@@ -92,6 +329,174 @@ class MediaContactsApiTestCase(unittest.TestCase):
         self.assertEqual(len(data['items']), 1)
         self.assertEqual(data['items'][0]['contactName'], 'Peter Jones')
 
+    def test_search_prefix_matching_and_ranking(self):
+        self.login()
+        # Every word must prefix a word of the contact; Focus is searched too
+        data = json.loads(self.app.get('/api/media-contacts?q=jo%20smi').data)
+        self.assertEqual([item['contactName'] for item in data['items']], ['John Smith'])
+        data = json.loads(self.app.get('/api/media-contacts?q=welln').data)
+        self.assertEqual([item['contactName'] for item in data['items']], ['Jane Doe'])
+
+        # A name hit ranks above an outlet-only hit
+        conn = get_db_connection()
+        conn.execute("INSERT INTO journalists (name, outletName, Email) VALUES ('Sam Testa', 'Daily', 'sam@daily.com')")
+        conn.commit()
+        conn.close()
+        data = json.loads(self.app.get('/api/media-contacts?q=test').data)
+        self.assertEqual([item['contactName'] for item in data['items']], ['Test Magazine', 'Sam Testa', 'John Smith'])
+
+    def test_search_index_follows_edits_and_deletes(self):
+        self.login()
+        conn = get_db_connection()
+        conn.execute("UPDATE journalists SET name = 'Peter Brown' WHERE name = 'Peter Jones'")
+        conn.execute("DELETE FROM media_titles")
+        conn.commit()
+        conn.close()
+        self.assertEqual(json.loads(self.app.get('/api/media-contacts?q=brown').data)['total'], 1)
+        # Still found through the unchanged email address
+        self.assertEqual(json.loads(self.app.get('/api/media-contacts?q=jones').data)['total'], 1)
+        self.assertEqual(json.loads(self.app.get('/api/media-contacts?q=magazine').data)['total'], 0)
+
+    def test_upload_search_uses_index(self):
+        self.login()
+        conn = get_db_connection()
+        upload_id = conn.execute("INSERT INTO uploads (name) VALUES ('Spring List')").lastrowid
+        conn.execute("UPDATE journalists SET upload_id = ? WHERE name = 'Jane Doe'", (upload_id,))
+        conn.commit()
+        conn.close()
+        data = json.loads(self.app.get('/api/search?q=another').data)
+        self.assertEqual([upload['name'] for upload in data], ['Spring List'])
+        self.assertEqual(json.loads(self.app.get('/api/search?q=nomatch').data), [])
+
+    def field_search(self, field, q, upload_id=None):
+        url = f'/api/search/{field}?q={q}' + (f'&upload_id={upload_id}' if upload_id else '')
+        return json.loads(self.app.get(url).data)
+
+    def test_field_search_matches_full_scan(self):
+        self.login()
+        prefixes = ['Daily', 'Evening', 'Tech', 'Business', 'Sunday']
+        suffixes = ['News', 'Times', 'Herald', 'Gazette', 'Review', 'Weekly Review']
+        conn = get_db_connection()
+        upload_id = conn.execute("INSERT INTO uploads (name) VALUES ('Outlets')").lastrowid
+        outlets = []
+        for i in range(300):
+            outlet = f"{prefixes[i % 5]} {suffixes[i % 6]}" + (f" {i}" if i % 4 else '')
+            outlets.append(outlet)
+            conn.execute("INSERT INTO media_titles (name, outletName, City, upload_id) VALUES (?, ?, ?, ?)",
+                         (f"Title {i}", outlet, ['Leeds', 'London', 'Londonderry'][i % 3], upload_id if i % 2 else None))
+        conn.commit()
+        conn.close()
+
+        values = sorted(set(outlets) | {'Test News', 'Another Paper', 'Search Weekly', 'Bad Data Inc', 'Null Times'})
+        for q in ['daily news', 'Tech Herlad', 'review', 'Evening Times 17', 'weekly', 'ws', 'zzz']:
+            expected = [m[0] for m in process.extract(q, values, limit=10) if m[1] >= 80]
+            self.assertEqual(self.field_search('outletName', q), expected, q)
+        self.assertEqual(self.field_search('City', 'londn'), ['London'])
+        self.assertEqual(self.field_search('City', 'london'), ['London', 'Londonderry'])
+
+        in_upload = self.field_search('outletName', 'daily news', upload_id)
+        self.assertTrue(in_upload)
+        self.assertTrue(all(outlets.index(value) % 2 for value in in_upload))
+
+    def test_field_search_follows_imports_and_deletes(self):
+        self.login()
+        self.assertEqual(self.field_search('outletName', 'null times'), ['Null Times'])
+        conn = get_db_connection()
+        conn.execute("DELETE FROM journalists WHERE outletName = 'Null Times'")
+        conn.execute("INSERT INTO journalists (name, outletName) VALUES ('New', 'Nul Times')")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.field_search('outletName', 'null times'), ['Nul Times'])
+        self.assertEqual(self.app.get('/api/search/Email?q=x').status_code, 400)
+
+    def test_field_index_matches_full_scan_on_random_queries(self):
+        rng = random.Random(7)
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        words = ['Daily', 'Evening', 'Tech', 'Business', 'Sunday', 'Morning', 'Property', 'Magazine', 'News', 'Times',
+                 'Herald', 'Review', 'Chronicle', 'Echo', 'Tv', 'Ink', 'London', 'Leeds', 'Glasgow', 'Cardiff', 'Record']
+        values = set(words)
+        values.update(''.join(rng.choice(letters) for _ in range(rng.randint(2, 10))).title() for _ in range(150))
+        while len(values) < 2500:
+            name = ' '.join(rng.sample(words, rng.randint(2, 3)))
+            if rng.random() < 0.3:
+                name += ' ' + ''.join(rng.choice(letters) for _ in range(rng.randint(3, 8)))
+            values.add(name)
+        values = sorted(values)
+        index = field_index.FieldIndex(values)
+        for _ in range(50):
+            kind = rng.random()
+            if kind < 0.5: # Words run together, so short values sit inside the query
+                q = ''.join(rng.sample(words, rng.randint(2, 3)))
+            elif kind < 0.75:
+                value = rng.choice(values)
+                start = rng.randrange(len(value))
+                q = value[start:start + rng.randint(2, 12)]
+            else:
+                q = ' '.join(rng.sample(words, rng.randint(1, 3))) + rng.choice(['', 'x', ' 24', 'ly'])
+            expected = [m[0] for m in process.extract(q, values, limit=10) if m[1] >= field_index.MIN_SCORE]
+            self.assertEqual(index.search(q), expected, q)
+
+    def test_outlet_and_city_counts_follow_writes(self):
+        self.login()
+        self.assertEqual(json.loads(self.app.get('/api/outlets/journalists').data), [
+            {'value': 'Another Paper', 'count': 1}, {'value': 'Bad Data Inc', 'count': 1}, {'value': 'Null Times', 'count': 1},
+            {'value': 'Search Weekly', 'count': 1}, {'value': 'Test News', 'count': 1},
+        ])
+
+        conn = get_db_connection()
+        first = conn.execute("INSERT INTO uploads (name) VALUES ('First')").lastrowid
+        second = conn.execute("INSERT INTO uploads (name) VALUES ('Second')").lastrowid
+        conn.executemany("INSERT INTO journalists (name, outletName, City, upload_id) VALUES (?, ?, ?, ?)", [
+            ('A', 'Test News', 'Leeds', first), ('B', 'Test News', '', first), ('C', 'Daily Post', 'Leeds', second),
+        ])
+        conn.execute("UPDATE journalists SET outletName = 'Daily Post', upload_id = ? WHERE name = 'B'", (second,))
+        conn.execute("UPDATE journalists SET upload_id = ? WHERE name = 'Peter Jones'", (first,))
+        conn.commit()
+        conn.close()
+
+        outlets = lambda query: {o['value']: o['count'] for o in json.loads(self.app.get('/api/outlets/all' + query).data)}
+        self.assertEqual(outlets(f'?upload_id={first}'), {'Test News': 1, 'Search Weekly': 1})
+        self.assertEqual(outlets(f'?upload_id={second}'), {'Daily Post': 2})
+        self.assertEqual(outlets('')['Test News'], 3)
+        self.assertEqual(json.loads(self.app.get(f'/api/cities/all?upload_id={second}').data), [{'value': 'Leeds', 'count': 1}])
+
+        # Deleting an upload hides its counts at once and takes them with it
+        with mock.patch.object(jobs, 'get_executor'):
+            self.app.delete(f'/api/upload/{second}')
+        self.assertNotIn('Daily Post', outlets(''))
+        jobs.run_upload_delete(second)
+        conn = get_db_connection()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM contact_facets WHERE upload_id = ?", (second,)).fetchone()[0], 0)
+        conn.close()
+
+        response = self.app.post('/api/outreach/prepare-follow-up', json={
+            'press_release_id': 1, 'staff_id': 1, 'upload_ids': [str(first)], 'subject': 'Hello'})
+        self.assertIn('outlets=Search+Weekly&outlets=Test+News', response.get_json()['redirect_url'])
+
+    def typeahead(self, field, q, **params):
+        query = ''.join(f'&{key}={value}' for key, value in params.items())
+        return [(c['value'], c['count']) for c in json.loads(self.app.get(f'/api/typeahead/{field}?q={q}{query}').data)]
+
+    def test_typeahead_completes_word_starts_by_contact_count(self):
+        self.login()
+        self.assertEqual(self.typeahead('outletName', 'TE'), [('Test News', 2)])
+        self.assertEqual(self.typeahead('outletName', 'new'), [('Test News', 2)])
+        self.assertEqual(self.typeahead('outletName', 'ews'), [])
+        self.assertEqual(self.typeahead('outletName', '', limit=1), [('Test News', 2)])
+        self.assertEqual(len(self.typeahead('outletName', '', limit=0)), 1)
+
+        conn = get_db_connection()
+        upload_id = conn.execute("INSERT INTO uploads (name) VALUES ('Weekly')").lastrowid
+        conn.executemany("INSERT INTO media_titles (name, outletName, City, upload_id) VALUES (?, 'Weekly Post', 'Leeds', ?)",
+                         [('A', upload_id), ('B', upload_id), ('C', None)])
+        conn.execute("DELETE FROM journalists WHERE outletName = 'Search Weekly'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.typeahead('outletName', 'we'), [('Weekly Post', 3)])
+        self.assertEqual(self.typeahead('outletName', 'we', upload_id=upload_id), [('Weekly Post', 2)])
+        self.assertEqual(self.typeahead('City', 'l'), [('Leeds', 3)])
+        self.assertEqual(self.app.get('/api/typeahead/Email?q=x').status_code, 400)
+
     def test_invalid_email_exclusion(self):
         self.login()
         # Fetch all valid contacts
@@ -105,5 +510,18 @@ class MediaContactsApiTestCase(unittest.TestCase):
         # The total should only reflect valid contacts
         self.assertEqual(data['total'], 4)
 
+    def test_total_matches_returned_items(self):
+        self.login()
+        conn = get_db_connection()
+        # Passed the old INSTR(Email, '@') count but was dropped from the page afterwards
+        conn.execute("INSERT INTO journalists (name, Email, Focus) VALUES ('Spacey', 'bad address@example.com', 'Tech')")
+        conn.commit()
+        conn.close()
+        data = json.loads(self.app.get('/api/media-contacts?page_size=100').data)
+        self.assertEqual(data['total'], len(data['items']))
+        self.assertEqual(data['total'], 4)
+        jane = next(item for item in data['items'] if item['contactName'] == 'Jane Doe')
+        self.assertEqual(jane['categories'], ['Health', 'Wellness'])
+
 if __name__ == '__main__':
     unittest.main()
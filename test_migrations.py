@@ -0,0 +1,106 @@
+import unittest
+import os
+import sqlite3
+import database
+import migrations
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_name = 'test_migrations.db'
+        database.DATABASE_NAME = self.db_name
+        self.conn = sqlite3.connect(self.db_name)
+
+    def tearDown(self):
+        self.conn.close()
+        database.close_pool()
+        os.remove(self.db_name)
+
+    def test_fresh_database_reaches_latest_version(self):
+        version = database.create_tables()
+        self.assertEqual(version, migrations.latest_version())
+        self.assertEqual(migrations.get_version(self.conn), migrations.latest_version())
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertTrue({'users', 'uploads', 'journalists', 'media_titles', 'staff', 'press_releases'} <= tables)
+
+    def test_current_database_is_a_single_version_check(self):
+        database.create_tables()
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        migrations.migrate(self.conn)
+        self.assertEqual(statements, ["PRAGMA user_version"])
+
+    def test_upgrades_pre_versioning_database(self):
+        # Schema as created before upload_id and html_content were added
+        legacy_columns = migrations.CONTACT_COLUMNS_SQL.replace("upload_id INTEGER,", "").replace(
+            "FOREIGN KEY (upload_id) REFERENCES uploads (id)", "").strip().rstrip(',')
+        self.conn.execute(f"CREATE TABLE journalists ({legacy_columns})")
+        self.conn.execute("CREATE TABLE press_releases (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, content TEXT NOT NULL, image BLOB)")
+        self.conn.execute("INSERT INTO journalists (name, Email, outletName) VALUES ('Old Contact', 'old@example.com', 'Old Paper')")
+        self.conn.execute("INSERT INTO journalists (name, Email, outletName) VALUES ('Old Duplicate', ' OLD@example.com', 'Old Paper')")
+        self.conn.commit()
+
+        migrations.migrate(self.conn)
+
+        self.assertTrue(migrations.column_exists(self.conn, 'journalists', 'upload_id'))
+        self.assertTrue(migrations.column_exists(self.conn, 'press_releases', 'html_content'))
+        self.assertEqual(self.conn.execute("SELECT name FROM journalists").fetchone()[0], 'Old Contact')
+        # Existing duplicates are normalized, and only the oldest one becomes the key an import upserts on
+        self.assertEqual(self.conn.execute("SELECT email_normalized, email_key FROM journalists ORDER BY id").fetchall(),
+                         [('old@example.com', 'old@example.com'), ('old@example.com', None)])
+        self.assertEqual(self.conn.execute("SELECT email_valid, name_sort, categories FROM journalists ORDER BY id").fetchone(),
+                         (1, 'old contact', '[]'))
+        self.conn.execute("UPDATE journalists SET Email = 'New@Example.com', Focus = 'Arts,Film' WHERE name = 'Old Duplicate'")
+        self.assertEqual(self.conn.execute("SELECT email_normalized, email_key, categories FROM journalists WHERE name = 'Old Duplicate'").fetchone(),
+                         ('new@example.com', 'new@example.com', '["Arts","Film"]'))
+        self.assertEqual(self.conn.execute("SELECT facet, upload_id, contact_table, value, contact_count FROM contact_facets").fetchall(),
+                         [('outletName', 0, 'journalists', 'Old Paper', 2)])
+
+    def test_failed_migration_rolls_back(self):
+        def create_then_fail(conn, progress):
+            conn.execute("CREATE TABLE half_done (id INTEGER)")
+            raise RuntimeError("boom")
+
+        steps = [
+            {'version': 1, 'description': 'ok', 'apply': lambda conn, progress: conn.execute("CREATE TABLE first (id INTEGER)")},
+            {'version': 2, 'description': 'fails', 'apply': create_then_fail},
+        ]
+        with self.assertRaises(RuntimeError):
+            migrations.migrate(self.conn, migrations=steps)
+
+        self.assertEqual(migrations.get_version(self.conn), 1)
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertIn('first', tables)
+        self.assertNotIn('half_done', tables)
+
+    def test_backfills_report_progress_and_resume(self):
+        self.conn.execute("CREATE TABLE big (id INTEGER PRIMARY KEY, value TEXT, derived TEXT)")
+        self.conn.executemany("INSERT INTO big (value) VALUES (?)", ((f"Value {i}",) for i in range(2500)))
+        self.conn.commit()
+        reports = []
+
+        def report(label, done, total):
+            reports.append((label, done, total))
+            if reports == [('big backfill', n, 2500) for n in (1000, 2000, 2500)] + [('big copy', 1000, 2500)]:
+                raise RuntimeError("interrupted") # After the first batch of the copy is committed
+
+        def step(conn, progress):
+            migrations.backfill(conn, 'big', "derived = lower(value)", batch_size=1000, progress=progress)
+            conn.execute("CREATE TABLE IF NOT EXISTS big_copy (id INTEGER PRIMARY KEY, derived TEXT NOT NULL)")
+            migrations.backfill_by_id(conn, 'big copy', 'big', [
+                "INSERT INTO big_copy (id, derived) SELECT id, derived FROM big WHERE id > ? AND id <= ?"
+            ], batch_size=1000, progress=progress)
+
+        steps = [{'version': 1, 'description': 'derive', 'apply': step}]
+        with self.assertRaises(RuntimeError):
+            migrations.migrate(self.conn, migrations=steps, progress=report)
+        # The batches committed before the failure stay; the copy resumes after them
+        self.assertEqual((migrations.get_version(self.conn), self.conn.execute("SELECT COUNT(*) FROM big_copy").fetchone()[0]), (0, 1000))
+        migrations.migrate(self.conn, migrations=steps, progress=report)
+
+        self.assertEqual(reports[-2:], [('big copy', 2000, 2500), ('big copy', 2500, 2500)])
+        self.assertIn(('big backfill', 2500, 2500), reports)
+        self.assertEqual(self.conn.execute("SELECT derived FROM big_copy WHERE id = 7").fetchone()[0], 'value 6')
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM big_copy").fetchone()[0], 2500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,8 @@ class PressReleasesTestCase(unittest.TestCase):
 
     def tearDown(self):
         # Clean up the test database
+        import database
+        database.close_pool()
         os.remove(self.db_name)
 
     def test_upload_docx_invalid(self):
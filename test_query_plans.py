@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import unittest
+
+import database
+import query_audit
+from app import app
+
+class QueryPlanTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.db_name = 'test_query_plans.db'
+        database.DATABASE_NAME = self.db_name
+        database.create_tables()
+        conn = database.get_db_connection()
+        self.upload_ids = query_audit.seed(conn)
+        conn.close()
+        self.client = app.test_client()
+        query_audit.login(self.client)
+
+    def tearDown(self):
+        database.close_pool()
+        os.remove(self.db_name)
+
+    def test_api_reads_no_hot_table_in_full(self):
+        with query_audit.recording() as statements:
+            query_audit.exercise(self.client, self.upload_ids)
+        self.assertGreater(len(statements), 100)
+
+        conn = sqlite3.connect(self.db_name)
+        scans = query_audit.full_scans(conn, statements)
+        conn.close()
+        report = '\n\n'.join(f"{statement}\n  scans {', '.join(tables)}: {plan}" for statement, (tables, plan) in scans.items())
+        self.assertEqual(scans, {}, f"Statements reading a whole table without an index:\n{report}")
+
+    def test_audit_flags_scans_through_aliases(self):
+        conn = sqlite3.connect(self.db_name)
+        scans = query_audit.full_scans(conn, [
+            "SELECT * FROM journalists c WHERE c.Focus = 'Tech'",
+            "SELECT * FROM journalists c WHERE c.Focus = 'Sport'", # Same statement, planned once
+            "SELECT * FROM media_titles WHERE upload_id = 3",
+            "SELECT COUNT(*) FROM (SELECT c.Focus FROM journalists c UNION ALL SELECT c.Focus FROM media_titles c) WHERE Focus = ''",
+            "SELECT * FROM uploads WHERE name = 'x'", # Not a hot table
+            "PRAGMA user_version",
+        ])
+        conn.close()
+        self.assertEqual({statement: tables for statement, (tables, plan) in scans.items()},
+                         {"SELECT * FROM journalists c WHERE c.Focus = ?": ['journalists'],
+                          "SELECT COUNT(*) FROM (SELECT c.Focus FROM journalists c UNION ALL SELECT c.Focus FROM media_titles c) "
+                          "WHERE Focus = ?": ['journalists', 'media_titles']})
+
+if __name__ == '__main__':
+    unittest.main()
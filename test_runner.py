@@ -13,6 +13,7 @@ class TestCompanyDatabase(unittest.TestCase):
         """Set up for all tests - use a temporary test database."""
         cls.db_name = "test_company_data.db"
         database.DATABASE_NAME = cls.db_name # Override database name for tests
+        database.close_pool()
         if os.path.exists(cls.db_name):
             os.remove(cls.db_name)
         database.create_tables()
@@ -20,6 +21,7 @@ class TestCompanyDatabase(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         """Clean up after all tests."""
+        database.close_pool()
         if os.path.exists(cls.db_name):
             os.remove(cls.db_name)
         database.DATABASE_NAME = 'company_data.db'
@@ -103,7 +105,7 @@ class TestCompanyDatabase(unittest.TestCase):
         print("test_6_empty_view PASSED")
 
     # --- Tests for Webhook Functionality ---
-    @unittest.mock.patch('database.requests.post')
+    @unittest.mock.patch('webhooks.requests.Session.post')
     def test_7_send_to_webhook_success(self, mock_post):
         print("Running test_7_send_to_webhook_success...")
         mock_response = unittest.mock.Mock()
@@ -118,12 +120,12 @@ class TestCompanyDatabase(unittest.TestCase):
             mock_post.assert_any_call(
                 url,
                 data=json.dumps(payload),
-                headers={'Content-Type': 'application/json'},
+                headers=None,
                 timeout=10
             )
         print("test_7_send_to_webhook_success PASSED")
 
-    @unittest.mock.patch('database.requests.post')
+    @unittest.mock.patch('webhooks.requests.Session.post')
     def test_8_send_to_webhook_http_error(self, mock_post):
         print("Running test_8_send_to_webhook_http_error...")
         mock_error_response = unittest.mock.Mock()
@@ -140,7 +142,7 @@ class TestCompanyDatabase(unittest.TestCase):
         self.assertEqual(mock_post.call_count, len(database.WEBHOOK_URLS))
         print("test_8_send_to_webhook_http_error PASSED")
 
-    @unittest.mock.patch('database.requests.post')
+    @unittest.mock.patch('webhooks.requests.Session.post')
     def test_9_send_to_webhook_timeout(self, mock_post):
         print("Running test_9_send_to_webhook_timeout...")
         mock_post.side_effect = requests.exceptions.Timeout
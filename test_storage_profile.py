@@ -0,0 +1,129 @@
+import unittest
+import os
+import json
+import sqlite3
+import threading
+import time
+import database
+from app import app
+
+class StorageProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.db_name = 'test_storage_profile.db'
+        database.DATABASE_NAME = self.db_name
+        database.create_tables()
+
+    def tearDown(self):
+        database.set_storage_profile() # Back to the environment's profile
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_name + suffix):
+                os.remove(self.db_name + suffix)
+
+    def login(self):
+        from user import User
+        user = User(username='testuser', is_admin=True)
+        user.set_password('password')
+        user.save()
+        return self.app.post('/login', data=dict(username='testuser', password='password'), follow_redirects=True)
+
+    def test_profile_pragmas_applied_on_connect(self):
+        database.set_storage_profile('default', busy_timeout=1234)
+        conn = database.get_db_connection()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1) # NORMAL
+        self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 1234)
+        self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2) # MEMORY
+        self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -16000)
+        conn.close()
+
+    def test_environment_overrides(self):
+        os.environ['DB_BUSY_TIMEOUT'] = '2500'
+        try:
+            profile = database.load_storage_profile('bulk')
+        finally:
+            del os.environ['DB_BUSY_TIMEOUT']
+        self.assertEqual(profile['name'], 'bulk')
+        self.assertEqual(profile['busy_timeout'], '2500')
+        with self.assertRaises(ValueError):
+            database.load_storage_profile('no-such-profile')
+
+    def test_readers_keep_serving_during_large_import(self):
+        database.set_storage_profile('default')
+        self.login()
+        conn = database.get_db_connection()
+        conn.execute("INSERT INTO journalists (name, Email) VALUES ('Existing Contact', 'existing@example.com')")
+        conn.commit()
+        conn.close()
+
+        # An import holding the write lock, with a tiny page cache so its changes spill to disk
+        # before commit. Under a rollback journal that spill takes an exclusive lock and blocks readers.
+        writer = sqlite3.connect(self.db_name, timeout=0)
+        writer.execute("PRAGMA cache_size = 10")
+        writer.execute("BEGIN IMMEDIATE")
+        writer.executemany(
+            "INSERT INTO journalists (name, outletName, Email, Focus) VALUES (?, ?, ?, ?)",
+            ((f"Contact {i}", f"Outlet {i % 50}", f"contact{i}@example.com", "News") for i in range(20000))
+        )
+        try:
+            started = time.monotonic()
+            response = self.app.get('/api/media-contacts')
+            elapsed = time.monotonic() - started
+            self.assertEqual(response.status_code, 200)
+            # Readers see the last committed snapshot, not the half-finished import
+            self.assertEqual(json.loads(response.data)['total'], 1)
+            self.assertLess(elapsed, 1.0)
+        finally:
+            writer.commit()
+            writer.close()
+
+        response = self.app.get('/api/media-contacts')
+        self.assertEqual(json.loads(response.data)['total'], 20001)
+
+    def test_concurrent_writer_waits_instead_of_failing(self):
+        database.set_storage_profile('default', busy_timeout=5000)
+        holder = sqlite3.connect(self.db_name, check_same_thread=False)
+        holder.execute("BEGIN IMMEDIATE")
+        holder.execute("INSERT INTO companies (name) VALUES ('First Writer')")
+        release = threading.Timer(0.3, holder.commit)
+        release.start()
+        try:
+            conn = database.get_db_connection()
+            conn.execute("INSERT INTO companies (name) VALUES ('Second Writer')")
+            conn.commit()
+            count = conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+            conn.close()
+        finally:
+            release.join()
+            holder.close()
+        self.assertEqual(count, 2)
+
+    def test_older_database_converted_to_incremental_vacuum(self):
+        database.close_pool()
+        os.remove(self.db_name)
+        database.set_storage_profile('default', auto_vacuum='none')
+        database.create_tables()
+        conn = database.get_db_connection()
+        conn.executemany("INSERT INTO companies (name) VALUES (?)", (("x" * 2000 + str(i),) for i in range(500)))
+        conn.commit()
+        conn.execute("DELETE FROM companies")
+        conn.commit()
+        self.assertEqual(database.incremental_vacuum(conn), 0)
+        conn.close()
+
+        database.set_storage_profile('default')
+        database.close_pool()
+        self.assertTrue(database.enable_incremental_vacuum())
+        conn = database.get_db_connection()
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2) # INCREMENTAL
+        conn.executemany("INSERT INTO companies (name) VALUES (?)", (("x" * 2000 + str(i),) for i in range(500)))
+        conn.commit()
+        conn.execute("DELETE FROM companies")
+        conn.commit()
+        self.assertGreater(database.incremental_vacuum(conn), 100)
+        conn.close()
+        database.close_pool()
+
+if __name__ == '__main__':
+    unittest.main()
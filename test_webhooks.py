@@ -0,0 +1,345 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import database
+import outbox
+import webhook_export
+import webhook_sync
+import webhooks
+from app import app
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Records each post. /slow answers after a delay, /fail with a 500, /gone with a 404, /flaky with 503s at first."""
+    protocol_version = 'HTTP/1.1' # Keep-alive, so connection reuse shows in client_address
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.encodings.append(self.headers.get('Content-Encoding'))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.received.append((self.path, self.client_address, json.loads(body)))
+        self.server.keys.append((self.path, self.headers.get('Idempotency-Key')))
+        if self.path == '/slow':
+            time.sleep(self.server.delay)
+        status = {'/fail': 500, '/gone': 404}.get(self.path, 200)
+        if self.path == '/flaky' and self.server.flaky_failures:
+            self.server.flaky_failures -= 1
+            status = 503
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+class StandInServerMixin:
+    def start_server(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.received = []
+        self.server.keys = []
+        self.server.encodings = []
+        self.server.delay = 0.3
+        self.server.flaky_failures = 0
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class WebhookDispatcherTestCase(StandInServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.start_server()
+
+    def tearDown(self):
+        self.stop_server()
+
+    def test_fans_out_in_parallel_with_a_result_per_destination(self):
+        urls = [f"{self.base}/slow", f"{self.base}/slow?second", f"{self.base}/fail"]
+        dispatcher = webhooks.WebhookDispatcher(urls)
+        started = time.monotonic()
+        results = dispatcher.send({'name': 'Test Co'})
+        elapsed = time.monotonic() - started
+        dispatcher.close()
+
+        self.assertLess(elapsed, 0.55) # Both slow posts waited at the same time
+        self.assertEqual([(r.url, r.ok, r.status_code) for r in results],
+                         [(urls[0], True, 200), (urls[1], True, 200), (urls[2], False, 500)])
+        self.assertIsNotNone(results[2].error)
+        self.assertEqual([body for _, _, body in self.server.received], [{'name': 'Test Co'}] * 3)
+
+    def test_timeouts_are_per_destination(self):
+        slow, fast = f"{self.base}/slow", f"{self.base}/fast"
+        dispatcher = webhooks.WebhookDispatcher([slow, fast], timeouts={slow: 0.1})
+        results = dispatcher.send({'id': 1})
+        dispatcher.close()
+        self.assertEqual([(r.ok, r.status_code) for r in results], [(False, None), (True, 200)])
+        self.assertLess(results[0].elapsed, 0.25)
+
+    def test_posts_reuse_pooled_connections(self):
+        dispatcher = webhooks.WebhookDispatcher([f"{self.base}/fast"], max_workers=1)
+        accepted = dispatcher.send_each([{'id': i} for i in range(5)])
+        dispatcher.close()
+        self.assertEqual([[r.ok for r in results] for results in accepted], [[True]] * 5)
+        self.assertEqual({body['id'] for _, _, body in self.server.received}, set(range(5)))
+        self.assertEqual(len({address for _, address, _ in self.server.received}), 1) # One connection for all five
+
+    def test_send_to_webhook_counts_accepting_destinations(self):
+        with mock.patch.object(database, 'WEBHOOK_URLS', [f"{self.base}/fast", f"{self.base}/fail"]):
+            self.assertEqual(database.send_to_webhook({'id': 1}), 1)
+            self.assertEqual(database.send_each_to_webhook([{'id': 2}, {'id': 3}]), [1, 1])
+
+    def test_payload_profiles_project_drop_empty_fields_and_gzip(self):
+        shaped, full = f"{self.base}/shaped", f"{self.base}/full"
+        profile = webhooks.PayloadProfile(columns=('name', 'Email', 'City'), omit_empty=True, gzip=True)
+        dispatcher = webhooks.WebhookDispatcher([shaped, full], profiles={shaped: profile})
+        contacts = [{'id': 1, 'name': 'Ann', 'Email': 'ann@example.com', 'City': '', 'ShadowEmail': None, 'phone': '1'},
+                    {'id': 2, 'name': 'Bob', 'Email': None, 'City': 'Leeds', 'ShadowEmail': '', 'phone': ''}]
+        dispatcher.send({'senders': [{'staff_name': 'Sam'}], 'outreach_contacts': contacts})
+        part = webhook_export.encode_part('export', 'journalists', 1, 1, contacts)
+        dispatcher.post_all([(shaped, part, None)])
+        dispatcher.close()
+
+        bodies = {(path, encoding): body for (path, _, body), encoding in zip(self.server.received, self.server.encodings)
+                  if 'senders' in body}
+        self.assertEqual(bodies[('/shaped', 'gzip')]['outreach_contacts'],
+                         [{'id': 1, 'name': 'Ann', 'Email': 'ann@example.com'}, {'id': 2, 'name': 'Bob', 'City': 'Leeds'}])
+        self.assertEqual(bodies[('/shaped', 'gzip')]['senders'], [{'staff_name': 'Sam'}])
+        self.assertEqual(bodies[('/full', None)]['outreach_contacts'], contacts)
+        # A part's checksum matches the rows as sent
+        sent_part = [body for path, _, body in self.server.received if 'manifest' in body][0]
+        self.assertEqual(sent_part['manifest']['checksum'], webhooks.rows_checksum(sent_part['journalists'])[1])
+        self.assertNotEqual(sent_part['manifest']['checksum'], json.loads(part)['manifest']['checksum'])
+
+class WebhookOutboxTestCase(StandInServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.start_server()
+        self.db_name = 'test_webhook_outbox.db'
+        database.DATABASE_NAME = self.db_name
+        database.create_tables()
+        self.conn = database.get_db_connection()
+        patcher = mock.patch.multiple(outbox, OUTBOX_BASE_DELAY=0.01, OUTBOX_MAX_ATTEMPTS=3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.conn.close()
+        database.close_pool()
+        os.remove(self.db_name)
+        self.stop_server()
+
+    def deliver_all(self, dispatcher):
+        """Runs the worker's delivery step until nothing is left pending."""
+        for _ in range(50):
+            outbox.deliver_due(dispatcher)
+            due = outbox.next_attempt_at(self.conn)
+            if due is None:
+                return
+            time.sleep(max(0, due - time.time()))
+        self.fail("Deliveries still pending")
+
+    def test_retries_with_backoff_and_delivers_each_destination_once(self):
+        fast, flaky = f"{self.base}/fast", f"{self.base}/flaky"
+        self.server.flaky_failures = 2
+        outbox_id, queued = outbox.enqueue(self.conn, {'id': 1}, idempotency_key='order-1', destinations=[fast, flaky])
+        self.assertEqual(outbox.enqueue(self.conn, {'id': 1}, idempotency_key='order-1', destinations=[fast, flaky]),
+                         (outbox_id, False))
+        self.conn.commit()
+
+        dispatcher = webhooks.WebhookDispatcher([fast, flaky])
+        self.deliver_all(dispatcher)
+        dispatcher.close()
+
+        self.assertTrue(queued)
+        self.assertEqual(sorted(self.server.keys), [('/fast', 'order-1')] + [('/flaky', 'order-1')] * 3) # First posts run in parallel
+        status = outbox.get_status(self.conn, outbox_id)
+        self.assertEqual([(d['destination'], d['status'], d['attempts']) for d in status['deliveries']],
+                         [(fast, 'delivered', 1), (flaky, 'delivered', 3)])
+        self.assertEqual(status['dead_letters'], [])
+
+    def test_exhausted_and_rejected_deliveries_become_dead_letters(self):
+        failing, gone = f"{self.base}/fail", f"{self.base}/gone"
+        outbox_id, _ = outbox.enqueue(self.conn, {'id': 2}, idempotency_key='order-2', destinations=[failing, gone])
+        self.conn.commit()
+
+        dispatcher = webhooks.WebhookDispatcher([failing, gone])
+        self.deliver_all(dispatcher)
+        dispatcher.close()
+
+        self.assertEqual(sorted(path for path, _ in self.server.keys), ['/fail'] * 3 + ['/gone']) # A 404 is not retried
+        status = outbox.get_status(self.conn, outbox_id)
+        self.assertEqual(status['deliveries'], [])
+        self.assertEqual(sorted((d['destination'], d['attempts']) for d in status['dead_letters']), [(failing, 3), (gone, 1)])
+
+        # A requeued dead letter starts over
+        letter = next(d for d in status['dead_letters'] if d['destination'] == gone)
+        self.assertEqual(outbox.requeue_dead_letter(self.conn, letter['id']), outbox_id)
+        status = outbox.get_status(self.conn, outbox_id)
+        self.assertEqual([(d['destination'], d['status'], d['attempts']) for d in status['deliveries']], [(gone, 'pending', 0)])
+        self.assertEqual(len(status['dead_letters']), 1)
+
+        # Enqueueing the same payload again re-arms the other dead-lettered destination
+        self.assertEqual(outbox.enqueue(self.conn, {'id': 2}, idempotency_key='order-2', destinations=[failing, gone]),
+                         (outbox_id, True))
+        self.assertEqual(outbox.enqueue(self.conn, {'id': 2}, idempotency_key='order-2', destinations=[failing, gone]),
+                         (outbox_id, False))
+        status = outbox.get_status(self.conn, outbox_id)
+        self.assertEqual(sorted((d['destination'], d['status']) for d in status['deliveries']),
+                         [(failing, 'pending'), (gone, 'pending')])
+
+    def test_export_goes_in_numbered_parts_with_a_manifest(self):
+        self.conn.executemany("INSERT INTO journalists (name, Email) VALUES (?, ?)",
+                              [(f"Journalist {i}", f"j{i}@example.com") for i in range(7)])
+        self.conn.executemany("INSERT INTO media_titles (name) VALUES (?)", [(f"Title {i}",) for i in range(3)])
+        self.conn.commit()
+        fast = f"{self.base}/fast"
+
+        export = webhook_export.queue_export(self.conn, chunk_rows=3, destinations=[fast])
+        dispatcher = webhooks.WebhookDispatcher([fast])
+        self.deliver_all(dispatcher)
+        dispatcher.close()
+
+        self.assertEqual((export['parts'], export['queued'], export['rows']), (4, True, {'journalists': 7, 'media_titles': 3}))
+        parts = sorted((body for _, _, body in self.server.received), key=lambda body: body['manifest']['index'])
+        self.assertEqual([(p['manifest']['index'], p['manifest']['total'], p['manifest']['table'], p['manifest']['rows'])
+                          for p in parts],
+                         [(1, 4, 'journalists', 3), (2, 4, 'journalists', 3), (3, 4, 'journalists', 1), (4, 4, 'media_titles', 3)])
+        for part in parts:
+            rows = part[part['manifest']['table']]
+            digest = hashlib.sha256(json.dumps(rows, separators=(',', ':')).encode('utf-8')).hexdigest()
+            self.assertEqual(part['manifest']['checksum'], f"sha256:{digest}")
+        self.assertEqual([row['name'] for part in parts[:3] for row in part['journalists']],
+                         [f"Journalist {i}" for i in range(7)])
+
+        # Sending the same data again is a new export; repeating its export_id queues nothing new
+        again = webhook_export.queue_export(self.conn, chunk_rows=3, destinations=[fast])
+        self.assertTrue(again['queued'])
+        self.assertTrue(set(again['outbox_ids']).isdisjoint(export['outbox_ids']))
+        repeat = webhook_export.queue_export(self.conn, chunk_rows=3, export_id=again['export_id'], destinations=[fast])
+        self.assertEqual((repeat['queued'], repeat['outbox_ids']), (False, again['outbox_ids']))
+
+        # The snapshot is read outside the pool, so an export never waits for a free pooled connection
+        pool = database.get_pool()
+        held = [pool.acquire() for _ in range(pool.max_size - 1)]
+        self.addCleanup(lambda: [conn.close() for conn in held])
+        self.assertEqual(self.conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        with mock.patch.object(pool, 'timeout', 0.1):
+            self.assertTrue(webhook_export.queue_export(self.conn, chunk_rows=3, destinations=[fast])['queued'])
+
+    def test_tombstones_are_kept_only_for_a_sync(self):
+        fast = f"{self.base}/fast"
+        tombstones = lambda: self.conn.execute("SELECT COUNT(*) FROM contact_tombstones").fetchone()[0]
+        self.conn.executemany("INSERT INTO journalists (name) VALUES (?)", [(f"Journalist {i}",) for i in range(4)])
+        self.conn.execute("DELETE FROM journalists WHERE id = 1")
+        self.assertEqual(tombstones(), 0) # No destination has sync state
+
+        self.conn.execute("INSERT INTO webhook_sync_state (destination) VALUES (?)", (fast,))
+        self.conn.execute("DELETE FROM journalists WHERE id IN (2, 3)")
+        webhook_sync.prune_tombstones(self.conn, [fast])
+        self.assertEqual(tombstones(), 2) # Not acknowledged yet
+        webhook_sync.prune_tombstones(self.conn, [f"{self.base}/other"])
+        self.assertEqual(tombstones(), 0) # No configured destination needs them
+        self.conn.commit()
+
+    def test_sync_sends_only_changes_since_the_acknowledged_watermark(self):
+        self.conn.executemany("INSERT INTO journalists (name, Email) VALUES (?, ?)",
+                              [(f"Journalist {i}", f"j{i}@example.com") for i in range(5)])
+        self.conn.execute("UPDATE journalists SET updated_at = '2020-01-01 00:00:0' || id")
+        self.conn.commit()
+        fast = f"{self.base}/fast"
+        dispatcher = webhooks.WebhookDispatcher([fast], profiles={fast: webhooks.COMPACT})
+        self.addCleanup(dispatcher.close)
+        sent_rows = []
+
+        def sync():
+            self.server.received.clear()
+            summary = webhook_sync.queue_sync(self.conn, fast, chunk_rows=2)
+            self.deliver_all(dispatcher)
+            parts = sorted((body for _, _, body in self.server.received), key=lambda body: body['manifest']['index'])
+            sent_rows[:] = [row for p in parts for row in p[p['manifest']['table']]]
+            return summary, [(p['manifest']['table'], row.get('name', row['id']))
+                             for p in parts for row in p[p['manifest']['table']]]
+
+        with mock.patch.object(database, 'WEBHOOK_URLS', [fast]), mock.patch.object(webhook_sync, 'SYNC_SETTLE_SECONDS', 0):
+            summary, sent = sync() # The first sync sends everything
+            self.assertEqual((summary['previous_sync'], summary['parts'], summary['watermark']), (None, 3, '2020-01-01 00:00:05'))
+            self.assertEqual(sent, [('journalists', f"Journalist {i}") for i in range(5)])
+            self.assertNotIn('City', sent_rows[0]) # New to the receiver: empty fields can be left out
+
+            self.conn.execute("UPDATE journalists SET City = 'Leeds', Email = '' WHERE name = 'Journalist 1'")
+            self.conn.execute("DELETE FROM journalists WHERE name = 'Journalist 3'")
+            self.conn.commit()
+            summary, sent = sync()
+            self.assertEqual((summary['previous_sync'], summary['since'], summary['changes']),
+                             ('acknowledged', '2020-01-01 00:00:05', {'journalists': 1, 'media_titles': 0, 'deleted': 1}))
+            self.assertEqual(sent, [('journalists', 'Journalist 1'), ('deleted', 4)])
+            # A changed row keeps its empty fields, or the receiver would not see Email cleared
+            self.assertEqual((sent_rows[0]['City'], sent_rows[0]['Email'], sent_rows[0]['ShadowEmail']), ('Leeds', '', None))
+
+            summary, sent = sync() # Nothing changed since
+            self.assertEqual((summary['queued'], sent), (False, []))
+            self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM contact_tombstones").fetchone()[0], 0) # Acknowledged
+
+            # A sync still being delivered holds back the next one
+            self.conn.execute("UPDATE journalists SET City = 'York', updated_at = datetime('now', '+1 minute') "
+                              "WHERE name = 'Journalist 2'")
+            self.conn.commit()
+            webhook_sync.queue_sync(self.conn, fast)
+            self.assertEqual(webhook_sync.queue_sync(self.conn, fast)['previous_sync'], 'in_flight')
+            self.assertEqual(webhook_sync.get_states(self.conn, [fast])[0]['in_flight'], True)
+
+    def test_send_endpoints_answer_once_queued(self):
+        from user import User
+        user = User(username='testuser', is_admin=True)
+        user.set_password('password')
+        user.save()
+        client = app.test_client()
+        client.post('/login', data=dict(username='testuser', password='password'))
+        self.conn.execute("INSERT INTO journalists (name, Email, outletName) VALUES ('Ann', 'ann@example.com', 'Daily')")
+        self.conn.commit()
+        outreach = {'target_table': 'journalists', 'outlet_names': ['Daily'],
+                    'staff_members': [{'staff_name': 'Sam', 'staff_email': 'sam@example.com'}]}
+
+        with mock.patch.object(database, 'WEBHOOK_URLS', [f"{self.base}/slow"]):
+            started = time.monotonic()
+            response = client.post('/api/webhook/send_targeted_outreach', json=outreach)
+            self.assertLess(time.monotonic() - started, self.server.delay) # Did not wait for the post
+            self.assertEqual(response.status_code, 202)
+            body = response.get_json()
+            self.assertTrue(body['queued'])
+            self.assertEqual(body['sent_contacts_count'], 1)
+            # Without an Idempotency-Key a repeated send is a new one; with the same key it is not
+            again = client.post('/api/webhook/send_targeted_outreach', json=outreach).get_json()
+            self.assertNotEqual(again['outbox_id'], body['outbox_id'])
+            self.assertTrue(again['queued'])
+            keyed = [client.post('/api/webhook/send_targeted_outreach', json=outreach,
+                                 headers={'Idempotency-Key': 'outreach-1'}).get_json() for _ in range(2)]
+            self.assertEqual([(r['outbox_id'], r['queued']) for r in keyed],
+                             [(keyed[0]['outbox_id'], True), (keyed[0]['outbox_id'], False)])
+
+            for _ in range(100):
+                status = client.get(body['status_url']).get_json()
+                if status['deliveries'][0]['status'] == 'delivered':
+                    break
+                time.sleep(0.05)
+            for _ in range(100): # Let the worker finish before the database goes
+                if outbox._worker is None:
+                    break
+                time.sleep(0.05)
+
+        self.assertEqual(status['deliveries'][0]['attempts'], 1)
+        self.assertEqual([body['outreach_contacts'][0]['name'] for _, _, body in self.server.received], ['Ann'] * 3)
+        self.assertEqual(client.get('/api/webhook/outbox/999').status_code, 404)
+        self.assertEqual(client.post('/api/webhook/send_all?chunk_size=-1').status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Paged, sorted and filtered reads of one upload's contacts for /api/upload/<upload_id>.
+
+An upload's rows are found through the (upload_id) index of each contact table
+(migration 11), which keeps them in id order: the default page is a short index
+range scan however large the upload. The rows show the id and the columns a CSV
+can be mapped onto, not the derived or bookkeeping ones; any of those may be sorted
+on or filtered by substring. Free text narrows through contacts_fts.
+"""
+import importer
+from migrations import CONTACT_FTS_TABLES
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def upload_tables(conn, upload_id):
+    """The contact tables holding rows of the upload, normally just the one it was imported into."""
+    return [table for table in CONTACT_FTS_TABLES
+            if conn.execute(f"SELECT 1 FROM {table} WHERE upload_id = ? LIMIT 1", (upload_id,)).fetchone()]
+
+def page_columns(conn, table):
+    """The columns a page of table's rows shows, sorts on and filters by: id and the mappable ones."""
+    return ['id', *importer.mappable_columns(conn, table)]
+
+def escape_like(text):
+    """text with the LIKE wildcards and the escape character escaped for ESCAPE '\\'."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def parse_filters(values, allowed):
+    """
+    [(column, text)] from "column:text" strings, dropping those with no text. Raises
+    ValueError for a malformed one or a column not in allowed.
+    """
+    filters = []
+    for value in values:
+        column, sep, text = value.partition(':')
+        if not sep or column not in allowed:
+            raise ValueError(f"Invalid filter: {value!r}")
+        if text.strip():
+            filters.append((column, text.strip()))
+    return filters
+
+def rows_sql(tables, columns, upload_id, filters=(), match=None):
+    """
+    Returns (sql, params) selecting columns plus contact_table for the upload's rows in
+    tables, narrowed by (column, text) substring filters and an FTS match expression.
+    """
+    selects, params = [], []
+    for table in tables:
+        conditions = ["upload_id = ?"]
+        params.append(upload_id)
+        for column, text in filters:
+            # LIKE ignores ASCII case
+            conditions.append(f"{column} LIKE ? ESCAPE '\\'")
+            params.append(f"%{escape_like(text)}%")
+        if match is not None:
+            conditions.append(f"id IN (SELECT rowid >> 1 FROM contacts_fts "
+                              f"WHERE contacts_fts MATCH ? AND rowid & 1 = {CONTACT_FTS_TABLES[table]})")
+            params.append(match)
+        selects.append(f"SELECT {', '.join(columns)}, '{table}' AS contact_table FROM {table} "
+                       f"WHERE {' AND '.join(conditions)}")
+    return "\nUNION ALL\n".join(selects), params
+
+def read_page(conn, tables, columns, upload_id, filters=(), match=None, sort='id', descending=False,
+              offset=0, limit=PAGE_SIZE):
+    """
+    One page of {column: value} for the upload's matching rows, in sort order (text
+    ignoring case) and then table and id order, which breaks ties the same way on every page.
+    """
+    selected = list(dict.fromkeys(['id', *columns, sort]))
+    sql, params = rows_sql(tables, selected, upload_id, filters, match)
+    direction = 'DESC' if descending else 'ASC'
+    order = [] if sort == 'id' else [f"{sort} COLLATE NOCASE {direction}"]
+    if len(tables) > 1:
+        order.append(f"contact_table {direction}")
+    order.append(f"id {direction}")
+    rows = conn.execute(f"SELECT * FROM ({sql}) ORDER BY {', '.join(order)} LIMIT ? OFFSET ?",
+                        params + [limit, offset])
+    return [{col: row[col] for col in columns} for row in rows]
+
+def count_rows(conn, tables, upload_id, filters=(), match=None):
+    """Number of the upload's rows passing the filters and match."""
+    sql, params = rows_sql(tables, ['id'], upload_id, filters, match)
+    return conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
@@ -0,0 +1,103 @@
+"""
+Chunked export of the contact tables for /api/webhook/send_all.
+
+The rows are read in id order in keyset batches (table_data.row_batches) inside one
+read snapshot, so the part count taken at the start stays exact. Each batch is
+serialized on its own and stored in the outbox as a numbered part:
+
+    {"manifest": {"export_id": ..., "table": "journalists", "index": 3, "total": 12,
+                  "rows": 500, "checksum": "sha256:..."},
+     "journalists": [{...}, ...]}
+
+index counts from 1 across both tables, total is the number of parts in the export,
+and checksum is the SHA-256 of the rows array as compact JSON (JSON.stringify
+output), so a receiver can tell when it has every part intact. Only one batch is
+in memory at a time. Parts are committed as they are written and scheduled for
+delivery together at the end.
+"""
+import json
+import os
+import uuid
+from contextlib import contextmanager
+
+import database
+import outbox
+import search
+import table_data
+import webhooks
+
+EXPORT_TABLES = ('journalists', 'media_titles')
+CHUNK_ROWS = int(os.environ.get('WEBHOOK_CHUNK_ROWS', 500)) # Rows per part; 0 sends one payload with every row
+MAX_CHUNK_ROWS = 10000
+
+def encode_part(export_id, table, index, total, rows, **extra):
+    """
+    The JSON body of one part; extra adds fields to its manifest. The rows are encoded
+    once, for the checksum and the body alike.
+    """
+    rows_json, checksum = webhooks.rows_checksum(rows)
+    manifest = {
+        'export_id': export_id, 'table': table, 'index': index, 'total': total, 'rows': len(rows),
+        'checksum': checksum, **extra,
+    }
+    return f'{{"manifest":{json.dumps(manifest)},{json.dumps(table)}:{rows_json}}}'
+
+@contextmanager
+def read_snapshot(conn):
+    """
+    Yields (reader, separate): a connection holding one read snapshot, and whether it
+    is a second connection. Under WAL it is, so conn can commit part by part
+    meanwhile; it is opened outside the pool, so requests that already hold a pooled
+    connection never wait on each other for another. Without WAL that reader would
+    block the commits, so conn itself reads and writes in one transaction.
+    """
+    separate = conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    if conn.in_transaction:
+        conn.commit()
+    reader = database.open_connection() if separate else conn
+    try:
+        reader.execute("BEGIN")
+        yield reader, separate
+    finally:
+        if separate:
+            reader.close()
+
+def store_parts(conn, export_id, total, batches, separate, **extra):
+    """
+    Stores each (table, rows) of batches as a numbered part, committing after each one
+    when separate. Returns the outbox ids. They are sent once schedule()d.
+    """
+    part_ids = []
+    for index, (table, rows) in enumerate(batches, start=1):
+        body = encode_part(export_id, table, index, total, rows, **extra)
+        part_ids.append(outbox.store(conn, body, f"{export_id}:{index}")[0])
+        if separate:
+            conn.commit() # Short write transactions; unscheduled parts are never sent
+    return part_ids
+
+def queue_export(conn, chunk_rows=CHUNK_ROWS, export_id=None, destinations=None):
+    """
+    Stores every row of EXPORT_TABLES, less those of uploads being deleted, in the
+    outbox as parts of at most chunk_rows rows and schedules them. export_id defaults to a new one per call; a repeated export_id
+    (the client's Idempotency-Key) queues nothing new. Commits; returns a summary dict.
+    """
+    with read_snapshot(conn) as (reader, separate):
+        export_id = export_id or f"send_all:{uuid.uuid4().hex}"
+        counts = {table: reader.execute(f"SELECT COUNT(*) FROM {table} WHERE {search.VISIBLE_CONTACT}").fetchone()[0]
+                  for table in EXPORT_TABLES}
+        total = sum(-(-count // chunk_rows) for count in counts.values())
+        columns = {table: table_data.table_columns(reader, table) for table in EXPORT_TABLES}
+        batches = ((table, rows) for table in EXPORT_TABLES
+                   for rows in table_data.row_batches(reader, table, columns[table], batch_size=chunk_rows,
+                                                      where=search.VISIBLE_CONTACT))
+        part_ids = store_parts(conn, export_id, total, batches, separate)
+
+    scheduled = outbox.schedule(conn, part_ids, destinations)
+    conn.commit()
+    return {
+        'export_id': export_id,
+        'parts': total,
+        'queued': scheduled > 0,
+        'outbox_ids': part_ids,
+        'rows': counts,
+    }
@@ -0,0 +1,168 @@
+"""
+Delta sync to the webhooks: each destination gets only the contacts changed since
+the last sync it acknowledged.
+
+Triggers keep journalists/media_titles.updated_at current and, once any destination
+has sync state, log every deleted contact in contact_tombstones (migrations 15, 16). webhook_sync_state holds, per
+destination, two watermarks: an updated_at and a tombstone id. queue_sync() reads,
+in one snapshot, the rows updated after the first and the tombstones after the
+second, and queues them as webhook_export parts for that destination alone:
+changed rows under their table's name, deletions under "deleted". A destination's
+first sync sends every row and no tombstones.
+
+The watermarks only move once every part has been delivered, which the next sync
+checks; if a part ended in the dead letters, it starts again from the old ones.
+updated_at has one-second resolution and is set when a row is written, not when
+its transaction commits, so the updated_at watermark stays SYNC_SETTLE_SECONDS
+behind the sync: rows changed in that window are sent again next time, and
+receivers should upsert by id.
+"""
+import hashlib
+import json
+import os
+
+import database
+import outbox
+import table_data
+import webhook_export
+
+SYNC_TABLES = webhook_export.EXPORT_TABLES
+SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', 60)) # Longer than any write transaction runs
+
+def get_state(conn, destination):
+    return conn.execute("SELECT * FROM webhook_sync_state WHERE destination = ?", (destination,)).fetchone()
+
+def settle_pending(conn, destination):
+    """
+    Moves the watermarks forward if the destination's last sync has been delivered in
+    full, or drops that sync if part of it was given up on. Does not commit. Returns
+    None (nothing in flight), 'acknowledged', 'in_flight' or 'failed'.
+    """
+    state = get_state(conn, destination)
+    if state is None or state['pending_outbox_ids'] is None:
+        return None
+    part_ids = json.loads(state['pending_outbox_ids'])
+    delivered, waiting = conn.execute(
+        "SELECT COUNT(delivered_at), COUNT(*) - COUNT(delivered_at) FROM webhook_deliveries "
+        "WHERE destination = ? AND outbox_id IN (SELECT value FROM json_each(?))",
+        (destination, state['pending_outbox_ids'])
+    ).fetchone()
+    if delivered == len(part_ids):
+        conn.execute('''
+            UPDATE webhook_sync_state SET updated_watermark = pending_updated_watermark,
+                tombstone_watermark = pending_tombstone_watermark, acknowledged_at = CURRENT_TIMESTAMP,
+                pending_outbox_ids = NULL, pending_updated_watermark = NULL, pending_tombstone_watermark = NULL
+            WHERE destination = ?
+        ''', (destination,))
+        return 'acknowledged'
+    if waiting:
+        return 'in_flight'
+    conn.execute("UPDATE webhook_sync_state SET pending_outbox_ids = NULL, pending_updated_watermark = NULL, "
+                 "pending_tombstone_watermark = NULL WHERE destination = ?", (destination,))
+    return 'failed'
+
+def changed_batches(reader, table, columns, since, batch_size):
+    """Yields lists of {column: value} for the rows with updated_at after `since` (all rows if None), in (updated_at, id) order."""
+    select = ', '.join(dict.fromkeys(['id', 'updated_at', *columns]))
+    rows = reader.execute(f"SELECT {select} FROM {table} WHERE updated_at > ? ORDER BY updated_at, id LIMIT ?",
+                          (since or '', batch_size)).fetchall()
+    while rows:
+        yield [{col: row[col] for col in columns} for row in rows]
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+        rows = reader.execute(
+            f"SELECT {select} FROM {table} WHERE (updated_at, id) > (?, ?) ORDER BY updated_at, id LIMIT ?",
+            (last['updated_at'], last['id'], batch_size)).fetchall()
+
+def tombstone_batches(reader, after, batch_size):
+    """Yields lists of deleted contacts ({table, id, upload_id, deleted_at}) logged after tombstone id `after`."""
+    while True:
+        rows = reader.execute(
+            "SELECT id, contact_table, contact_id, upload_id, deleted_at FROM contact_tombstones "
+            "WHERE id > ? ORDER BY id LIMIT ?", (after, batch_size)).fetchall()
+        if rows:
+            yield [{'table': row['contact_table'], 'id': row['contact_id'], 'upload_id': row['upload_id'],
+                    'deleted_at': row['deleted_at']} for row in rows]
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]['id']
+
+def prune_tombstones(conn, destinations):
+    """
+    Deletes the tombstones every destination that has synced has acknowledged, or all
+    of them if none of destinations has synced. Does not commit.
+    """
+    conn.execute('''
+        DELETE FROM contact_tombstones WHERE id <= IFNULL(
+            (SELECT MIN(tombstone_watermark) FROM webhook_sync_state WHERE destination IN (SELECT value FROM json_each(?))),
+            (SELECT MAX(id) FROM contact_tombstones))
+    ''', (json.dumps(list(destinations)),))
+
+def queue_sync(conn, destination, chunk_rows=webhook_export.CHUNK_ROWS):
+    """
+    Queues the changes since the destination's acknowledged watermarks, unless its
+    previous sync is still being delivered. Commits; returns a summary dict.
+    """
+    outcome = settle_pending(conn, destination)
+    prune_tombstones(conn, database.WEBHOOK_URLS)
+    conn.execute("INSERT INTO webhook_sync_state (destination) VALUES (?) ON CONFLICT DO NOTHING", (destination,))
+    conn.commit()
+    state = get_state(conn, destination)
+    summary = {'destination': destination, 'previous_sync': outcome, 'since': state['updated_watermark']}
+    if outcome == 'in_flight':
+        return {**summary, 'queued': False, 'parts': 0}
+
+    since, tombstones_after = state['updated_watermark'], state['tombstone_watermark']
+    with webhook_export.read_snapshot(conn) as (reader, separate):
+        settled = reader.execute("SELECT datetime('now', ?)", (f"-{SYNC_SETTLE_SECONDS} seconds",)).fetchone()[0]
+        counts = {table: reader.execute(f"SELECT COUNT(*) FROM {table} WHERE updated_at > ?", (since or '',)).fetchone()[0]
+                  for table in SYNC_TABLES}
+        latest = max((reader.execute(f"SELECT MAX(updated_at) FROM {table}").fetchone()[0] or '' for table in SYNC_TABLES))
+        last_tombstone = reader.execute("SELECT IFNULL(MAX(id), 0) FROM contact_tombstones").fetchone()[0]
+        if since is None:
+            tombstones_after = last_tombstone # A first sync sends every row, so no deletions
+        counts['deleted'] = reader.execute("SELECT COUNT(*) FROM contact_tombstones WHERE id > ?",
+                                           (tombstones_after,)).fetchone()[0]
+        total = sum(-(-count // chunk_rows) for count in counts.values())
+        watermark = since
+        if any(counts[table] for table in SYNC_TABLES):
+            watermark = max(min(latest, settled), since or '')
+
+        destination_key = hashlib.sha256(destination.encode('utf-8')).hexdigest()[:16]
+        export_id = f"sync:{destination_key}:{since}:{tombstones_after}:{database.get_data_generation(reader)}"
+        columns = {table: table_data.table_columns(reader, table) for table in SYNC_TABLES}
+        batches = [((table, rows) for table in SYNC_TABLES
+                    for rows in changed_batches(reader, table, columns[table], since, chunk_rows)),
+                   (('deleted', rows) for rows in tombstone_batches(reader, tombstones_after, chunk_rows))]
+        part_ids = webhook_export.store_parts(conn, export_id, total, (part for source in batches for part in source),
+                                              separate, since=since, watermark=watermark)
+
+    if part_ids:
+        outbox.schedule(conn, part_ids, [destination])
+        conn.execute(
+            "UPDATE webhook_sync_state SET pending_outbox_ids = ?, pending_updated_watermark = ?, "
+            "pending_tombstone_watermark = ? WHERE destination = ?",
+            (json.dumps(part_ids), watermark, last_tombstone, destination))
+    else:
+        # Nothing to acknowledge; a first sync of empty tables still skips the deletions before it
+        conn.execute("UPDATE webhook_sync_state SET tombstone_watermark = ?, acknowledged_at = CURRENT_TIMESTAMP "
+                     "WHERE destination = ?", (last_tombstone, destination))
+    conn.commit()
+    return {**summary, 'queued': bool(part_ids), 'parts': total, 'watermark': watermark, 'changes': counts,
+            'outbox_ids': part_ids}
+
+def get_states(conn, destinations):
+    """Sync state per destination as JSON-ready dicts, with None for those never synced."""
+    rows = {row['destination']: row for row in conn.execute("SELECT * FROM webhook_sync_state")}
+    states = []
+    for destination in destinations:
+        row = rows.get(destination)
+        states.append({
+            'destination': destination,
+            'updated_watermark': row['updated_watermark'] if row else None,
+            'tombstone_watermark': row['tombstone_watermark'] if row else None,
+            'acknowledged_at': row['acknowledged_at'] if row else None,
+            'in_flight': bool(row and row['pending_outbox_ids']),
+        })
+    return states
@@ -0,0 +1,161 @@
+"""
+Webhook delivery: posts JSON payloads to every configured destination at once.
+
+A WebhookDispatcher keeps one requests.Session per destination URL, so repeated
+posts reuse kept-alive connections instead of opening a new TLS connection each
+time. send() posts a payload to all destinations in parallel on a shared thread
+pool and returns one DeliveryResult per destination. Each destination has its own
+timeout, so a slow one no longer holds up the others.
+
+Each destination also has a PayloadProfile, applied to the encoded body as it is
+posted: contact rows can be cut down to a column projection and lose their null
+and empty fields, and the body can be sent with Content-Encoding: gzip. A chunked
+part's manifest checksum is recomputed over the rows as sent.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = 10 # Seconds, for destinations without their own
+WEBHOOK_WORKERS = 8 # Posts in flight at once, over all destinations
+
+GZIP_LEVEL = 6
+
+# ok is True for a 2xx response; error describes a failure, None on success
+DeliveryResult = namedtuple('DeliveryResult', 'url ok status_code elapsed error')
+
+# columns: the contact fields to keep (None for all; id is always kept). omit_empty drops
+# null and '' fields from contact rows, except in delta sync parts (a manifest "since"):
+# those rows update records the receiver already has, where a missing field would keep
+# its old value. gzip compresses the body.
+PayloadProfile = namedtuple('PayloadProfile', 'columns omit_empty gzip')
+FULL = PayloadProfile(columns=None, omit_empty=False, gzip=False) # The body exactly as queued
+COMPACT = PayloadProfile(columns=None, omit_empty=True, gzip=True)
+
+CONTACT_KEYS = ('journalists', 'media_titles', 'outreach_contacts') # Payload keys holding lists of contact rows
+
+def rows_checksum(rows):
+    """The manifest checksum of a part's rows: SHA-256 of their compact JSON, as JSON.stringify writes it."""
+    rows_json = json.dumps(rows, separators=(',', ':'), ensure_ascii=False)
+    return rows_json, 'sha256:' + hashlib.sha256(rows_json.encode('utf-8')).hexdigest()
+
+def shape_row(row, profile):
+    if profile.columns is not None:
+        row = {col: value for col, value in row.items() if col == 'id' or col in profile.columns}
+    if profile.omit_empty:
+        row = {col: value for col, value in row.items() if value is not None and value != ''}
+    return row
+
+def apply_profile(profile, body):
+    """Returns (data, headers): an encoded JSON payload as this profile sends it."""
+    if profile == FULL:
+        return body, {}
+    if profile.columns is not None or profile.omit_empty:
+        payload = json.loads(body)
+        manifest = payload.get('manifest')
+        if isinstance(manifest, dict) and manifest.get('since') is not None:
+            profile = profile._replace(omit_empty=False) # Keep cleared fields in a delta sync
+        for key in CONTACT_KEYS:
+            if isinstance(payload.get(key), list):
+                payload[key] = [shape_row(row, profile) for row in payload[key]]
+        if isinstance(manifest, dict) and manifest.get('table') in CONTACT_KEYS:
+            manifest['checksum'] = rows_checksum(payload[manifest['table']])[1]
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+    data = body.encode('utf-8')
+    if profile.gzip:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL), {'Content-Encoding': 'gzip'}
+    return data, {}
+
+class WebhookDispatcher:
+    def __init__(self, destinations, timeouts=None, max_workers=WEBHOOK_WORKERS, profiles=None):
+        """
+        destinations: the webhook URLs; timeouts: {url: seconds} for those not using
+        DEFAULT_TIMEOUT; profiles: {url: PayloadProfile} for those not using FULL.
+        """
+        self.destinations = list(destinations)
+        self.timeouts = {url: (timeouts or {}).get(url, DEFAULT_TIMEOUT) for url in self.destinations}
+        self.profiles = {url: (profiles or {}).get(url, FULL) for url in self.destinations}
+        self.max_workers = max_workers
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhook')
+
+    def session(self, url):
+        """The pooled session for a destination, created on first use."""
+        with self._lock:
+            session = self._sessions.get(url)
+            if session is None:
+                session = requests.Session()
+                # Enough pooled connections for every worker to post to this destination at once
+                session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+                session.headers['Content-Type'] = 'application/json'
+                self._sessions[url] = session
+            return session
+
+    def post(self, url, body, headers=None):
+        """Posts an encoded JSON body to one destination. Never raises; the outcome is in the result."""
+        data, profile_headers = apply_profile(self.profiles.get(url, FULL), body)
+        headers = {**profile_headers, **(headers or {})} or None
+        started = time.perf_counter()
+        try:
+            response = self.session(url).post(url, data=data, headers=headers,
+                                              timeout=self.timeouts.get(url, DEFAULT_TIMEOUT))
+            response.raise_for_status() # Raises an HTTPError for bad responses (4XX or 5XX)
+            return DeliveryResult(url, True, response.status_code, time.perf_counter() - started, None)
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if e.response is not None else None
+            return DeliveryResult(url, False, status_code, time.perf_counter() - started, str(e) or type(e).__name__)
+
+    def send(self, payload):
+        """Posts payload to every destination in parallel; returns their DeliveryResults in destination order."""
+        return self.send_each([payload])[0]
+
+    def send_each(self, payloads):
+        """Posts each payload to every destination, all in parallel; returns a list of results per payload."""
+        bodies = [json.dumps(payload) for payload in payloads]
+        results = iter(self.post_all([(url, body, None) for body in bodies for url in self.destinations]))
+        return [[next(results) for _ in self.destinations] for _ in bodies]
+
+    def post_all(self, posts):
+        """Runs post(url, body, headers) for each tuple in posts, all in parallel; returns the results in order."""
+        futures = [self._executor.submit(self.post, url, body, headers) for url, body, headers in posts]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher(destinations, timeouts=None, profiles=None):
+    """The shared dispatcher for these destinations, timeouts and profiles, replaced (and closed) when they change."""
+    global _dispatcher
+    destinations, timeouts, profiles = list(destinations), dict(timeouts or {}), dict(profiles or {})
+    with _dispatcher_lock:
+        if (_dispatcher is None or _dispatcher.destinations != destinations
+                or _dispatcher.timeouts != {url: timeouts.get(url, DEFAULT_TIMEOUT) for url in destinations}
+                or _dispatcher.profiles != {url: profiles.get(url, FULL) for url in destinations}):
+            if _dispatcher is not None:
+                _dispatcher.close()
+            _dispatcher = WebhookDispatcher(destinations, timeouts, profiles=profiles)
+        return _dispatcher
+
+def report(results):
+    """Prints one line per destination and returns the number of successful deliveries."""
+    for result in results:
+        if result.ok:
+            print(f"Data successfully sent to webhook: {result.url}. Status: {result.status_code} ({result.elapsed:.2f}s)")
+        else:
+            print(f"Error sending data to webhook {result.url}: {result.error}")
+    return sum(result.ok for result in results)